@@ -0,0 +1,144 @@
+"""Análise das questões a partir do registro de respostas (answer_log): dificuldade e discriminação.
+
+Tudo é calculado sobre as colunas inteiras (NumPy/pandas), sem laço por
+evento: as somas por questão, assunto ou mestre saem de np.bincount.
+
+- acerto: fração de respostas certas (índice de dificuldade clássico);
+- discriminação: correlação ponto-bisserial entre acertar a questão e o
+  aproveitamento do usuário nas demais respostas dele. Perto de zero, a
+  questão não separa quem sabe de quem não sabe; negativa, os melhores
+  erram mais que os outros (gabarito suspeito).
+
+Por padrão só a primeira resposta de cada usuário a cada questão entra:
+refazer erradas e a revisão inteligente repetem justamente as difíceis.
+
+Uso fora do app (SQLite local):
+    python analytics.py [arena.db] [questoes.db] [saida.csv|saida.parquet]
+"""
+import io
+import sys
+
+import numpy as np
+import pandas as pd
+
+import answer_log
+
+try:
+    import pyarrow  # noqa: F401 (motor do DataFrame.to_parquet)
+    PARQUET_INSTALLED = True
+except ImportError:
+    PARQUET_INSTALLED = False
+
+MIN_RESPOSTAS = 20  # abaixo disso a questão não recebe alerta
+LEVELS = {"questao": ["qid"], "assunto": ["master", "materia", "assunto"], "mestre": ["master"]}
+LEVEL_NAMES = {"questao": "Questão", "assunto": "Assunto", "mestre": "Mestre"}
+
+def events_frame(blobs):
+    """DataFrame (login, qid, correto, ts) com todos os eventos dos blocos."""
+    logins, columns = answer_log.read_blocks(blobs)
+    return pd.DataFrame({
+        "login": pd.Categorical.from_codes(columns["usuario"].astype("int64"), categories=pd.Index(logins, dtype=object)),
+        "qid": columns["qid"],
+        "correto": columns["correto"].astype(bool),
+        "ts": columns["ts"],
+    })
+
+def first_attempts(events):
+    """Só a primeira resposta de cada usuário a cada questão."""
+    order = np.argsort(events["ts"].to_numpy(), kind="stable")
+    ordered = events.iloc[order]
+    return ordered[~ordered.duplicated(["login", "qid"])].reset_index(drop=True)
+
+def rest_score(events):
+    """Aproveitamento do usuário nas outras respostas dele, por evento (NaN se ele só tem essa)."""
+    users = events["login"].cat.codes.to_numpy()
+    correct = events["correto"].to_numpy(dtype="float64")
+    n = np.bincount(users, minlength=len(events["login"].cat.categories))[users]
+    hits = np.bincount(users, weights=correct, minlength=len(events["login"].cat.categories))[users]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(n > 1, (hits - correct) / (n - 1), np.nan)
+
+def _grouped(codes, n_groups, correct, ability):
+    """Respostas, acertos e correlação ponto-bisserial por grupo, em somas vetorizadas."""
+    respostas = np.bincount(codes, minlength=n_groups)
+    acertos = np.bincount(codes, weights=correct, minlength=n_groups)
+    valid = ~np.isnan(ability)
+    c, x, y = codes[valid], correct[valid], ability[valid]
+    n = np.bincount(c, minlength=n_groups).astype("float64")
+    sx, sy = np.bincount(c, weights=x, minlength=n_groups), np.bincount(c, weights=y, minlength=n_groups)
+    sxy, syy = np.bincount(c, weights=x * y, minlength=n_groups), np.bincount(c, weights=y * y, minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mx, my = sx / n, sy / n
+        cov = sxy / n - mx * my
+        var_x, var_y = mx - mx * mx, syy / n - my * my  # x é 0/1: soma de x² = soma de x
+        r = cov / np.sqrt(var_x * var_y)
+    r[~np.isfinite(r)] = np.nan
+    return respostas, acertos, r
+
+def item_stats(events, catalog, level="questao", first_only=True):
+    """Estatísticas por questão, assunto ou mestre (ver LEVELS).
+
+    catalog = QuestionBank.catalog(); eventos de questões que saíram do banco
+    entram só no nível de questão.
+    """
+    if first_only: events = first_attempts(events)
+    questions = pd.DataFrame(catalog).rename(columns={"id": "qid"})
+    qids = events["qid"].to_numpy()
+    correct = events["correto"].to_numpy(dtype="float64")
+    ability = rest_score(events)
+    if level == "questao":
+        codes, uniques = pd.factorize(qids)
+        groups = pd.DataFrame({"qid": uniques})
+    else:
+        # Grupos numerados no catálogo (pequeno) e levados aos eventos por busca binária no id
+        group_codes = questions.groupby(LEVELS[level], sort=False).ngroup().to_numpy()
+        groups = questions[LEVELS[level]].drop_duplicates(ignore_index=True)
+        order = np.argsort(questions["qid"].to_numpy())
+        ids = questions["qid"].to_numpy()[order]
+        pos = np.minimum(np.searchsorted(ids, qids), max(len(ids) - 1, 0))
+        known = ids[pos] == qids if len(ids) else np.zeros(len(qids), dtype=bool)
+        codes, correct, ability = group_codes[order][pos][known], correct[known], ability[known]
+    respostas, acertos, r = _grouped(np.asarray(codes, dtype="int64"), len(groups), correct, ability)
+    table = groups.assign(respostas=respostas, acertos=acertos.astype("int64"),
+                          acerto=np.divide(acertos, respostas, out=np.zeros(len(respostas)), where=respostas > 0),
+                          discriminacao=r)
+    if level == "questao":
+        table = table.merge(questions, on="qid", how="left")
+        table["alerta"] = np.select(
+            [table["respostas"] < MIN_RESPOSTAS, table["discriminacao"] < 0, table["acerto"] >= 0.9,
+             table["acerto"] <= 0.2, table["discriminacao"] < 0.1],
+            ["", "gabarito suspeito", "fácil demais", "difícil demais", "pouco discriminativa"], default="")
+    return table.sort_values("respostas", ascending=False, kind="stable").reset_index(drop=True)
+
+def overview(events):
+    users = events["login"].cat.codes.to_numpy()
+    return {
+        "eventos": len(events),
+        "usuarios": int(np.unique(users).size),
+        "questoes": int(events["qid"].nunique()),
+        "acerto": float(events["correto"].mean()) if len(events) else 0.0,
+    }
+
+def to_csv(df):
+    return df.to_csv(index=False).encode("utf-8")
+
+def to_parquet(df):
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+if __name__ == "__main__":
+    import question_bank
+    import storage
+    args = sys.argv[1:]
+    arena_db = args[0] if args else storage.SQLITE_PATH
+    bank_db = args[1] if len(args) > 1 else question_bank.QUESTOES_DB
+    events = events_frame(storage.SQLiteStorage(arena_db).load_answers())
+    table = item_stats(events, question_bank.QuestionBank(bank_db).catalog())
+    print(overview(events))
+    if len(args) > 2:
+        with open(args[2], "wb") as f:
+            f.write(to_parquet(table) if args[2].endswith(".parquet") else to_csv(table))
+        print(f"{len(table)} questões exportadas para {args[2]}")
+    else:
+        print(table[table["alerta"] != ""].head(30).to_string(index=False))
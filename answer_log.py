@@ -0,0 +1,65 @@
+"""Registro das respostas do Doctore: um evento (usuário, questão, acerto, instante) por resposta.
+
+O registro só cresce: cada flush da fila de gravação acrescenta um ou mais
+blocos colunares (colunas binárias de tamanho fixo, comprimidas e em base64,
+como a agenda do review.py). Os logins de um bloco ficam num dicionário no
+cabeçalho e a coluna guarda só o índice. A leitura devolve as colunas direto
+como arrays NumPy, sem montar um objeto por evento.
+"""
+import base64
+import struct
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+FORMAT_VERSION = 1
+HEADER = "<BII"  # versão, número de eventos, tamanho do dicionário de logins
+# 1000 eventos = 21 KB antes da compressão: um bloco sempre cabe numa célula do Sheets
+BLOCK_EVENTS = 1000
+LAYOUT = (("usuario", "<u4"), ("qid", "<i8"), ("correto", "u1"), ("ts", "<i8"))
+
+Event = namedtuple("Event", ["login", "qid", "correct", "ts"])
+
+def pack(events):
+    """Um bloco com os eventos dados (no máximo BLOCK_EVENTS)."""
+    logins = sorted({e.login for e in events})
+    index = {login: i for i, login in enumerate(logins)}
+    names = "\n".join(logins).encode("utf-8")
+    columns = [np.array([index[e.login] for e in events], dtype=LAYOUT[0][1]),
+               np.array([e.qid for e in events], dtype=LAYOUT[1][1]),
+               np.array([bool(e.correct) for e in events], dtype=LAYOUT[2][1]),
+               np.array([e.ts for e in events], dtype=LAYOUT[3][1])]
+    raw = struct.pack(HEADER, FORMAT_VERSION, len(events), len(names)) + names + b"".join(c.tobytes() for c in columns)
+    return base64.b64encode(zlib.compress(raw, 6)).decode("ascii")
+
+def pack_blocks(events):
+    return [pack(events[i:i + BLOCK_EVENTS]) for i in range(0, len(events), BLOCK_EVENTS)]
+
+def unpack(blob):
+    """(logins, {coluna: array}) de um bloco; "usuario" indexa a lista de logins."""
+    raw = zlib.decompress(base64.b64decode(blob))
+    version, n, size = struct.unpack_from(HEADER, raw)
+    if version != FORMAT_VERSION: raise ValueError(f"Formato de bloco de respostas desconhecido: {version}")
+    offset = struct.calcsize(HEADER)
+    logins = raw[offset:offset + size].decode("utf-8").split("\n") if size else []
+    offset += size
+    columns = {}
+    for name, dtype in LAYOUT:
+        columns[name] = np.frombuffer(raw, dtype=dtype, count=n, offset=offset)
+        offset += columns[name].nbytes
+    return logins, columns
+
+def read_blocks(blobs):
+    """Junta os blocos em (logins, {coluna: array}), com os índices de usuário já globais."""
+    logins, index, parts = [], {}, []
+    for blob in blobs:
+        names, columns = unpack(blob)
+        for name in names:
+            if name not in index:
+                index[name] = len(logins)
+                logins.append(name)
+        remap = np.array([index[name] for name in names], dtype=LAYOUT[0][1])
+        parts.append(dict(columns, usuario=remap[columns["usuario"]] if len(remap) else columns["usuario"]))
+    if not parts: return logins, {name: np.empty(0, dtype=dtype) for name, dtype in LAYOUT}
+    return logins, {name: np.concatenate([p[name] for p in parts]) for name, _ in LAYOUT}
@@ -1,24 +1,43 @@
 import streamlit as st
 import pandas as pd
-import json
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 import random
 import os
 import base64
-import re
+import threading
+import atexit
+import hashlib
+import copy
+from collections import OrderedDict, deque
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+import analytics
+import answer_log
+import history
+import question_bank
+import ranking
+import review
+import shared_cache
+import storage
+from metrics import METRICS
+from storage import (
+    new_arena_data, hash_password, verify_password,
+    daily_delta, merge_delta, apply_delta, history_row, row_to_activity, history_matches, to_columns
+)
 
 # -----------------------------------------------------------------------------
-# 0. IMPORTAÇÃO SEGURA DAS LIBS DO GOOGLE
+# 0. IMPORTAÇÃO SEGURA DAS LIBS OPCIONAIS
 # -----------------------------------------------------------------------------
+# As libs do Google são importadas (com a mesma proteção) em storage.py
+
+# Pillow é opcional: sem ele as imagens são servidas no tamanho original
 try:
-    import gspread
-    from google.oauth2.service_account import Credentials
-    LIBS_INSTALLED = True
-    IMPORT_ERROR = ""
-except ImportError as e:
-    LIBS_INSTALLED = False
-    IMPORT_ERROR = str(e)
+    from PIL import Image
+    PIL_INSTALLED = True
+except ImportError:
+    PIL_INSTALLED = False
 
 st.set_page_config(
     page_title="Arena SpartaJus",
@@ -30,8 +49,15 @@ st.set_page_config(
 # -----------------------------------------------------------------------------
 # 1. CONSTANTES E ARQUIVOS
 # -----------------------------------------------------------------------------
-SHEET_NAME = "SpartaJus_DB"
-QUESTOES_FILE = "questoes.json"
+HISTORY_PAGE_SIZE = storage.HISTORY_PAGE_SIZE
+QUESTOES_FILE = question_bank.QUESTOES_FILE
+QUESTOES_DB = question_bank.QUESTOES_DB
+REVIEW_SESSION_SIZE = 20
+RANKING_TOP = 10
+HISTORY_TYPES = ["Batalha"]  # tipos de atividade que o app registra (filtro da aba Histórico)
+# ARENA_LOGIN_PREFETCH=0 volta ao login serial (para comparar o tempo até a primeira tela)
+LOGIN_PREFETCH = os.environ.get("ARENA_LOGIN_PREFETCH", "1") != "0"
+LOGIN_WORKERS = 4
 
 # Arquivos de Imagem
 HERO_IMG_FILE = "Arena_Spartajus_Logo_3.jpg"
@@ -39,8 +65,15 @@ USER_AVATAR_FILE = "fux_concurseiro.png"
 PREPARE_SE_FILE = "prepare-se.jpg"
 LOGO_SPARTAJUS = "logo_spartajus.jpg"  # Nova logo migrada
 
-# ÁUDIO PLACEHOLDER (Para quando o arquivo oficial não existir)
-AUDIO_PLACEHOLDER = "https://www.soundhelix.com/examples/mp3/SoundHelix-Song-1.mp3"
+# Variantes redimensionadas (geradas na primeira utilização, servidas pelo static serving)
+ASSETS_DIR = os.path.join("static", "assets")
+ASSETS_URL = "app/static/assets"
+ASSET_WIDTH = 800
+HERO_WIDTH = 1600
+
+# ÁUDIO PLACEHOLDER (Para quando o arquivo oficial não existir): local, nenhuma tela depende de host externo
+AUDIO_PLACEHOLDER = "audios/silencio.wav"
+AUDIO_MIME = {".m4a": "audio/mp4", ".mp3": "audio/mpeg", ".wav": "audio/wav"}
 
 # MAPA DE ESPECIALIDADES
 SPECIALTIES_MAP = {
@@ -65,6 +98,7 @@ AUDIO_MAP = {
 # -----------------------------------------------------------------------------
 # 2. FUNÇÕES VISUAIS & UTILITÁRIOS
 # -----------------------------------------------------------------------------
+@METRICS.timed()
 def get_base64_of_bin_file(bin_file):
     try:
         with open(bin_file, 'rb') as f:
@@ -73,13 +107,91 @@ def get_base64_of_bin_file(bin_file):
     except Exception:
         return None
 
+@METRICS.timed()
+def build_display_asset(img_path, max_width=ASSET_WIDTH):
+    """Gera a variante para exibição (WebP reduzido), com o hash do conteúdo no nome."""
+    with open(img_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    stem, ext = os.path.splitext(os.path.basename(img_path))
+    out_name = f"{stem}-{digest}-{max_width}.webp" if PIL_INSTALLED else f"{stem}-{digest}{ext}"
+    out_path = os.path.join(ASSETS_DIR, out_name)
+    if not os.path.exists(out_path):
+        os.makedirs(ASSETS_DIR, exist_ok=True)
+        tmp_path = f"{out_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if PIL_INSTALLED:
+            with Image.open(img_path) as img:
+                img = img.convert("RGBA" if "A" in img.getbands() or img.mode == "P" else "RGB")
+                img.thumbnail((max_width, max_width * 4))
+                img.save(tmp_path, format="WEBP", quality=80, method=4)
+        else:
+            with open(img_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                dst.write(src.read())
+        os.replace(tmp_path, out_path)  # atômico: outros processos nunca veem arquivo pela metade
+    return out_path
+
+@st.cache_data(show_spinner=False)
+def get_asset_src(img_path, max_width=ASSET_WIDTH):
+    """URL curta da variante em cache; sem static serving, cai para data URI da variante pequena."""
+    if not os.path.exists(img_path): return img_path
+    try:
+        asset_path = build_display_asset(img_path, max_width)
+    except Exception as e:
+        print(f"Erro ao preparar imagem {img_path}: {e}")
+        asset_path = img_path
+    if st.get_option("server.enableStaticServing") and asset_path.startswith(ASSETS_DIR):
+        return f"{ASSETS_URL}/{os.path.basename(asset_path)}"
+    ext = asset_path.split('.')[-1]
+    b64 = get_base64_of_bin_file(asset_path)
+    return f"data:image/{ext};base64,{b64}" if b64 else img_path
+
+@METRICS.timed()
+def build_audio_asset(audio_path):
+    """Cópia do áudio em static/assets com o hash do conteúdo no nome (o navegador pode cachear para sempre)."""
+    with open(audio_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    stem, ext = os.path.splitext(os.path.basename(audio_path))
+    out_path = os.path.join(ASSETS_DIR, f"{stem}-{digest}{ext}")
+    if not os.path.exists(out_path):
+        os.makedirs(ASSETS_DIR, exist_ok=True)
+        tmp_path = f"{out_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(audio_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            dst.write(src.read())
+        os.replace(tmp_path, out_path)
+    return out_path
+
+@st.cache_data(show_spinner=False)
+def get_audio_src(audio_path):
+    """URL do áudio no static serving (que atende Range: o navegador toca por partes); None se indisponível."""
+    if not st.get_option("server.enableStaticServing"): return None
+    try:
+        return f"{ASSETS_URL}/{os.path.basename(build_audio_asset(audio_path))}"
+    except Exception as e:
+        print(f"Erro ao preparar áudio {audio_path}: {e}")
+        return None
+
+@st.cache_resource(show_spinner=False)
+def read_audio(audio_path, mtime):
+    # Sem static serving: os bytes ficam na memória do processo e o media file manager
+    # reaproveita o arquivo já registrado (o id é o hash do conteúdo)
+    with open(audio_path, 'rb') as f:
+        return f.read()
+
+def render_audio(audio_path):
+    """PLAYER HÍBRIDO: URL externa direto; arquivo local pelo static serving, baixado só ao tocar."""
+    if not audio_path: return
+    if audio_path.startswith('http'):
+        st.audio(audio_path)
+        return
+    if not os.path.exists(audio_path): return
+    mime_type = AUDIO_MIME.get(os.path.splitext(audio_path)[1].lower(), 'audio/mpeg')
+    src = get_audio_src(audio_path)
+    if src:
+        st.markdown(f'<audio controls preload="none" style="width:100%;"><source src="{src}" type="{mime_type}"></audio>', unsafe_allow_html=True)
+    else:
+        st.audio(read_audio(audio_path, os.path.getmtime(audio_path)), format=mime_type)
+
 def render_centered_image(img_path, width=None):
-    src = img_path
-    if os.path.exists(img_path):
-        ext = img_path.split('.')[-1]
-        b64 = get_base64_of_bin_file(img_path)
-        if b64:
-            src = f"data:image/{ext};base64,{b64}"
+    src = get_asset_src(img_path) if img_path else img_path
     
     if width:
         style_attr = f"width: {width}px;"
@@ -95,25 +207,18 @@ def render_centered_image(img_path, width=None):
 def render_red_header(text):
     st.markdown(f"<h3 style='color: #9E0000 !important; font-weight: 700; margin-top: 5px; margin-bottom: 5px;'>{text}</h3>", unsafe_allow_html=True)
 
-def calculate_daily_stats(history, target_date):
-    stats = {"total": 0, "acertos": 0, "erros": 0}
-    target_str = target_date.strftime("%d/%m/%Y")
-    for activity in history:
-        try:
-            act_date_str = activity.get('data', '').split(' ')[0]
-            if act_date_str == target_str:
-                result_str = activity.get('resultado', '')
-                match = re.search(r'(\d+)/(\d+)', result_str)
-                if match:
-                    acertos = int(match.group(1))
-                    total = int(match.group(2))
-                    erros = max(0, total - acertos)
-                    stats['total'] += total
-                    stats['acertos'] += acertos
-                    stats['erros'] += erros
-        except:
-            continue
-    return stats
+def render_global_stats(slot, stats):
+    """Desenha os contadores globais dentro de um st.empty (o fragmento do Doctore redesenha só ele)."""
+    with slot.container():
+        c1, c2 = st.columns(2)
+        c1.markdown(f"""<div class='stat-box'><div class='stat-value' style='color:#006400'>{stats['total_acertos']}</div><div class='stat-label'>Acertos</div></div>""", unsafe_allow_html=True)
+        c2.markdown(f"""<div class='stat-box'><div class='stat-value' style='color:#8B0000'>{stats['total_erros']}</div><div class='stat-label'>Erros</div></div>""", unsafe_allow_html=True)
+        
+        st.markdown(f"""<div class='stat-box'><div class='stat-value'>{stats['total_questoes']}</div><div class='stat-label'>Total de Questões</div></div>""", unsafe_allow_html=True)
+
+@METRICS.timed()
+def get_daily_stats(arena_data, target_date):
+    return arena_data.get("stats_diarios", {}).get(target_date.isoformat(), {"total": 0, "acertos": 0, "erros": 0})
 
 # ESTILIZAÇÃO GERAL
 st.markdown("""
@@ -186,6 +291,7 @@ st.markdown("""
         margin-left: auto !important; margin-right: auto !important;
         text-align: left !important; font-size: 22px !important; color: #2e2c2b !important;
     }
+    .doctore-meta { font-size: 14px; font-weight: 600; color: #8B7D6B; margin-bottom: 16px; }
     
     /* Stats */
     .stat-box { background-color: #FFFFFF; border: 1px solid #E3DFD3; border-radius: 6px; padding: 12px; text-align: center; margin-bottom: 10px; }
@@ -198,12 +304,6 @@ st.markdown("""
 # -----------------------------------------------------------------------------
 # 3. CONFIGURAÇÃO DE DADOS & OPONENTES
 # -----------------------------------------------------------------------------
-DEFAULT_ARENA_DATA = {
-    "stats": {"total_questoes": 0, "total_acertos": 0, "total_erros": 0},
-    "progresso_arena": {"fase_maxima_desbloqueada": 1, "fases_vencidas": []},
-    "historico_atividades": []
-}
-
 DEFAULT_DOCTORE_DB = {
     "praetorium": {"nome": "Praetorium Lex", "especialidades": "Constitucional, Administrativo, Penal e Processo Penal", "imagem": "praetorium.jpg", "audio": "audios/praetorium.m4a", "materias": {}}
 }
@@ -285,91 +385,539 @@ OPONENTS_DB = [
 # -----------------------------------------------------------------------------
 # 4. CARGA DE DADOS DOCTORE
 # -----------------------------------------------------------------------------
+@st.cache_resource
+def get_bank_watcher():
+    """Vigia o questoes.json: compila na primeira vez e, quando o conteúdo muda, regrava só os assuntos alterados."""
+    try:
+        return question_bank.BankWatcher(QUESTOES_FILE, QUESTOES_DB)
+    except Exception as e:
+        print(f"Erro ao compilar {QUESTOES_FILE}: {e}")
+        question_bank.build_bank(DEFAULT_DOCTORE_DB, QUESTOES_DB)
+        return question_bank.BankWatcher(QUESTOES_FILE, QUESTOES_DB)
+
+def get_question_bank():
+    bank, reloaded = get_bank_watcher().current()
+    if reloaded:
+        # Só os caches derivados do banco: sessões e registros de usuários ficam intactos
+        for cached in (load_doctore_data, load_materias, load_assuntos, load_master_ids, search_questions, get_question): cached.clear()
+    return bank
+
 @st.cache_data
+@METRICS.timed()
 def load_doctore_data():
-    """Carrega JSON e injeta especialidades e áudio."""
-    data = DEFAULT_DOCTORE_DB
-    if os.path.exists(QUESTOES_FILE):
-        try:
-            with open(QUESTOES_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except Exception:
-            pass
-            
+    """Carrega os mestres (sem as questões) e injeta especialidades e áudio."""
+    data = get_question_bank().masters()
     for key, master_info in data.items():
         if key in SPECIALTIES_MAP:
-            data[key]['especialidades'] = SPECIALTIES_MAP[key]
+            master_info['especialidades'] = SPECIALTIES_MAP[key]
             
         if key in AUDIO_MAP:
-            data[key]['audio'] = AUDIO_MAP[key]
+            master_info['audio'] = AUDIO_MAP[key]
         else:
-            data[key]['audio'] = None
+            master_info['audio'] = None
         
         nome_atual = master_info.get('nome', '')
         if "Praetorium" in nome_atual or key == "praetorium":
-            data[key]['nome'] = "Praetorium Lex"
+            master_info['nome'] = "Praetorium Lex"
         elif "Sara" in nome_atual or key == "sara" or key == "sara_oracula":
-            data[key]['nome'] = "Sara Orácula"
+            master_info['nome'] = "Sara Orácula"
         elif "Primus" in nome_atual or key == "primus" or key == "primus_revisao":
-            data[key]['nome'] = "Primus Savage"
+            master_info['nome'] = "Primus Savage"
             
     return data
 
+@st.cache_data
+def load_materias(master_key):
+    return get_question_bank().materias(master_key)
+
+@st.cache_data
+def load_assuntos(master_key, materia):
+    return get_question_bank().assuntos(master_key, materia)
+
+@st.cache_data
+def load_master_ids(master_key):
+    return get_question_bank().master_ids(master_key)
+
+@st.cache_data(max_entries=256)
+@METRICS.timed()
+def search_questions(master_key, query):
+    """Busca textual (índice FTS5 do banco compilado) nas questões do mestre."""
+    return get_question_bank().search(query, master_key)
+
+@st.cache_resource(max_entries=2000)
+def get_question(qid):
+    """Questões quentes compartilhadas pelas sessões (não alterar o dict retornado).
+
+    O resto fica no banco compilado, mapeado em memória e compartilhado entre os processos.
+    """
+    return get_question_bank().question(qid)
+
 DOCTORE_DB = load_doctore_data()
 
 # -----------------------------------------------------------------------------
 # 5. SISTEMA DE LOGIN E BANCO DE DADOS
 # -----------------------------------------------------------------------------
-def get_gsheets_client():
-    if not LIBS_INSTALLED: return None
-    if "gcp_service_account" not in st.secrets: return None
-    scope = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-    creds_dict = dict(st.secrets["gcp_service_account"])
-    credentials = Credentials.from_service_account_info(creds_dict, scopes=scope)
-    return gspread.authorize(credentials)
+def _secret(key, default=None):
+    try:
+        return st.secrets[key] if key in st.secrets else default
+    except Exception:  # sem secrets.toml
+        return default
+
+@st.cache_resource
+def get_storage():
+    """Backend do processo (ver _create_storage), atrás do cache compartilhado se ARENA_CACHE/shared_cache estiver definido."""
+    store = _create_storage()
+    cache = shared_cache.create_cache(os.environ.get("ARENA_CACHE") or _secret("shared_cache"))
+    return storage.CachedStorage(store, cache) if store and cache else store
+
+def _create_storage():
+    """ARENA_STORAGE (env) ou st.secrets["storage_backend"]; padrão "sheets"."""
+    backend = os.environ.get("ARENA_STORAGE") or _secret("storage_backend", "sheets")
+    if backend == "sqlite":
+        path = os.environ.get("ARENA_SQLITE_PATH") or _secret("sqlite_path", storage.SQLITE_PATH)
+        return storage.create_storage("sqlite", sqlite_path=path)
+    if backend in storage.BACKENDS: return storage.create_storage(backend)
+    creds = _secret("gcp_service_account")
+    quota = (int(_secret("sheets_reads_per_minute", storage.READS_PER_MINUTE)),
+             int(_secret("sheets_writes_per_minute", storage.WRITES_PER_MINUTE)))
+    return storage.create_storage("sheets", dict(creds) if creds else None, quota=quota)
+
+class LoginIndex:
+    """Índice Login -> (key, registro) dos usuários, com TTL e trava por tentativas.
 
+    A leitura do backend (lista completa ou um login) roda fora do lock: uma
+    consulta lenta não segura os outros logins. Logins fora do índice custam
+    uma busca ao backend, limitada por login (MISS_INTERVAL) e no processo
+    todo (MISS_BUDGET por MISS_WINDOW), para tentativas com nomes aleatórios
+    não esgotarem a cota de leitura compartilhada.
+    """
+    TTL = 300
+    MISS_INTERVAL = 30
+    MISS_BUDGET = 30
+    MISS_WINDOW = 60
+    MAX_ATTEMPTS = 5
+    LOCK_WINDOW = 300
+    MAX_TRACKED = 10000
+    THROTTLED = object()
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = {}
+        self._built_at = 0.0
+        self._building = False
+        self._miss_lookups = OrderedDict()
+        self._miss_times = deque()
+        self._failures = OrderedDict()
+
+    def _remember(self, table, login, value):
+        # LRU por login: acima de MAX_TRACKED sai o menos recente
+        table[login] = value
+        table.move_to_end(login)
+        while len(table) > self.MAX_TRACKED: table.popitem(last=False)
+
+    def _allow_miss(self, login, now):
+        """Com o lock: a busca do login fora do índice cabe nos limites (e já é contada)?"""
+        last = self._miss_lookups.get(login)
+        if last is not None and now - last < self.MISS_INTERVAL: return False
+        while self._miss_times and now - self._miss_times[0] >= self.MISS_WINDOW: self._miss_times.popleft()
+        if len(self._miss_times) >= self.MISS_BUDGET: return False
+        self._miss_times.append(now)
+        self._remember(self._miss_lookups, login, now)
+        return True
+
+    def _build(self, store):
+        try:
+            records = {}
+            for key, record in store.list_users():
+                login = str(record.get('Login', '')).strip()
+                if login: records[login] = (key, record)
+        except Exception:
+            with self._lock: self._building = False
+            raise
+        with self._lock:
+            self._records = records
+            self._built_at = time.time()
+            self._building = False
+            self._miss_lookups.clear()
+
+    def lookup(self, store, login):
+        """(key, registro); None se o login não existe; THROTTLED se a busca dele passou dos limites."""
+        with self._lock:
+            now = time.time()
+            rebuild = now - self._built_at > self.TTL and not self._building
+            if rebuild: self._building = True
+            elif login in self._records: return self._records[login]
+            elif not self._allow_miss(login, now): return self.THROTTLED
+        if rebuild:
+            self._build(store)
+            with self._lock: return self._records.get(login)
+        # Usuário novo (ou índice sendo refeito por outra thread): busca só o registro dele
+        found = store.find_user(login)
+        if found:
+            with self._lock: self._records[login] = found
+        return found
+
+    def may_exist(self, login):
+        """Sem I/O: o login pode ter registro? Com o índice vencido não dá para saber (True)."""
+        with self._lock:
+            return time.time() - self._built_at > self.TTL or login in self._records
+
+    def update(self, login, field, value):
+        with self._lock:
+            if login in self._records: self._records[login][1][field] = value
+
+    def invalidate(self, login=None):
+        with self._lock:
+            if login is None: self._built_at = 0.0
+            else: self._records.pop(login, None)
+
+    def locked_for(self, login):
+        """Segundos restantes de bloqueio para o login (0 = liberado)."""
+        with self._lock:
+            now = time.time()
+            attempts = [t for t in self._failures.get(login, []) if now - t < self.LOCK_WINDOW]
+            if attempts: self._failures[login] = attempts
+            else: self._failures.pop(login, None)
+            if len(attempts) < self.MAX_ATTEMPTS: return 0
+            return int(self.LOCK_WINDOW - (now - attempts[0])) + 1
+
+    def register_failure(self, login):
+        with self._lock:
+            attempts = self._failures.get(login, []) + [time.time()]
+            self._remember(self._failures, login, attempts[-self.MAX_ATTEMPTS:])
+
+    def clear_failures(self, login):
+        with self._lock:
+            self._failures.pop(login, None)
+
+@st.cache_resource
+def get_login_index():
+    return LoginIndex()
+
+@METRICS.timed()
 def check_login(username, password):
-    client = get_gsheets_client()
-    if not client: return False, "Erro de Biblioteca (ver logs)"
+    store = get_storage()
+    if not store: return False, "Erro de Biblioteca (ver logs)"
+    index = get_login_index()
+    wait = index.locked_for(username)
+    if wait: return False, f"Muitas tentativas. Tente novamente em {wait} s."
     try:
-        sheet = client.open(SHEET_NAME).worksheet("Usuarios")
-        records = sheet.get_all_records()
-        for record in records:
-            if str(record.get('Login', '')).strip() == username and str(record.get('Senha', '')).strip() == password:
+        found = index.lookup(store, username)
+        if found is LoginIndex.THROTTLED:
+            # Busca não feita: não conta como tentativa errada, mas a resposta é a mesma
+            # de senha errada (não revela se o login existe)
+            return False, "Usuário ou senha incorretos."
+        if found:
+            key, record = found
+            stored = str(record.get('Senha', '')).strip()
+            if verify_password(password, stored):
+                index.clear_failures(username)
+                if not storage.is_hashed(stored):
+                    new_hash = hash_password(password)
+                    try:
+                        store.update_password(key, new_hash)
+                        index.update(username, 'Senha', new_hash)
+                    except Exception as e:
+                        print(f"Erro ao converter senha para hash: {e}")
                 return True, record.get('Nome', 'Gladiador')
+        index.register_failure(username)
         return False, "Usuário ou senha incorretos."
     except Exception as e:
+        index.invalidate()
         return False, f"Erro ao acessar base de usuários: {str(e)}"
 
+@METRICS.timed()
 def load_user_data(username):
-    client = get_gsheets_client()
-    if not client: return DEFAULT_ARENA_DATA.copy(), None, "Erro libs"
+    store = get_storage()
+    if not store: return new_arena_data(), None, "Erro libs"
     try:
-        sheet = client.open(SHEET_NAME).sheet1
-        cell = sheet.find(username, in_column=1)
-        if cell:
-            raw_data = sheet.cell(cell.row, 3).value 
-            if not raw_data: return DEFAULT_ARENA_DATA.copy(), cell.row, "Novo Registro"
-            try:
-                data = json.loads(raw_data)
-                return data, cell.row, "Dados Carregados"
-            except:
-                return DEFAULT_ARENA_DATA.copy(), cell.row, "Erro no JSON"
-        else:
-            new_row = [username, "", json.dumps(DEFAULT_ARENA_DATA)]
-            sheet.append_row(new_row)
-            return DEFAULT_ARENA_DATA.copy(), len(sheet.get_all_values()), "Novo Usuário Criado"
+        return store.load_profile(username)
     except Exception as e:
-        return DEFAULT_ARENA_DATA.copy(), None, f"Erro Sheets: {str(e)}"
+        return new_arena_data(), None, f"Erro ao carregar dados: {str(e)}"
+
+@st.cache_resource
+def get_login_pool():
+    """Threads do login: o registro lido junto com as credenciais e o aquecimento da próxima tela."""
+    return ThreadPoolExecutor(max_workers=LOGIN_WORKERS, thread_name_prefix="arena-login")
+
+def _prefetch_profile(store, username):
+    # Só leitura: a senha ainda não foi conferida (nada é criado nem migrado aqui)
+    with METRICS.span("login.registro_antecipado"):
+        try:
+            return store.load_profile(username, create=False)
+        except Exception as e:
+            print(f"Erro ao antecipar dados de {username}: {e}")
+            return None
+
+def start_login(username, password):
+    """check_login com o registro da arena lido em paralelo; devolve (sucesso, nome ou erro, perfil).
+
+    perfil é (dados, key, status) como em load_user_data, ou None quando não
+    houve leitura antecipada ou ela precisaria gravar: aí o main carrega como antes.
+    """
+    store = get_storage()
+    index = get_login_index()
+    prefetch = None
+    if LOGIN_PREFETCH and store and not index.locked_for(username) and index.may_exist(username):
+        prefetch = get_login_pool().submit(_prefetch_profile, store, username)
+    success, result = check_login(username, password)
+    if not success or prefetch is None: return success, result, None
+    profile = prefetch.result()
+    return success, result, profile if profile and profile[1] is not None else None
 
-def save_data(row_idx, full_data):
-    client = get_gsheets_client()
-    if client and row_idx:
+def warm_up(store, bank, username):
+    """Prepara em segundo plano a próxima tela provável, o Doctore; devolve os cartões de revisão (None se falhar).
+
+    Imagens e áudios dos mestres vão para static/assets e o banco lê as matérias
+    do mestre da última questão respondida (páginas já no cache do SQLite).
+    """
+    with METRICS.span("login.aquecimento"):
+        for master in DOCTORE_DB.values():
+            try:
+                if master.get('imagem') and os.path.exists(master['imagem']): build_display_asset(master['imagem'])
+                if (master.get('audio') and os.path.exists(master['audio'])
+                        and st.get_option("server.enableStaticServing")): build_audio_asset(master['audio'])
+            except Exception as e:
+                print(f"Erro ao aquecer mídia de {master.get('nome')}: {e}")
+        cards = None
+        try:
+            cards = review.unpack(store.load_reviews(username))
+        except Exception as e:
+            print(f"Erro ao antecipar agenda de revisão: {e}")
         try:
-            sheet = client.open(SHEET_NAME).sheet1
-            sheet.update_cell(row_idx, 3, json.dumps(full_data))
+            last = max(cards, key=lambda qid: cards[qid].seen) if cards else None
+            master_key = (bank.master_of(last) if last is not None else None) or next(iter(DOCTORE_DB), None)
+            if master_key:
+                for materia in bank.materias(master_key): bank.assuntos(master_key, materia)
+                bank.master_ids(master_key)
         except Exception as e:
-            print(f"Erro ao salvar: {e}")
+            print(f"Erro ao aquecer o banco de questões: {e}")
+        return cards
+
+def record_activity(username, activity):
+    """Registra uma atividade como linha nova do histórico; devolve o delta do agregado diário."""
+    if get_storage():
+        get_write_queue().append(username, history_row(username, activity))
+    return daily_delta(activity)
+
+@METRICS.timed()
+def load_history_frame(username, inicio=None, fim=None, tipo=None, detalhe=None):
+    """Histórico filtrado (mais novo primeiro) como DataFrame tipado, já com as linhas ainda na fila."""
+    store = get_storage()
+    if not store: return history.to_frame(to_columns([]))
+    pending = [row_to_activity(row) for row in get_write_queue().pending_history(username)][::-1]
+    pending = to_columns([a for a in pending if history_matches(a, inicio, fim, tipo, detalhe)])
+    try:
+        stored = store.history_columns(username, inicio, fim, tipo, detalhe)
+    except Exception as e:
+        print(f"Erro ao ler histórico: {e}")
+        stored = {}
+    return history.to_frame(history.merge_columns(pending, stored))
+
+@METRICS.timed()
+def load_ranking_rows():
+    """[(login, nome, resumo)] para o índice do ranking: os resumos e a lista de usuários, nada dos registros."""
+    store = get_storage()
+    names = {str(record.get('Login', '')).strip(): record.get('Nome') for _, record in store.list_users()}
+    return [(login, names.get(login) or login, summary) for login, summary in store.ranking_summaries().items()]
+
+@st.cache_resource
+def get_leaderboard():
+    return ranking.Leaderboard(load_ranking_rows)
+
+@METRICS.timed()
+def load_review_schedule(username, warmed=None):
+    """Agenda de revisão (SM-2) do usuário, já com as respostas ainda na fila de gravação.
+
+    warmed é o futuro do warm_up do login: se ele já leu os cartões, não há nova leitura.
+    """
+    cards = {}
+    store = get_storage()
+    if store:
+        cards = warmed.result() if warmed is not None else None
+        if cards is None:
+            try:
+                cards = review.unpack(store.load_reviews(username))
+            except Exception as e:
+                # A gravação soma com o que estiver no backend: nada se perde se a leitura falhar
+                print(f"Erro ao carregar agenda de revisão: {e}")
+                cards = {}
+        review.merge(cards, get_write_queue().pending_reviews(username))
+    return review.ReviewSchedule(cards)
+
+def get_review_schedule():
+    if 'revisoes' not in st.session_state:
+        st.session_state['revisoes'] = load_review_schedule(st.session_state['user_id'],
+                                                            st.session_state.pop('revisoes_aquecidas', None))
+    return st.session_state['revisoes']
+
+class WriteBehindQueue:
+    """Grava em segundo plano: os deltas acumulados de cada registro, as novas linhas de histórico,
+    os cartões de revisão respondidos e os eventos do registro de respostas.
+
+    Deltas da mesma linha (de uma ou várias abas) são somados na fila; cada flush
+    manda todos numa única chamada a writer({key: delta}), que os soma ao registro
+    gravado (ver apply_deltas de cada backend). Cota e backoff ficam a cargo do backend.
+    Cartões de revisão são juntados por questão (vale a resposta mais recente);
+    os eventos de resposta viram blocos colunares (answer_log), um por flush.
+    O que falhar volta para a fila.
+    """
+    FLUSH_INTERVAL = 5.0
+
+    def __init__(self, writer, appender, review_writer=None, answer_writer=None):
+        self._writer = writer
+        self._appender = appender
+        self._review_writer = review_writer
+        self._answer_writer = answer_writer
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._appends = []
+        self._reviews = {}
+        self._answers = []
+        self._latest = {}
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="arena-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def add_delta(self, row_idx, delta):
+        with self._lock:
+            merge_delta(self._pending.setdefault(row_idx, {}), delta)
+
+    def latest(self, row_idx):
+        """Cópia do registro como ficou no último flush (com os deltas de outras abas), ou None."""
+        with self._lock:
+            data = self._latest.get(row_idx)
+            return copy.deepcopy(data) if data is not None else None
+
+    def append(self, username, row_values):
+        with self._lock:
+            self._appends.append((username, row_values))
+
+    def pending_history(self, username):
+        with self._lock:
+            return [row for user, row in self._appends if user == username]
+
+    def add_reviews(self, username, cards):
+        with self._lock:
+            review.merge(self._reviews.setdefault(username, {}), cards)
+
+    def pending_reviews(self, username):
+        with self._lock:
+            return dict(self._reviews.get(username, {}))
+
+    def add_answer(self, event):
+        with self._lock:
+            self._answers.append(event)
+
+    def pending_count(self, row_idx=None):
+        with self._lock:
+            if row_idx is None: return len(self._pending) + len(self._appends) + len(self._reviews) + len(self._answers)
+            return 1 if row_idx in self._pending else 0
+
+    def request_flush(self):
+        """Acorda o gravador sem bloquear quem chamou."""
+        self._wake.set()
+
+    def flush(self, row_idx=None):
+        """Grava agora (tudo ou só uma linha), bloqueando até terminar."""
+        with self._flush_lock:
+            with self._lock:
+                appends, self._appends = self._appends, []
+                reviews, self._reviews = (self._reviews, {}) if self._review_writer else ({}, self._reviews)
+                answers, self._answers = (self._answers, []) if self._answer_writer else ([], self._answers)
+                if row_idx is None:
+                    batch, self._pending = self._pending, {}
+                else:
+                    batch = {row_idx: self._pending.pop(row_idx)} if row_idx in self._pending else {}
+            # Histórico primeiro: um registro sem o histórico migrado só é gravado depois dele.
+            try:
+                if appends:
+                    with METRICS.span("write_queue.append_history"):
+                        self._appender([row for _, row in appends])
+                    appends = []
+                if batch:
+                    with METRICS.span("write_queue.apply_deltas"):
+                        try:
+                            saved = self._writer(batch)
+                        except storage.PartialWriteError as e:
+                            # Só o que não foi gravado volta para a fila (deltas não são idempotentes)
+                            with self._lock: self._latest.update(e.saved)
+                            batch = {row: delta for row, delta in batch.items() if row not in e.saved}
+                            raise
+                    with self._lock: self._latest.update(saved)
+                    batch = {}
+                if reviews:
+                    with METRICS.span("write_queue.update_reviews"):
+                        self._review_writer(reviews)
+                    reviews = {}
+                if answers:
+                    with METRICS.span("write_queue.append_answers"):
+                        self._answer_writer(answer_log.pack_blocks(answers))
+                    answers = []
+                self.last_error = None
+            except Exception as e:
+                print(f"Erro ao salvar ({len(appends)} linha(s) de histórico, {len(batch)} registro(s), "
+                      f"{len(reviews)} agenda(s) de revisão, {len(answers)} resposta(s)): {e}")
+                self.last_error = str(e)
+                with self._lock:
+                    self._appends[:0] = appends
+                    # Devolve para a fila, somando com o que chegou enquanto isso.
+                    for row, delta in batch.items(): merge_delta(self._pending.setdefault(row, {}), delta)
+                    for user, cards in reviews.items(): review.merge(self._reviews.setdefault(user, {}), cards)
+                    self._answers[:0] = answers
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.FLUSH_INTERVAL)
+            self._wake.clear()
+            self.flush()
+
+@st.cache_resource
+def start_metrics_exporter(path, interval=15):
+    """Regrava o arquivo Prometheus (ARENA_METRICS_FILE) periodicamente, para o coletor textfile."""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                METRICS.write_textfile(path)
+            except OSError as e:
+                print(f"Erro ao exportar métricas: {e}")
+    threading.Thread(target=run, name="arena-metrics", daemon=True).start()
+    return path
+
+@st.cache_resource
+def get_write_queue():
+    store = get_storage()
+    return WriteBehindQueue(store.apply_deltas, store.append_history,
+                            lambda updates: store.update_reviews(updates, review.merge_blob), store.append_answers)
+
+@METRICS.timed()
+def save_delta(row_idx, arena_data, delta):
+    """Aplica o delta na cópia da sessão e o enfileira; o backend soma com o que já está gravado."""
+    apply_delta(arena_data, delta)
+    if get_storage() and row_idx:
+        get_write_queue().add_delta(row_idx, delta)
+
+@METRICS.timed()
+def save_review(username, qid, correct, group):
+    """Reagenda a questão na agenda da sessão e enfileira o cartão novo."""
+    card = get_review_schedule().review(qid, correct, group)
+    if get_storage():
+        get_write_queue().add_reviews(username, {qid: card})
+
+def record_answer(username, qid, correct):
+    """Enfileira o evento da resposta para o registro de respostas (answer_log)."""
+    if get_storage():
+        get_write_queue().add_answer(answer_log.Event(username, qid, correct, int(time.time())))
+
+def flush_saves(row_idx=None, wait=True):
+    if not get_storage(): return
+    queue = get_write_queue()
+    if wait: queue.flush(row_idx)
+    else: queue.request_flush()
 
 # -----------------------------------------------------------------------------
 # 6. TELA DE LOGIN
@@ -378,8 +926,7 @@ def login_screen():
     c1, c2, c3 = st.columns([1, 2, 1])
     with c2:
         if os.path.exists(HERO_IMG_FILE):
-            img_b64 = get_base64_of_bin_file(HERO_IMG_FILE)
-            st.markdown(f'<img src="data:image/jpg;base64,{img_b64}" style="width:100%; border-radius:10px; margin-bottom:20px;">', unsafe_allow_html=True)
+            st.markdown(f'<img src="{get_asset_src(HERO_IMG_FILE, HERO_WIDTH)}" style="width:100%; border-radius:10px; margin-bottom:20px;">', unsafe_allow_html=True)
         
         render_red_header("🛡️ Portão da Arena")
         st.info("Utilize suas credenciais para acessar.")
@@ -393,12 +940,21 @@ def login_screen():
                 if not user or not pwd:
                     st.error("Preencha todos os campos.")
                 else:
+                    st.session_state['login_inicio'] = time.perf_counter()
                     with st.spinner("Validando credenciais..."):
-                        success, result = check_login(user, pwd)
+                        success, result, profile = start_login(user, pwd)
                         if success:
+                            METRICS.set_user(user)
                             st.session_state['logged_in'] = True
                             st.session_state['user_id'] = user
                             st.session_state['user_name'] = result
+                            if profile:
+                                # Registro já lido junto com a senha: o próximo rerun não espera por ele
+                                data, row, status = profile
+                                st.session_state.update({'arena_data': data, 'row_idx': row, 'status': status})
+                            if LOGIN_PREFETCH and get_storage():
+                                st.session_state['revisoes_aquecidas'] = get_login_pool().submit(
+                                    warm_up, get_storage(), get_question_bank(), user)
                             st.rerun()
                         else:
                             st.error(result)
@@ -406,6 +962,295 @@ def login_screen():
 # -----------------------------------------------------------------------------
 # 7. APP PRINCIPAL
 # -----------------------------------------------------------------------------
+@st.fragment
+def doctore_question_fragment(global_stats_slot):
+    """Card da questão, botões e feedback: cada clique reexecuta só este trecho (e os contadores da sidebar)."""
+    with METRICS.rerun(st.session_state.get('user_id'), "fragment"):
+        doctore_question_card(global_stats_slot)
+
+def doctore_question_card(global_stats_slot):
+    arena_data = st.session_state['arena_data']
+    stats = arena_data['stats']
+    ds = st.session_state['doctore_session']
+    if st.session_state.pop('doc_stats_dirty', False):
+        render_global_stats(global_stats_slot, stats)
+
+    q_list = ds['questions']
+    idx = ds['idx']
+
+    # Questões removidas do questoes.json desde o início do treino são puladas
+    while idx < len(q_list) and get_question(q_list[idx]) is None:
+        idx = ds['idx'] = idx + 1
+
+    if idx < len(q_list):
+        q = get_question(q_list[idx])
+        mode_label = {'retry': 'REVISÃO', 'smart': 'REVISÃO INTELIGENTE', 'busca': 'BUSCA'}.get(ds['mode'], 'TREINO')
+        st.markdown(f"**Modo:** {mode_label} | Q {idx+1}/{len(q_list)}")
+        st.progress((idx)/len(q_list))
+
+        # Fragmentos saneados e montados na compilação do banco (question_bank.render_question)
+        st.markdown(q['card_html'], unsafe_allow_html=True)
+
+        if 'doc_revealed' not in st.session_state: st.session_state['doc_revealed'] = False
+
+        if not st.session_state['doc_revealed']:
+            c1, c2 = st.columns(2)
+
+            # Callbacks rodam antes do fragmento ser redesenhado: não é preciso st.rerun()
+            def process_answer(ans):
+                st.session_state['doc_choice'] = ans
+                st.session_state['doc_revealed'] = True
+                is_correct = (ans == q['gabarito'])
+                if not is_correct: ds['wrong_ids'].add(q['id'])
+
+                # Resposta entra também no agregado do dia e na última atividade (ranking por período)
+                delta = {"stats": {"total_questoes": 1, "total_acertos": int(is_correct), "total_erros": int(not is_correct)}}
+                merge_delta(delta, daily_delta({"acertos": int(is_correct), "total": 1, "ts": int(time.time())}))
+                save_delta(st.session_state['row_idx'], arena_data, delta)
+                save_review(st.session_state['user_id'], q['id'], is_correct, st.session_state['selected_master'])
+                record_answer(st.session_state['user_id'], q['id'], is_correct)
+                st.session_state['doc_stats_dirty'] = True
+
+            c1.button("✅ CERTO", use_container_width=True, on_click=process_answer, args=("Certo",))
+            c2.button("❌ ERRADO", use_container_width=True, on_click=process_answer, args=("Errado",))
+
+        else:
+            acertou = (st.session_state['doc_choice'] == q['gabarito'])
+            if acertou: st.success(f"Correto! Gabarito: {q['gabarito']}")
+            else: st.error(f"Errou! Gabarito: {q['gabarito']}")
+
+            if q['feedback_html']: st.markdown(q['feedback_html'], unsafe_allow_html=True)
+
+            def next_question():
+                st.session_state['doc_revealed'] = False
+                ds['idx'] += 1
+
+            st.button("Próxima ➡️", on_click=next_question)
+    else:
+        st.success("Treino Finalizado!")
+        st.write(f"Erros: {len(ds['wrong_ids'])}")
+
+        c1, c2 = st.columns(2)
+        if c1.button("🏠 Novo Treino"):
+            ds['active'] = False
+            st.rerun()
+        def retry_wrong():
+            retry = array('l', [qid for qid in ds['questions'] if qid in ds['wrong_ids']])
+            ds.update({"questions": retry, "wrong_ids": set(), "idx": 0, "mode": "retry"})
+
+        if len(ds['wrong_ids']) > 0: c2.button("🔄 Refazer Erradas", on_click=retry_wrong)
+
+def render_history(username):
+    """Aba Histórico: filtros aplicados no backend, agregados do período e uma página por vez no navegador."""
+    f1, f2, f3 = st.columns([2, 1, 2])
+    periodo = f1.date_input("Período", value=(), format="DD/MM/YYYY", key="hist_periodo")
+    tipo = f2.selectbox("Tipo", ["Todos"] + HISTORY_TYPES, key="hist_tipo")
+    oponente = f3.selectbox("Adversário", ["Todos"] + [o['nome'] for o in OPONENTS_DB], key="hist_oponente")
+
+    inicio = fim = None
+    if len(periodo) > 0: inicio = int(datetime.combine(periodo[0], datetime.min.time()).timestamp())
+    if len(periodo) > 1: fim = int(datetime.combine(periodo[1] + timedelta(days=1), datetime.min.time()).timestamp())
+    filtros = (inicio, fim, None if tipo == "Todos" else tipo, None if oponente == "Todos" else f"vs {oponente}")
+
+    # Um só resultado em memória por sessão: o do filtro atual (descartado quando uma atividade nova é registrada)
+    cached = st.session_state.get('hist_frame')
+    if not cached or cached[0] != filtros:
+        cached = (filtros, load_history_frame(username, *filtros))
+        st.session_state['hist_frame'] = cached
+        st.session_state['hist_page'] = 0
+    df = cached[1]
+    if df.empty:
+        st.info("Sem histórico." if filtros == (None, None, None, None) else "Nenhuma atividade com esses filtros.")
+        return
+
+    with METRICS.span("historico.agregados"):
+        summary = history.summarize(df)
+    m1, m2, m3, m4, m5 = st.columns(5)
+    m1.metric("Atividades", summary['atividades'])
+    m2.metric("Questões", summary['questoes'])
+    m3.metric("Aproveitamento", f"{summary['aproveitamento']:.1%}")
+    m4.metric("Vitórias", summary['vitorias'])
+    m5.metric("Tempo médio", f"{summary['tempo_medio_min']:.0f} min")
+
+    total_pages = (len(df) - 1) // HISTORY_PAGE_SIZE + 1
+    page = min(st.session_state.get('hist_page', 0), total_pages - 1)
+    st.dataframe(df.iloc[page * HISTORY_PAGE_SIZE:(page + 1) * HISTORY_PAGE_SIZE], use_container_width=True, hide_index=True,
+                 column_config={
+                     "quando": st.column_config.DatetimeColumn("Data", format="DD/MM/YYYY HH:mm"),
+                     "tipo": "Tipo", "detalhe": "Detalhe", "resultado": "Resultado",
+                     "acertos": st.column_config.NumberColumn("Acertos"),
+                     "total": st.column_config.NumberColumn("Total"),
+                     "tempo_min": st.column_config.NumberColumn("Tempo", format="%.0f min"),
+                 })
+
+    h_prev, h_info, h_next = st.columns([1, 4, 1])
+    with h_prev:
+        if page > 0:
+            if st.button("⬅️ Mais recentes"): st.session_state['hist_page'] = page - 1; st.rerun()
+    h_info.caption(f"Página {page + 1} de {total_pages} ({summary['atividades']} atividades)")
+    with h_next:
+        if page + 1 < total_pages:
+            if st.button("Mais antigas ➡️"): st.session_state['hist_page'] = page + 1; st.rerun()
+
+def render_ranking(username, user_name, arena_data):
+    """Aba Ranking: top-N e a posição do usuário, servidos pelo índice em memória (refeito a cada TTL)."""
+    if not get_storage():
+        st.info("Ranking indisponível sem conexão com a base.")
+        return
+    r1, r2 = st.columns(2)
+    period = r1.radio("Período", list(ranking.PERIODS), format_func=ranking.PERIODS.get, horizontal=True, key="rank_periodo")
+    criterion = r2.radio("Critério", list(ranking.CRITERIA), format_func=ranking.CRITERIA.get, horizontal=True, key="rank_criterio")
+    try:
+        board = get_leaderboard().board(period, criterion)
+    except Exception as e:
+        st.error(f"Erro ao carregar o ranking: {e}")
+        return
+
+    # A posição usa o registro da sessão, que já inclui o que ainda está na fila de gravação
+    mine = ranking.entry(username, user_name, storage.ranking_summary(arena_data), period)
+    position = board.position(username, mine)
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Sua posição", f"{position[0]}º de {position[1]}" if position else "—")
+    m2.metric("Acertos", mine.acertos)
+    m3.metric("Questões", mine.questoes)
+    m4.metric("Aproveitamento", f"{mine.acertos / mine.questoes:.1%}" if mine.questoes else "—")
+    if not position and criterion == "aproveitamento" and mine.questoes:
+        st.caption(f"O aproveitamento só entra no ranking a partir de {ranking.MIN_QUESTOES} questões no período.")
+
+    top = board.top(RANKING_TOP)
+    if not top:
+        st.info("Ninguém pontuou neste período ainda.")
+        return
+    df = pd.DataFrame([{"posicao": pos, "gladiador": e.nome + (" (você)" if e.login == username else ""),
+                        "acertos": e.acertos, "questoes": e.questoes, "aproveitamento": e.acertos / e.questoes * 100,
+                        "fase": e.fase, "ultima": e.ultima} for pos, e in top])
+    st.dataframe(df, use_container_width=True, hide_index=True,
+                 column_config={
+                     "posicao": st.column_config.NumberColumn("#", format="%dº"),
+                     "gladiador": "Gladiador",
+                     "acertos": st.column_config.NumberColumn("Acertos"),
+                     "questoes": st.column_config.NumberColumn("Questões"),
+                     "aproveitamento": st.column_config.ProgressColumn("Aproveitamento", format="%.1f%%", min_value=0, max_value=100),
+                     "fase": st.column_config.NumberColumn("Fase"),
+                     "ultima": "Última atividade",
+                 })
+    st.caption(f"{len(board)} gladiador(es) no ranking · atualizado a cada {ranking.TTL} s")
+
+def is_admin(username):
+    return username in list(_secret("admin_users", []))
+
+def render_metrics_dashboard():
+    """Painel oculto (?painel=desempenho, só para admin_users): onde o tempo e a cota estão indo."""
+    render_red_header("📈 Painel de Desempenho")
+    b1, b2 = st.columns(2)
+    if b1.button("⬅️ Voltar à Arena"):
+        del st.query_params["painel"]
+        st.rerun()
+    if b2.button("📊 Análise das Questões"):
+        st.query_params["painel"] = "questoes"
+        st.rerun()
+
+    spans = METRICS.span_table()
+    users = METRICS.user_table()
+    reruns = next((s for s in spans if s['span'] == 'rerun'), None)
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("No ar há", f"{(time.time() - METRICS.started_at) / 60:.0f} min")
+    c2.metric("Reruns", reruns['chamadas'] if reruns else 0)
+    c3.metric("p95 do rerun", f"{reruns['p95_ms'] if reruns else 0} ms")
+    c4.metric("Chamadas de API", sum(r['chamadas'] for r in METRICS.api_table()))
+
+    store = get_storage()
+    if store:
+        st.caption(store.report())
+        st.caption(f"Fila de gravação: {get_write_queue().pending_count()} pendência(s)")
+        # Usuários que não gravaram nada desde que o resumo existe ficam fora do ranking até aqui
+        if st.button("🏆 Recalcular ranking"):
+            count = store.rebuild_ranking()
+            get_leaderboard().invalidate()
+            st.success(f"Resumo do ranking recalculado para {count} gladiador(es).")
+
+    st.markdown("**Trechos instrumentados** (ordenados pelo tempo total)")
+    st.dataframe(pd.DataFrame(spans), use_container_width=True, hide_index=True)
+    st.markdown("**Usuários** (ordenados pelas chamadas de API)")
+    st.dataframe(pd.DataFrame(users), use_container_width=True, hide_index=True)
+    st.markdown("**Chamadas de API por método**")
+    st.dataframe(pd.DataFrame(METRICS.api_table()), use_container_width=True, hide_index=True)
+
+    st.markdown("**Reruns mais lentos** (últimos registrados)")
+    slowest = [{"usuario": r['user'], "tipo": r['kind'], "quando": datetime.fromtimestamp(r['ts']).strftime("%d/%m %H:%M:%S"),
+                "ms": round(r['seconds'] * 1000, 1), "chamadas_api": r['api_calls'],
+                "trechos": ", ".join(f"{name} {sec * 1000:.0f}ms" for name, sec in r['spans'])}
+               for r in METRICS.slowest_reruns()]
+    st.dataframe(pd.DataFrame(slowest), use_container_width=True, hide_index=True)
+
+    prom = METRICS.prometheus()
+    st.download_button("⬇️ Exportar (Prometheus)", prom, file_name="arena_metrics.prom", mime="text/plain")
+    with st.expander("Texto Prometheus"):
+        st.code(prom, language="text")
+    if st.button("🧹 Zerar métricas"):
+        METRICS.reset()
+        st.rerun()
+
+@st.cache_resource(ttl=300, show_spinner="Lendo o registro de respostas...")
+def load_answer_events():
+    """Todos os eventos de resposta (DataFrame compartilhado: só leitura)."""
+    flush_saves()
+    return analytics.events_frame(get_storage().load_answers())
+
+@st.cache_data(ttl=300, show_spinner="Calculando as estatísticas...")
+def load_answer_stats():
+    events = load_answer_events()
+    catalog = get_question_bank().catalog()
+    return analytics.overview(events), {level: analytics.item_stats(events, catalog, level) for level in analytics.LEVELS}
+
+def render_answer_analytics():
+    """Painel oculto (?painel=questoes, só para admin_users): dificuldade e discriminação das questões."""
+    render_red_header("📊 Análise das Questões")
+    if st.button("⬅️ Voltar à Arena"):
+        del st.query_params["painel"]
+        st.rerun()
+    if not get_storage():
+        st.info("Análise indisponível sem conexão com a base.")
+        return
+
+    overview, tables = load_answer_stats()
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Respostas", overview['eventos'])
+    c2.metric("Usuários", overview['usuarios'])
+    c3.metric("Questões respondidas", overview['questoes'])
+    c4.metric("Acerto geral", f"{overview['acerto']:.1%}")
+    st.caption(f"Só a primeira resposta de cada usuário a cada questão; alertas a partir de {analytics.MIN_RESPOSTAS} respostas. "
+               "Discriminação negativa: os melhores erram mais que os outros (confira o gabarito).")
+
+    level = st.radio("Nível", list(analytics.LEVELS), format_func=analytics.LEVEL_NAMES.get, horizontal=True, key="an_nivel")
+    df = tables[level]
+    if level == "questao" and st.toggle("Só questões com alerta", key="an_alertas"): df = df[df["alerta"] != ""]
+    st.dataframe(df, use_container_width=True, hide_index=True,
+                 column_config={
+                     "qid": st.column_config.NumberColumn("Questão", format="%d"),
+                     "master": "Mestre", "materia": "Matéria", "assunto": "Assunto", "gabarito": "Gabarito",
+                     "respostas": st.column_config.NumberColumn("Respostas"),
+                     "acertos": st.column_config.NumberColumn("Acertos"),
+                     "acerto": st.column_config.ProgressColumn("Acerto", format="percent", min_value=0, max_value=1),
+                     "discriminacao": st.column_config.NumberColumn("Discriminação", format="%.2f"),
+                     "alerta": "Alerta",
+                 })
+
+    # Arquivos gerados só no clique (callable): o painel não serializa nada a cada rerun
+    e1, e2, e3 = st.columns(3)
+    e1.download_button("⬇️ Tabela (CSV)", lambda: analytics.to_csv(df), file_name=f"analise_{level}.csv", mime="text/csv")
+    if analytics.PARQUET_INSTALLED:
+        e2.download_button("⬇️ Tabela (Parquet)", lambda: analytics.to_parquet(df), file_name=f"analise_{level}.parquet",
+                           mime="application/octet-stream")
+        e3.download_button("⬇️ Todas as respostas (Parquet)", lambda: analytics.to_parquet(load_answer_events()),
+                           file_name="respostas.parquet", mime="application/octet-stream")
+    else:
+        e2.caption("Exportação Parquet indisponível (pyarrow não instalado).")
+    if st.button("🔄 Recalcular agora"):
+        load_answer_events.clear()
+        load_answer_stats.clear()
+        st.rerun()
+
 def main():
     if 'logged_in' not in st.session_state: st.session_state['logged_in'] = False
 
@@ -416,6 +1261,13 @@ def main():
     current_user = st.session_state['user_id']
     user_name = st.session_state['user_name']
 
+    if st.query_params.get("painel") == "desempenho" and is_admin(current_user):
+        render_metrics_dashboard()
+        return
+    if st.query_params.get("painel") == "questoes" and is_admin(current_user):
+        render_answer_analytics()
+        return
+
     if 'arena_data' not in st.session_state:
         with st.spinner(f"Carregando dados de {user_name}..."):
             data, row, status = load_user_data(current_user)
@@ -423,40 +1275,43 @@ def main():
             st.session_state['row_idx'] = row
             st.session_state['status'] = status
 
+    # Outra aba do mesmo usuário gravou depois: adota o registro já somado (se esta não tem nada pendente)
+    if get_storage() and st.session_state.get('row_idx'):
+        queue = get_write_queue()
+        fresh = queue.latest(st.session_state['row_idx'])
+        if (fresh and fresh.get('versao', 0) > st.session_state['arena_data'].get('versao', 0)
+                and not queue.pending_count(st.session_state['row_idx'])):
+            st.session_state['arena_data'] = fresh
+
     arena_data = st.session_state['arena_data']
-    if "stats" not in arena_data: arena_data["stats"] = DEFAULT_ARENA_DATA["stats"].copy()
-    if "progresso_arena" not in arena_data: arena_data["progresso_arena"] = DEFAULT_ARENA_DATA["progresso_arena"].copy()
-    if "historico_atividades" not in arena_data: arena_data["historico_atividades"] = DEFAULT_ARENA_DATA["historico_atividades"].copy()
+    if "stats" not in arena_data: arena_data["stats"] = new_arena_data()["stats"]
+    if "progresso_arena" not in arena_data: arena_data["progresso_arena"] = new_arena_data()["progresso_arena"]
     
     stats = arena_data['stats']
-    hist = arena_data['historico_atividades']
 
     # --- SIDEBAR (IDENTIDADE VISUAL ATUALIZADA) ---
     with st.sidebar:
         # 1. LOGO MIGRADA (ACIMA DO AVATAR)
         if os.path.exists(LOGO_SPARTAJUS):
-            st.image(LOGO_SPARTAJUS, use_container_width=True)
+            st.markdown(f'<img src="{get_asset_src(LOGO_SPARTAJUS)}" style="width:100%;">', unsafe_allow_html=True)
         else:
             st.markdown("<h1 style='color: #9E0000; text-align: center; margin-bottom: 10px;'>🏛️ SpartaJus</h1>", unsafe_allow_html=True)
 
         # 2. AVATAR DO USUÁRIO
         if os.path.exists(USER_AVATAR_FILE):
-            st.image(USER_AVATAR_FILE, use_container_width=True)
+            st.markdown(f'<img src="{get_asset_src(USER_AVATAR_FILE)}" style="width:100%; margin-bottom:10px;">', unsafe_allow_html=True)
         
         render_red_header(f"Olá, {user_name}")
         st.caption(f"ID: {current_user}")
         
         st.divider()
         st.markdown("<div class='stat-header'>📊 Desempenho Global</div>", unsafe_allow_html=True)
-        c1, c2 = st.columns(2)
-        c1.markdown(f"""<div class='stat-box'><div class='stat-value' style='color:#006400'>{stats['total_acertos']}</div><div class='stat-label'>Acertos</div></div>""", unsafe_allow_html=True)
-        c2.markdown(f"""<div class='stat-box'><div class='stat-value' style='color:#8B0000'>{stats['total_erros']}</div><div class='stat-label'>Erros</div></div>""", unsafe_allow_html=True)
-        
-        st.markdown(f"""<div class='stat-box'><div class='stat-value'>{stats['total_questoes']}</div><div class='stat-label'>Total de Questões</div></div>""", unsafe_allow_html=True)
+        global_stats_slot = st.empty()
+        render_global_stats(global_stats_slot, stats)
         
         st.markdown("<div class='stat-header'>📅 Desempenho Diário</div>", unsafe_allow_html=True)
         selected_date = st.date_input("Data:", datetime.now(), format="DD/MM/YYYY")
-        daily_stats = calculate_daily_stats(hist, selected_date)
+        daily_stats = get_daily_stats(arena_data, selected_date)
         
         d1, d2 = st.columns(2)
         d1.markdown(f"""<div class='stat-box'><div class='stat-value' style='color:#006400'>{daily_stats['acertos']}</div><div class='stat-label'>Acertos</div></div>""", unsafe_allow_html=True)
@@ -470,18 +1325,33 @@ def main():
 
         st.divider()
         if st.button("🔄 Recarregar Dados"):
-            st.cache_data.clear()
+            # Só o registro deste usuário: os caches do processo (e das outras sessões) ficam
+            flush_saves(st.session_state.get('row_idx'))
+            if get_storage(): get_storage().invalidate(current_user)
             del st.session_state['arena_data']
+            st.session_state.pop('hist_frame', None)
+            st.session_state.pop('revisoes', None)
+            st.session_state.pop('revisoes_aquecidas', None)
             st.rerun()
         if st.button("🚪 SAIR (Logout)"):
+            flush_saves(st.session_state.get('row_idx'))
             st.session_state.clear()
             st.rerun()
 
+        store = get_storage()
+        if store:
+            queue = get_write_queue()
+            if queue.pending_count(st.session_state.get('row_idx')):
+                st.caption("⚠️ Falha ao salvar; tentando novamente..." if queue.last_error else "⏳ Salvamento pendente...")
+            else:
+                st.caption("✅ Progresso salvo")
+
     if os.path.exists(HERO_IMG_FILE):
-        img_b64 = get_base64_of_bin_file(HERO_IMG_FILE)
-        st.markdown(f"""<div style="background-color: #F5F4EF; border-bottom: 4px solid #DAA520; display:flex; justify-content:center; height:250px; overflow:hidden;"><img src="data:image/jpg;base64,{img_b64}" style="height:100%; width:auto;"></div>""", unsafe_allow_html=True)
+        st.markdown(f"""<div style="background-color: #F5F4EF; border-bottom: 4px solid #DAA520; display:flex; justify-content:center; height:250px; overflow:hidden;"><img src="{get_asset_src(HERO_IMG_FILE, HERO_WIDTH)}" style="height:100%; width:auto;"></div>""", unsafe_allow_html=True)
 
-    tab_batalha, tab_doctore, tab_historico = st.tabs(["🏛️ Coliseum", "🦉 Doctore", "📜 Histórico"])
+    # on_change="rerun": as abas passam a saber qual está aberta (.open); Histórico e Ranking só carregam quando abertos
+    tab_batalha, tab_doctore, tab_historico, tab_ranking = st.tabs(["🏛️ Coliseum", "🦉 Doctore", "📜 Histórico", "🏆 Ranking"],
+                                                                   key="aba", on_change="rerun")
 
     # -------------------------------------------------------------------------
     # TAB 1: BATALHA
@@ -514,14 +1384,7 @@ def main():
                 render_centered_image(opp['avatar_url'])
                 
                 # PLAYER HÍBRIDO (Coliseum)
-                audio_path = opp.get('audio')
-                if audio_path:
-                    if audio_path.startswith('http'):
-                        st.audio(audio_path)
-                    elif os.path.exists(audio_path):
-                        _, ext = os.path.splitext(audio_path)
-                        mime_type = 'audio/mp4' if 'm4a' in ext.lower() else 'audio/mp3'
-                        st.audio(audio_path, format=mime_type)
+                render_audio(opp.get('audio'))
             
             with c_info:
                 st.markdown(f"<h3 style='color: #9E0000;'>{opp['nome']}</h3>", unsafe_allow_html=True)
@@ -569,31 +1432,34 @@ def main():
                             erros = max(0, total - acertos)
                             win = (erros <= opp['max_erros']) and (tempo <= opp['max_tempo'])
                             
-                            stats['total_questoes'] += total
-                            stats['total_acertos'] += acertos
-                            stats['total_erros'] += erros
-                            hist.append({
+                            delta = {"stats": {"total_questoes": total, "total_acertos": acertos, "total_erros": erros}}
+                            merge_delta(delta, record_activity(current_user, {
                                 "data": datetime.now().strftime("%d/%m/%Y %H:%M"),
                                 "tipo": "Batalha",
                                 "detalhe": f"vs {opp['nome']}",
                                 "resultado": f"{'Vitória' if win else 'Derrota'} ({acertos}/{total})",
-                                "tempo": f"{tempo} min"
-                            })
+                                "tempo": f"{tempo} min",
+                                "acertos": acertos,
+                                "total": total,
+                                "ts": int(time.time())
+                            }))
+                            st.session_state.pop('hist_frame', None)
                             
                             st.session_state['last_opp_id'] = opp['id']
                             if win:
                                 st.session_state['last_result'] = 'vitoria'
                                 if opp['id'] not in fases_vencidas:
-                                    fases_vencidas.append(opp['id'])
+                                    delta["fases_vencidas"] = [opp['id']]
                                     if opp['id'] == fase_max:
-                                        arena_data['progresso_arena']['fase_maxima_desbloqueada'] += 1
+                                        delta["fase_maxima_desbloqueada"] = fase_max + 1
                                 st.balloons()
                                 st.success("VITÓRIA!")
                             else:
                                 st.session_state['last_result'] = 'derrota'
                                 st.error("DERROTA. Tente novamente!")
                             
-                            save_data(st.session_state['row_idx'], arena_data)
+                            save_delta(st.session_state['row_idx'], arena_data, delta)
+                            flush_saves(wait=False)
                             time.sleep(1.5)
                             del st.session_state['active_battle_id']
                             st.rerun()
@@ -643,14 +1509,7 @@ def main():
                         if master.get('imagem'): render_centered_image(master['imagem'], width=400)
                         
                         # PLAYER HÍBRIDO (Doctore)
-                        audio_path = master.get('audio')
-                        if audio_path:
-                            if audio_path.startswith('http'):
-                                st.audio(audio_path)
-                            elif os.path.exists(audio_path):
-                                _, ext = os.path.splitext(audio_path)
-                                mime_type = 'audio/mp4' if 'm4a' in ext.lower() else 'audio/mp3'
-                                st.audio(audio_path, format=mime_type)
+                        render_audio(master.get('audio'))
 
                         st.markdown(f"<h3 style='color: #9E0000;'>{master['nome']}</h3>", unsafe_allow_html=True)
                         
@@ -658,7 +1517,7 @@ def main():
                         if st.button(f"Treinar", key=f"sel_{key}"):
                             st.session_state['selected_master'] = key
                             st.session_state['doctore_state'] = 'training'
-                            st.session_state['doctore_session'] = {"active": False, "questions": [], "idx": 0, "wrong_ids": [], "mode": "normal"}
+                            st.session_state['doctore_session'] = {"active": False, "questions": array('l'), "idx": 0, "wrong_ids": set(), "mode": "normal"}
                             st.rerun()
                         st.markdown("</div>", unsafe_allow_html=True)
         
@@ -675,87 +1534,76 @@ def main():
              st.markdown("---")
              
              if 'doctore_session' not in st.session_state:
-                 st.session_state['doctore_session'] = {"active": False, "questions": [], "idx": 0}
+                 st.session_state['doctore_session'] = {"active": False, "questions": array('l'), "idx": 0}
              ds = st.session_state['doctore_session']
              
              if not ds['active']:
-                 materias = list(master['materias'].keys())
+                 materias = load_materias(master_key)
                  if not materias:
                      st.warning("Sem matérias cadastradas.")
                  else:
                      nicho = st.selectbox("Escolha a Matéria:", materias)
-                     assuntos = list(master['materias'][nicho].keys())
+                     assuntos = load_assuntos(master_key, nicho)
                      sub_nicho = st.selectbox("Escolha o Assunto:", assuntos)
                      
                      if st.button("Iniciar Treino", type="primary"):
-                         qs = master['materias'][nicho][sub_nicho].copy()
+                         # A sessão guarda só os ids; o texto vem do índice compartilhado
+                         qs = get_question_bank().question_ids(master_key, nicho, sub_nicho)
                          random.shuffle(qs)
-                         ds.update({"questions": qs, "idx": 0, "active": True, "wrong_ids": [], "mode": "normal"})
+                         ds.update({"questions": array('l', qs), "idx": 0, "active": True, "wrong_ids": set(), "mode": "normal"})
                          st.rerun()
-             else:
-                 q_list = ds['questions']
-                 idx = ds['idx']
-                 
-                 if idx < len(q_list):
-                     q = q_list[idx]
-                     st.markdown(f"**Modo:** {'REVISÃO' if ds['mode']=='retry' else 'TREINO'} | Q {idx+1}/{len(q_list)}")
-                     st.progress((idx)/len(q_list))
-                     
-                     st.markdown(f"<div class='doctore-card'>{q['texto']}</div>", unsafe_allow_html=True)
-                     
-                     if 'doc_revealed' not in st.session_state: st.session_state['doc_revealed'] = False
-                     
-                     if not st.session_state['doc_revealed']:
-                         c1, c2 = st.columns(2)
-                         
-                         def process_answer(ans):
-                             st.session_state['doc_choice'] = ans
-                             st.session_state['doc_revealed'] = True
-                             is_correct = (ans == q['gabarito'])
-                             
-                             stats['total_questoes'] += 1 
-                             if is_correct: stats['total_acertos'] += 1
-                             else:
-                                 stats['total_erros'] += 1
-                                 if q not in ds['wrong_ids']: ds['wrong_ids'].append(q)
-                             
-                             save_data(st.session_state['row_idx'], arena_data)
-
-                         if c1.button("✅ CERTO", use_container_width=True): process_answer("Certo"); st.rerun()
-                         if c2.button("❌ ERRADO", use_container_width=True): process_answer("Errado"); st.rerun()
-                     
-                     else:
-                         acertou = (st.session_state['doc_choice'] == q['gabarito'])
-                         if acertou: st.success(f"Correto! Gabarito: {q['gabarito']}")
-                         else: st.error(f"Errou! Gabarito: {q['gabarito']}")
-                         
-                         st.markdown(f"<div class='feedback-box'>{q['explicacao']}</div>", unsafe_allow_html=True)
-                         
-                         if st.button("Próxima ➡️"):
-                             st.session_state['doc_revealed'] = False
-                             ds['idx'] += 1
+
+                     # REVISÃO INTELIGENTE: questões vencidas de todas as matérias do mestre, as mais atrasadas primeiro
+                     st.markdown("---")
+                     schedule = get_review_schedule()
+                     master_ids = load_master_ids(master_key)
+                     if not schedule.has_queue(master_key): schedule.build_queue(master_key, master_ids)
+                     st.caption(f"🧠 {schedule.due_count(master_key)} questão(ões) para revisar hoje, em todas as matérias.")
+                     if st.button("🧠 Revisão Inteligente"):
+                         qs = schedule.due(master_key, REVIEW_SESSION_SIZE)
+                         # Poucas revisões vencidas: completa com questões ainda não vistas
+                         if len(qs) < REVIEW_SESSION_SIZE: qs += schedule.unseen(master_key, REVIEW_SESSION_SIZE - len(qs))
+                         if qs:
+                             ds.update({"questions": array('l', qs), "idx": 0, "active": True, "wrong_ids": set(), "mode": "smart"})
                              st.rerun()
-                 else:
-                     st.success("Treino Finalizado!")
-                     st.write(f"Erros: {len(ds['wrong_ids'])}")
-                     
-                     c1, c2 = st.columns(2)
-                     if c1.button("🏠 Novo Treino"):
-                         ds['active'] = False
-                         st.rerun()
-                     if len(ds['wrong_ids']) > 0 and c2.button("🔄 Refazer Erradas"):
-                         ds.update({"questions": ds['wrong_ids'].copy(), "wrong_ids": [], "idx": 0, "mode": "retry"})
-                         st.rerun()
+                         st.info("Nada para revisar por enquanto.")
+
+                     # BUSCA: palavras (sem acento), artigos, banca, ano ou órgão, em todas as matérias do mestre
+                     st.markdown("---")
+                     query = st.text_input("🔎 Buscar questões", placeholder="Ex.: CEBRASPE 2006 Constitucional, art. 18", key="doc_busca")
+                     if query:
+                         results = search_questions(master_key, query)
+                         if not results:
+                             st.info("Nenhuma questão encontrada.")
+                         else:
+                             limited = " (as mais relevantes)" if len(results) >= question_bank.SEARCH_LIMIT else ""
+                             st.caption(f"{len(results)} questão(ões) encontrada(s){limited}.")
+                             st.dataframe(pd.DataFrame(results[:10]).drop(columns="id"), use_container_width=True, hide_index=True)
+                             if st.button("Iniciar Treino com a Busca"):
+                                 ds.update({"questions": array('l', [r['id'] for r in results]), "idx": 0, "active": True, "wrong_ids": set(), "mode": "busca"})
+                                 st.rerun()
+             else:
+                 doctore_question_fragment(global_stats_slot)
 
     # -------------------------------------------------------------------------
     # TAB 3: HISTÓRICO
     # -------------------------------------------------------------------------
     with tab_historico:
-        if hist:
-            st.dataframe(pd.DataFrame(hist[::-1]), use_container_width=True, hide_index=True)
-        else:
-            st.info("Sem histórico.")
+        if tab_historico.open:
+            render_history(current_user)
+
+    # -------------------------------------------------------------------------
+    # TAB 4: RANKING
+    # -------------------------------------------------------------------------
+    with tab_ranking:
+        if tab_ranking.open:
+            render_ranking(current_user, user_name, arena_data)
 
 if __name__ == "__main__":
-    main()
+    if os.environ.get("ARENA_METRICS_FILE"): start_metrics_exporter(os.environ["ARENA_METRICS_FILE"])
+    with METRICS.rerun(st.session_state.get('user_id')):
+        main()
+        # Tempo até a primeira tela interativa depois do login (o rerun do login termina em st.rerun e não chega aqui)
+        if st.session_state.get('logged_in') and 'login_inicio' in st.session_state:
+            METRICS.observe("login.tempo_ate_interativo", time.perf_counter() - st.session_state.pop('login_inicio'))
 
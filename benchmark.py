@@ -0,0 +1,530 @@
+"""Benchmark de carga da Arena com streamlit.testing.v1.AppTest.
+
+Simula N gladiadores contra um Google Sheets falso (em memória) com latência,
+cota por minuto e erros injetados. Cada gladiador é uma sessão AppTest rodando
+na sua própria thread; todas partem juntas de uma barreira e disputam os caches
+de processo, o Sheets e a CPU exatamente como num servidor Streamlit.
+
+Jornada de cada gladiador: login, relatório de batalha no Coliseum, sessão
+Doctore de N questões e visita ao Histórico. O rerun "coliseum_reportar" inclui
+a pausa de 1,5 s da animação de vitória/derrota do próprio app.
+
+Cada trecho da jornada é uma fase (acesso, coliseum, doctore, historico) e as
+sessões passam juntas de uma fase à outra. A fase só fecha quando a fila de
+gravação esvazia, então as leituras e escritas dela incluem o segundo plano;
+as "chamadas" por ação contam só o rerun em si.
+
+A ação "login" vai do envio do formulário até a primeira tela pronta (tempo
+até interativo); --login-serial mede o login serial de antes, para comparar.
+
+Uso:
+    python benchmark.py --users 50 --latency-ms 80 --error-rate 0.01 --output bench_results.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import re
+import resource
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import question_bank
+import storage
+import metrics
+from metrics import METRICS
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "arenaspartajus.py")
+FAKE_BACKEND = "fake_sheets"
+PASSWORD = "arena123"
+PHASES = ["acesso", "coliseum", "doctore", "historico"]
+SETTLE_SECONDS = 6.0  # mais que o FLUSH_INTERVAL da fila de gravação do app
+
+# -----------------------------------------------------------------------------
+# GOOGLE SHEETS FALSO
+# -----------------------------------------------------------------------------
+class FakeAPIError(Exception):
+    """Imita o APIError do gspread: o status HTTP fica em .response.status_code."""
+    def __init__(self, status, message=""):
+        super().__init__(f"{status} {message}")
+        self.response = SimpleNamespace(status_code=status, headers={})
+
+class FakeSheets:
+    """Estado compartilhado do Sheets simulado: abas em memória, latência, cota e erros."""
+
+    def __init__(self, latency_ms=80, jitter_ms=20, read_quota=300, write_quota=300, error_rate=0.0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.quota = {"read": read_quota, "write": write_quota}
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self._window = {"read": deque(), "write": deque()}
+        self.sheets = {}
+
+    def api_call(self, kind, method):
+        """Contabiliza uma chamada; aplica cota por minuto, erro aleatório e latência."""
+        METRICS.api_call(FAKE_BACKEND, method)
+        with self.lock:
+            self.calls[kind] += 1
+            self.calls[f"{kind}:{method}"] += 1
+            if kind in self._window:
+                now = time.monotonic()
+                window = self._window[kind]
+                while window and now - window[0] > 60: window.popleft()
+                if len(window) >= self.quota[kind]:
+                    self.calls["throttled"] += 1
+                    raise FakeAPIError(429, "RESOURCE_EXHAUSTED")
+                window.append(now)
+            fail = self.rng.random() < self.error_rate
+            delay = max(0.0, self.rng.gauss(self.latency_ms, self.jitter_ms)) / 1000
+        time.sleep(delay)
+        if fail:
+            with self.lock: self.calls["errors"] += 1
+            raise FakeAPIError(503, "UNAVAILABLE")
+
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls[k] for k in ("read", "write", "auth", "open"))
+
+class FakeCell:
+    def __init__(self, row, col, value):
+        self.row, self.col, self.value = row, col, value
+
+def _col_number(letters):
+    n = 0
+    for ch in letters: n = n * 26 + ord(ch) - ord("A") + 1
+    return n
+
+def _parse_range(a1, last_row=0):
+    """'A5:I5' (ou 'C5', ou 'A2:A' até last_row) -> (linha_ini, col_ini, linha_fim, col_fim)."""
+    m = re.fullmatch(r"([A-Z]+)(\d+)(?::([A-Z]+)(\d*))?", a1.split("!")[-1])
+    end_col, end_row = (m.group(3), m.group(4) or last_row) if m.group(3) else (m.group(1), m.group(2))
+    return int(m.group(2)), _col_number(m.group(1)), int(end_row), _col_number(end_col)
+
+class FakeWorksheet:
+    def __init__(self, fake, title, rows, cols):
+        self.fake = fake
+        self.title = title
+        self.rows = [list(r) for r in rows]
+        self.col_count = cols
+
+    def _get(self, r, c):
+        row = self.rows[r - 1] if r - 1 < len(self.rows) else []
+        return row[c - 1] if c - 1 < len(row) else ""
+
+    def _set(self, r, c, value):
+        while len(self.rows) < r: self.rows.append([])
+        row = self.rows[r - 1]
+        while len(row) < c: row.append("")
+        row[c - 1] = "" if value is None else str(value)
+
+    def get_all_values(self):
+        self.fake.api_call("read", "get_all_values")
+        return [list(r) for r in self.rows]
+
+    def row_values(self, r):
+        self.fake.api_call("read", "row_values")
+        return list(self.rows[r - 1]) if r - 1 < len(self.rows) else []
+
+    def col_values(self, c):
+        self.fake.api_call("read", "col_values")
+        return [self._get(r, c) for r in range(1, len(self.rows) + 1)]
+
+    def find(self, query, in_column=None):
+        self.fake.api_call("read", "find")
+        for r, row in enumerate(self.rows, start=1):
+            for c, value in enumerate(row, start=1):
+                if (in_column is None or c == in_column) and value == query: return FakeCell(r, c, value)
+        return None
+
+    def cell(self, r, c):
+        self.fake.api_call("read", "cell")
+        return FakeCell(r, c, self._get(r, c))
+
+    def get(self, a1):
+        self.fake.api_call("read", "get")
+        r1, c1, r2, c2 = _parse_range(a1, len(self.rows))
+        return [[self._get(r, c) for c in range(c1, c2 + 1)] for r in range(r1, r2 + 1)]
+
+    def batch_get(self, ranges):
+        self.fake.api_call("read", "batch_get")
+        out = []
+        for a1 in ranges:
+            r1, c1, r2, c2 = _parse_range(a1, len(self.rows))
+            out.append([[self._get(r, c) for c in range(c1, c2 + 1)] for r in range(r1, r2 + 1)])
+        return out
+
+    def update_cell(self, r, c, value):
+        self.fake.api_call("write", "update_cell")
+        self._set(r, c, value)
+
+    def batch_update(self, data, **kwargs):
+        self.fake.api_call("write", "batch_update")
+        for item in data:
+            r1, c1, _, _ = _parse_range(item["range"])
+            for dr, values in enumerate(item["values"]):
+                for dc, value in enumerate(values): self._set(r1 + dr, c1 + dc, value)
+
+    def _append(self, values):
+        self.rows.append(["" if v is None else str(v) for v in values])
+        r = len(self.rows)
+        return f"'{self.title}'!A{r}:{chr(ord('A') + max(0, len(values) - 1))}{r}"
+
+    def append_row(self, values, **kwargs):
+        self.fake.api_call("write", "append_row")
+        return {"updates": {"updatedRange": self._append(values)}}
+
+    def append_rows(self, rows, **kwargs):
+        self.fake.api_call("write", "append_rows")
+        ranges = [self._append(values) for values in rows]
+        return {"updates": {"updatedRange": ranges[0] if ranges else ""}}
+
+    def add_cols(self, n):
+        self.fake.api_call("write", "add_cols")
+        self.col_count += n
+
+class FakeSpreadsheet:
+    def __init__(self, fake):
+        self.fake = fake
+
+    @property
+    def sheet1(self):
+        self.fake.api_call("read", "sheet1")
+        return self.fake.sheets["sheet1"]
+
+    def worksheet(self, name):
+        self.fake.api_call("read", "worksheet")
+        if name not in self.fake.sheets: raise storage.gspread.WorksheetNotFound(name)
+        return self.fake.sheets[name]
+
+    def add_worksheet(self, title, rows, cols):
+        self.fake.api_call("write", "add_worksheet")
+        self.fake.sheets[title] = FakeWorksheet(self.fake, title, [], cols)
+        return self.fake.sheets[title]
+
+class FakeClient:
+    def __init__(self, fake):
+        self.fake = fake
+
+    def open(self, name):
+        self.fake.api_call("open", "open")
+        return FakeSpreadsheet(self.fake)
+
+class FakeConnection(storage.SheetsConnection):
+    def __init__(self, fake):
+        super().__init__({})
+        self.fake = fake
+
+    def _authorize(self):
+        self.fake.api_call("auth", "authorize")
+        return FakeClient(self.fake)
+
+def seed_fake_sheets(fake, n_users, history_per_user=60):
+    """Cria Usuarios, sheet1 e Historico com n_users gladiadores (senha PASSWORD, já em hash)."""
+    password_hash = storage.hash_password(PASSWORD)
+    users = [["Login", "Senha", "Nome"]]
+    records = [["Login", "", "Dados"]]
+    history = [storage.HISTORY_HEADER]
+    now = int(time.time())
+    for i in range(n_users):
+        login = f"gladiador{i:04d}"
+        users.append([login, password_hash, f"Gladiador {i}"])
+        records.append([login, "", json.dumps(storage.new_arena_data())])
+        for h in range(history_per_user):
+            ts = now - (h + 1) * 3600
+            activity = {"data": time.strftime("%d/%m/%Y %H:%M", time.localtime(ts)), "tipo": "Batalha",
+                        "detalhe": "vs Velho Leão", "resultado": "Derrota (5/10)", "tempo": "45 min",
+                        "acertos": 5, "total": 10, "ts": ts}
+            history.append([str(v) for v in storage.history_row(login, activity)])
+    fake.sheets["sheet1"] = FakeWorksheet(fake, "sheet1", records, 3)
+    fake.sheets["Usuarios"] = FakeWorksheet(fake, "Usuarios", users, 3)
+    fake.sheets[storage.HISTORY_SHEET] = FakeWorksheet(fake, storage.HISTORY_SHEET, history, len(storage.HISTORY_HEADER))
+    return [row[0] for row in users[1:]]
+
+# -----------------------------------------------------------------------------
+# JORNADAS
+# -----------------------------------------------------------------------------
+def _button(at, label):
+    for b in at.button:
+        if b.label == label: return b
+    return None
+
+def journey(at, login, n_questions, rng):
+    """Gera (ação, thunk): o runner executa e cronometra cada thunk (= um rerun)."""
+    yield "abrir", lambda: at.run()
+
+    def do_login():
+        at.text_input[0].input(login)
+        at.text_input[1].input(PASSWORD)
+        _button(at, "ENTRAR NA ARENA").click().run()
+    yield "login", do_login
+
+    yield "coliseum_batalhar", lambda: at.button(key="bat_1").click().run()
+
+    def report():
+        at.number_input[0].set_value(10)
+        at.number_input[1].set_value(rng.randint(3, 10))
+        at.number_input[2].set_value(rng.randint(20, 70))
+        _button(at, "REPORTAR RESULTADO").click().run()
+    yield "coliseum_reportar", report
+
+    yield "doctore_mestre", lambda: at.button(key="sel_praetorium").click().run()
+    bank = question_bank.QuestionBank(question_bank.QUESTOES_DB)
+    targets = [(m, a) for m in bank.materias("praetorium") for a in bank.assuntos("praetorium", m)]
+    answered = 0
+    while answered < n_questions and targets:
+        materia, assunto = targets.pop(0)
+
+        def start(materia=materia, assunto=assunto):
+            at.selectbox[0].set_value(materia).run()
+            at.selectbox[1].set_value(assunto)
+            _button(at, "Iniciar Treino").click().run()
+        yield "doctore_iniciar", start
+        while answered < n_questions and _button(at, "✅ CERTO"):
+            label = rng.choice(["✅ CERTO", "❌ ERRADO"])
+            yield "doctore_responder", lambda label=label: _button(at, label).click().run()
+            answered += 1
+            yield "doctore_proxima", lambda: _button(at, "Próxima ➡️").click().run()
+        if _button(at, "🏠 Novo Treino"):
+            yield "doctore_novo_treino", lambda: _button(at, "🏠 Novo Treino").click().run()
+        elif answered >= n_questions:
+            yield "doctore_voltar", lambda: _button(at, "🔙 Voltar ao Panteão").click().run()
+
+    # Só a aba aberta é executada: "ver" o Histórico é trocar de aba + paginação
+    def open_history():
+        at.session_state["aba"] = "📜 Histórico"
+        at.run()
+    yield "historico", open_history
+    if _button(at, "Mais antigas ➡️"):
+        yield "historico_pagina", lambda: _button(at, "Mais antigas ➡️").click().run()
+
+# -----------------------------------------------------------------------------
+# EXECUÇÃO E RELATÓRIO
+# -----------------------------------------------------------------------------
+def percentile(values, p):
+    if not values: return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+def session_bytes(at):
+    state = {k: at.session_state[k] for k in at.session_state.keys()}
+    return question_bank.deep_sizeof(state)
+
+def sheets_calls_of(login, since):
+    """Chamadas ao Sheets feitas pelos reruns do gladiador iniciados a partir de since.
+
+    Só o primeiro plano: sob concorrência a diferença do contador global mistura
+    as sessões. O que a fila de gravação faz em segundo plano aparece nas fases.
+    """
+    return sum(r["api_calls"] for r in METRICS.recent_reruns(login, since))
+
+def phase_of(action):
+    return "acesso" if action in ("abrir", "login") else action.split("_")[0]
+
+def settle(fake, quiet=SETTLE_SECONDS):
+    """Espera o Sheets simulado ficar quiet segundos sem chamadas (a fila de gravação esvaziou)."""
+    last, calm_since = fake.total_calls(), time.perf_counter()
+    while time.perf_counter() - calm_since < quiet:
+        time.sleep(0.2)
+        now = fake.total_calls()
+        if now != last: last, calm_since = now, time.perf_counter()
+
+def fake_counters(fake):
+    with fake.lock:
+        return {"read": fake.calls["read"], "write": fake.calls["write"]}
+
+@contextlib.contextmanager
+def concurrent_apptest():
+    """Deixa várias sessões AppTest rodarem ao mesmo tempo em threads, só dentro do with.
+
+    A cada run o AppTest compila o app de novo, cria um Runtime global e o apaga
+    no fim, e liga/desliga a opção global.appTest; com runs simultâneos um
+    apagaria o Runtime do outro (e o ast.parse concorrente quebra no CPython
+    3.11). Como no servidor, todas as sessões passam a ver um só cache de
+    bytecode e o primeiro Runtime criado. Na saída tudo volta ao original.
+    """
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import local_script_runner
+
+    saved = (local_script_runner.ScriptCache, Runtime.__dict__["instance"], Runtime.__dict__["exists"],
+             config.get_option("global.appTest"))
+    shared_cache = ScriptCache()
+    shared = []
+    lock = threading.Lock()
+
+    def instance(cls):
+        with lock:
+            if not shared and cls._instance is not None: shared.append(cls._instance)
+        if not shared: raise RuntimeError("Runtime hasn't been created!")
+        return shared[0]
+
+    local_script_runner.ScriptCache = lambda: shared_cache
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: bool(shared) or cls._instance is not None)
+    config.set_option("global.appTest", True)
+    try:
+        yield
+    finally:
+        local_script_runner.ScriptCache, Runtime.instance, Runtime.exists, app_test = saved
+        config.set_option("global.appTest", app_test)
+
+def run_benchmark(users, questions, fake, seed=0, history=60, timeout=60):
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed)
+    logins = seed_fake_sheets(fake, users, history)
+    sessions = []
+    for login in logins:
+        at = AppTest.from_file(APP_FILE, default_timeout=timeout)
+        sessions.append((login, at, journey(at, login, questions, random.Random(rng.random()))))
+    # Guarda todos os reruns da rodada para a contagem de chamadas por ação
+    METRICS.keep_recent(max(metrics.RECENT_RERUNS, users * (questions + 20)))
+
+    samples = defaultdict(list)
+    calls = defaultdict(list)
+    failures = Counter()
+    memory = {}
+    phases = {}
+    lock = threading.Lock()
+    clock = {"fase": -1, "inicio": 0.0, "antes": None, "espera": 0.0}
+
+    def close_phase():
+        # Fecha a fase só depois da fila de gravação esvaziar: as escritas em segundo plano entram nela
+        if clock["fase"] >= 0:
+            seconds = time.perf_counter() - clock["inicio"]
+            waited = time.perf_counter()
+            settle(fake)
+            clock["espera"] += time.perf_counter() - waited
+            after = fake_counters(fake)
+            phases[PHASES[clock["fase"]]] = dict(
+                {k: after[k] - clock["antes"][k] for k in after}, segundos=round(seconds, 2))
+        clock["fase"] += 1
+        clock["antes"], clock["inicio"] = fake_counters(fake), time.perf_counter()
+
+    # As sessões partem juntas e atravessam as fases juntas: cada gladiador num worker próprio
+    barrier = threading.Barrier(users, action=close_phase)
+
+    def run_session(login, at, steps):
+        entered = -1
+        try:
+            for action, thunk in steps:
+                while entered < PHASES.index(phase_of(action)):
+                    barrier.wait()
+                    entered += 1
+                since = time.time()
+                t0 = time.perf_counter()
+                failed = False
+                try:
+                    thunk()
+                    failed = bool(at.exception)
+                except Exception:
+                    failed = True
+                seconds = time.perf_counter() - t0
+                n_calls = sheets_calls_of(login, since)
+                with lock:
+                    samples[action].append(seconds)
+                    calls[action].append(n_calls)
+                    if failed: failures[action] += 1
+        except Exception as e:
+            print(f"Jornada de {login} interrompida: {e}")
+        # Quem terminou antes ainda atravessa as barreiras das fases que faltam
+        while entered < len(PHASES) - 1:
+            barrier.wait()
+            entered += 1
+        size = session_bytes(at)
+        with lock: memory[login] = size
+
+    started = time.perf_counter()
+    with concurrent_apptest(), ThreadPoolExecutor(max_workers=users) as pool:
+        for future in [pool.submit(run_session, *session) for session in sessions]:
+            future.result()
+    close_phase()
+    elapsed = time.perf_counter() - started - clock["espera"]
+
+    all_latencies = [v for values in samples.values() for v in values]
+    actions = {}
+    for action, values in samples.items():
+        actions[action] = {
+            "reruns": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 1),
+            "p95_ms": round(percentile(values, 95) * 1000, 1),
+            "p99_ms": round(percentile(values, 99) * 1000, 1),
+            "sheets_calls_per_action": round(sum(calls[action]) / len(calls[action]), 2),
+            "failures": failures[action],
+        }
+    mem_values = list(memory.values())
+    return {
+        "config": {"users": users, "questions": questions, "latency_ms": fake.latency_ms,
+                   "jitter_ms": fake.jitter_ms, "read_quota_per_min": fake.quota["read"],
+                   "write_quota_per_min": fake.quota["write"], "error_rate": fake.error_rate, "history_per_user": history, "seed": seed,
+                   "login_prefetch": os.environ.get("ARENA_LOGIN_PREFETCH", "1") != "0"},
+        "wall_seconds": round(elapsed, 2),
+        "reruns": len(all_latencies),
+        "throughput_reruns_per_s": round(len(all_latencies) / elapsed, 2) if elapsed else None,
+        "overall": {"p50_ms": round(percentile(all_latencies, 50) * 1000, 1),
+                    "p95_ms": round(percentile(all_latencies, 95) * 1000, 1),
+                    "p99_ms": round(percentile(all_latencies, 99) * 1000, 1)},
+        "actions": actions,
+        "phases": phases,
+        "sheets_calls": dict(fake.calls),
+        "session_bytes": {"mean": int(sum(mem_values) / len(mem_values)) if mem_values else 0,
+                          "max": max(mem_values) if mem_values else 0},
+        "process_max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+def print_report(result):
+    cfg = result["config"]
+    print(f"{cfg['users']} gladiadores | latência {cfg['latency_ms']}±{cfg['jitter_ms']} ms | "
+          f"erro {cfg['error_rate']:.1%} | {result['reruns']} reruns em {result['wall_seconds']} s "
+          f"({result['throughput_reruns_per_s']} reruns/s)")
+    print(f"{'ação':<22}{'reruns':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'chamadas':>10}{'falhas':>8}")
+    for action, a in result["actions"].items():
+        print(f"{action:<22}{a['reruns']:>8}{a['p50_ms']:>10}{a['p95_ms']:>10}{a['p99_ms']:>10}"
+              f"{a['sheets_calls_per_action']:>10}{a['failures']:>8}")
+    print(f"{'fase':<22}{'segundos':>10}{'leituras':>10}{'escritas':>10}{'leit./glad.':>12}{'escr./glad.':>12}")
+    for phase, f in result["phases"].items():
+        print(f"{phase:<22}{f['segundos']:>10}{f['read']:>10}{f['write']:>10}"
+              f"{f['read'] / cfg['users']:>12.2f}{f['write'] / cfg['users']:>12.2f}")
+    print(f"memória por sessão: média {result['session_bytes']['mean']:,} B, máx {result['session_bytes']['max']:,} B")
+    print(f"chamadas ao Sheets: {result['sheets_calls']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--questions", type=int, default=30, help="questões por sessão Doctore")
+    parser.add_argument("--latency-ms", type=float, default=80)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--read-quota", type=int, default=300, help="leituras por minuto")
+    parser.add_argument("--write-quota", type=int, default=300, help="escritas por minuto")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fração de chamadas que falham com 503")
+    parser.add_argument("--history", type=int, default=60, help="linhas de Histórico pré-existentes por gladiador")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--login-serial", action="store_true", help="login sem leitura antecipada nem aquecimento")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    fake = FakeSheets(args.latency_ms, args.jitter_ms, args.read_quota, args.write_quota, args.error_rate, args.seed)
+    # O governador do app recebe a mesma cota do Sheets simulado
+    governor = lambda: storage.QuotaGovernor(args.read_quota, args.write_quota)
+    storage.register_backend(FAKE_BACKEND, lambda: storage.SheetsStorage(FakeConnection(fake), governor()))
+    os.environ["ARENA_STORAGE"] = FAKE_BACKEND
+    if args.login_serial: os.environ["ARENA_LOGIN_PREFETCH"] = "0"
+    os.chdir(os.path.dirname(APP_FILE))
+
+    result = run_benchmark(args.users, args.questions, fake, args.seed, args.history)
+    print_report(result)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"resultado salvo em {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Histórico em colunas tipadas para a aba Histórico: conversão e agregados vetorizados.
+
+O storage devolve o histórico já filtrado em colunas (history_columns);
+aqui ele vira um DataFrame com tipos de verdade, e os agregados são
+calculados sobre as colunas inteiras (pandas/NumPy), sem laço por linha.
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from storage import HISTORY_KEYS
+
+DATE_FORMAT = "%d/%m/%Y %H:%M"
+LOCAL_TZ = datetime.now().astimezone().tzinfo
+COLUMNS = ["quando", "tipo", "detalhe", "resultado", "acertos", "total", "tempo_min"]
+
+def merge_columns(*parts):
+    """Concatena colunas ({chave: lista}) na ordem dada."""
+    return {k: [v for part in parts for v in part.get(k, [])] for k in HISTORY_KEYS}
+
+def to_frame(columns):
+    """DataFrame tipado (quando, tipo, detalhe, resultado, acertos, total, tempo_min)."""
+    raw = pd.DataFrame({k: pd.Series(columns.get(k, []), dtype=object) for k in HISTORY_KEYS})
+    ts = pd.to_numeric(raw["ts"], errors="coerce")
+    quando = pd.to_datetime(ts, unit="s", utc=True).dt.tz_convert(LOCAL_TZ).dt.tz_localize(None)
+    # Linhas antigas sem Timestamp: cai para o texto da coluna Data
+    quando = quando.fillna(pd.to_datetime(raw["data"], format=DATE_FORMAT, errors="coerce"))
+    resultado = raw["resultado"].astype("string")
+    # Linhas antigas sem Acertos/Total só têm o texto "Vitória (8/10)"
+    numbers = resultado.str.extract(r"(\d+)/(\d+)").astype("float64")
+    total = pd.to_numeric(raw["total"], errors="coerce")
+    legacy = total.isna()
+    acertos = pd.to_numeric(raw["acertos"], errors="coerce").where(~legacy, numbers[0])
+    total = total.where(~legacy, numbers[1])
+    tempo = raw["tempo"].astype("string").str.extract(r"(\d+(?:[.,]\d+)?)")[0].str.replace(",", ".", regex=False)
+    return pd.DataFrame({
+        "quando": quando,
+        "tipo": raw["tipo"].astype("string").fillna("").astype("category"),
+        "detalhe": raw["detalhe"].astype("string"),
+        "resultado": resultado,
+        "acertos": acertos.fillna(0).astype("int32"),
+        "total": total.fillna(0).astype("int32"),
+        "tempo_min": pd.to_numeric(tempo, errors="coerce").astype("float32"),
+    }, columns=COLUMNS)
+
+def summarize(df):
+    """Totais do período filtrado."""
+    total = int(df["total"].to_numpy().sum())
+    acertos = int(df["acertos"].to_numpy().sum())
+    tempo = df["tempo_min"].to_numpy(dtype="float64")
+    timed = ~np.isnan(tempo)
+    return {
+        "atividades": len(df),
+        "questoes": total,
+        "acertos": acertos,
+        "erros": total - acertos,
+        "aproveitamento": acertos / total if total else 0.0,
+        "vitorias": int(df["resultado"].str.startswith("Vitória").fillna(False).to_numpy().sum()),
+        "tempo_total_min": float(tempo[timed].sum()),
+        "tempo_medio_min": float(tempo[timed].mean()) if timed.any() else 0.0,
+    }
@@ -0,0 +1,325 @@
+"""Importação em massa de questões (exportações do TEC, CEBRASPE...) para o questoes.json.
+
+Lê CSV (separador detectado) ou JSONL em fluxo, uma linha por vez. Cada
+questão é validada (mestre existente, matéria e assunto, gabarito
+Certo/Errado, HTML permitido) e deduplicada pelo hash do texto
+normalizado (sem acentos, maiúsculas nem diferenças de espaço), contra o
+banco atual e contra o próprio arquivo, numa só passada. As aceitas
+recebem ids novos (depois do maior id do banco).
+
+O banco atual é lido do questoes.db compilado e as questões aceitas ficam
+num SQLite temporário, então a memória não cresce com o tamanho da
+importação. O questoes.json novo é escrito em fluxo, no mesmo formato do
+atual, num arquivo temporário que só então substitui o original.
+
+Colunas reconhecidas (sem acento, maiúsculas ou minúsculas): texto
+(enunciado), gabarito (resposta), explicacao (comentario), materia
+(disciplina), assunto (topico), mestre e, opcionais, banca, ano e orgao:
+viram a linha de Metadados da explicação quando ela não tem uma.
+
+Uso:
+    python ingest.py importacao.csv [outra.jsonl ...] [--mestre praetorium] [--simular]
+                     [--rejeitadas rejeitadas.csv] [--json questoes.json] [--db questoes.db]
+"""
+import argparse
+import csv
+import functools
+import hashlib
+import html
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import unicodedata
+from collections import Counter
+
+import question_bank
+
+FIELD_ALIASES = {
+    "texto": ("texto", "enunciado"),
+    "gabarito": ("gabarito", "resposta", "resposta correta"),
+    "explicacao": ("explicacao", "comentario", "justificativa"),
+    "materia": ("materia", "disciplina"),
+    "assunto": ("assunto", "topico"),
+    "master": ("mestre", "master"),
+    "banca": ("banca",),
+    "ano": ("ano",),
+    "orgao": ("orgao", "instituicao"),
+}
+GABARITOS = {"certo": "Certo", "c": "Certo", "correto": "Certo", "v": "Certo", "verdadeiro": "Certo",
+             "errado": "Errado", "e": "Errado", "incorreto": "Errado", "f": "Errado", "falso": "Errado"}
+INSERT_BATCH = 1000
+SPOOL_SCHEMA = """
+CREATE TABLE hashes (hash INTEGER PRIMARY KEY, id INTEGER, gabarito TEXT);
+CREATE TABLE novas (
+    seq INTEGER PRIMARY KEY, master TEXT, materia TEXT, assunto TEXT,
+    id INTEGER, texto TEXT, gabarito TEXT, explicacao TEXT
+);
+"""
+
+# -----------------------------------------------------------------------------
+# NORMALIZAÇÃO E VALIDAÇÃO
+# -----------------------------------------------------------------------------
+TAG_RE = re.compile(r"<[^>]+>")
+COMBINING_RE = re.compile(r"[\u0300-\u036f]")  # acentos soltos pelo NFKD
+
+def fold_text(text):
+    """Texto para comparação: sem HTML, acentos e maiúsculas, com os espaços colapsados."""
+    text = unicodedata.normalize("NFKD", html.unescape(TAG_RE.sub(" ", text or "")))
+    return " ".join(COMBINING_RE.sub("", text).casefold().split())
+
+@functools.lru_cache(maxsize=256)
+def fold_name(name):
+    """fold_text() dos nomes de coluna (os mesmos em todas as linhas)."""
+    return fold_text(name)
+
+def content_hash(texto):
+    """Hash de 64 bits (com sinal, como o INTEGER do SQLite) do texto normalizado."""
+    digest = hashlib.blake2b(fold_text(texto).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+def clean_text(text):
+    """Texto como é gravado: Unicode composto (NFC) e espaços colapsados; os acentos ficam."""
+    return " ".join(unicodedata.normalize("NFC", str(text or "")).split())
+
+def canonical_record(raw, default_master=None):
+    """Registro da entrada -> campos do FIELD_ALIASES (colunas com outros nomes são ignoradas)."""
+    by_name = {fold_name(str(k)): v for k, v in raw.items() if k is not None}
+    record = {}
+    for field, aliases in FIELD_ALIASES.items():
+        value = next((by_name[a] for a in aliases if by_name.get(a) not in (None, "")), "")
+        record[field] = clean_text(value) if field != "explicacao" else str(value or "").strip()
+    if not record["master"]: record["master"] = default_master or ""
+    return record
+
+def validate(record, masters):
+    """(questão pronta, lista de problemas); a questão só vale se a lista estiver vazia."""
+    problems = []
+    if record["master"] not in masters: problems.append(f"mestre desconhecido: {record['master'] or '(vazio)'}")
+    if not record["materia"]: problems.append("matéria vazia")
+    if not record["assunto"]: problems.append("assunto vazio")
+    if not record["texto"]: problems.append("texto vazio")
+    gabarito = GABARITOS.get(fold_name(record["gabarito"]).rstrip("."))
+    if not gabarito: problems.append(f"gabarito inválido: {record['gabarito'] or '(vazio)'}")
+    explicacao = record["explicacao"]
+    if record["banca"] and not question_bank.METADADOS_RE.search(explicacao):
+        meta = " / ".join(v for v in (record["banca"], record["ano"], record["orgao"]) if v)
+        explicacao = f"<strong>Metadados:</strong> {html.escape(meta, quote=False)}" + (f"<br><br>{explicacao}" if explicacao else "")
+    problems += [f"texto: {p}" for p in question_bank.html_problems(record["texto"])]
+    problems += [f"explicação: {p}" for p in question_bank.html_problems(explicacao)]
+    question = {"texto": record["texto"], "gabarito": gabarito, "explicacao": explicacao}
+    return question, problems
+
+# -----------------------------------------------------------------------------
+# LEITURA EM FLUXO
+# -----------------------------------------------------------------------------
+def read_records(path):
+    """(linha, registro ou None, erro) de um CSV ou JSONL, um de cada vez."""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip(): continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    yield line_number, None, f"JSON inválido: {e}"
+                    continue
+                if isinstance(record, dict): yield line_number, record, None
+                else: yield line_number, None, "a linha não é um objeto JSON"
+            return
+        sample = f.read(64 * 1024)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.DictReader(f, dialect=dialect)
+        for record in reader:
+            yield reader.line_num, record, None
+
+# -----------------------------------------------------------------------------
+# ESCRITA DO BANCO
+# -----------------------------------------------------------------------------
+class _Items:
+    """Pares (chave, valor) de um objeto JSON gerados sob demanda."""
+
+    def __init__(self, pairs):
+        self.pairs = pairs
+
+def dump_json(write, value, newline, depth=0):
+    """Mesma saída de json.dumps(value, indent=2, ensure_ascii=False), em pedaços.
+
+    Listas podem ser geradores e objetos podem ser _Items: nada precisa estar
+    inteiro na memória.
+    """
+    if isinstance(value, dict): value = _Items(value.items())
+    if isinstance(value, _Items):
+        pairs, brackets = value.pairs, "{}"
+    elif isinstance(value, list) or hasattr(value, "__next__"):
+        pairs, brackets = ((None, item) for item in value), "[]"
+    else:
+        write(json.dumps(value, ensure_ascii=False))
+        return
+    empty = True
+    for key, item in pairs:
+        write(("," if not empty else brackets[0]) + newline + "  " * (depth + 1))
+        if key is not None: write(json.dumps(key, ensure_ascii=False) + ": ")
+        dump_json(write, item, newline, depth + 1)
+        empty = False
+    write(brackets if empty else newline + "  " * depth + brackets[1])
+
+def _newline_of(path):
+    with open(path, "rb") as f:
+        return "\r\n" if b"\r\n" in f.read(4096) else "\n"
+
+class Ingestion:
+    """Uma importação: banco atual (questoes.db, só leitura) + questões aceitas (SQLite temporário)."""
+
+    def __init__(self, json_path=question_bank.QUESTOES_FILE, db_path=question_bank.QUESTOES_DB, spool_dir=None):
+        self.json_path = json_path
+        if question_bank.is_stale(json_path, db_path): question_bank.compile_bank(json_path, db_path)
+        self.bank = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        self._tmp = tempfile.TemporaryDirectory(dir=spool_dir)
+        self.spool = sqlite3.connect(os.path.join(self._tmp.name, "ingest.db"))
+        self.spool.executescript("PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;" + SPOOL_SCHEMA)
+        self.masters = {row[0]: row for row in self.bank.execute("SELECT * FROM masters ORDER BY ordem")}
+        self.next_id = (self.bank.execute("SELECT MAX(id) FROM questions").fetchone()[0] or 0) + 1
+        self.stats = Counter()
+        self._pending = []
+        self.spool.executemany("INSERT OR IGNORE INTO hashes VALUES (?, ?, ?)",
+                               ((content_hash(texto), qid, gabarito)
+                                for qid, texto, gabarito in self.bank.execute("SELECT id, texto, gabarito FROM questions")))
+
+    def add(self, raw, default_master=None):
+        """Valida e guarda uma questão; devolve None ou o motivo da rejeição."""
+        self.stats["lidas"] += 1
+        record = canonical_record(raw, default_master)
+        question, problems = validate(record, self.masters)
+        if problems:
+            self.stats["invalidas"] += 1
+            return "; ".join(problems)
+        h = content_hash(question["texto"])
+        # A tabela de hashes é a memória da deduplicação: fica no disco, não no processo
+        if not self.spool.execute("INSERT OR IGNORE INTO hashes VALUES (?, ?, ?)", (h, self.next_id, question["gabarito"])).rowcount:
+            qid, gabarito = self.spool.execute("SELECT id, gabarito FROM hashes WHERE hash = ?", (h,)).fetchone()
+            self.stats["duplicadas"] += 1
+            if gabarito != question["gabarito"]:
+                self.stats["gabarito_divergente"] += 1
+                return f"duplicada da questão {qid}, com gabarito diferente ({gabarito})"
+            return f"duplicada da questão {qid}"
+        self._pending.append((record["master"], record["materia"], record["assunto"], self.next_id,
+                              question["texto"], question["gabarito"], question["explicacao"]))
+        self.next_id += 1
+        self.stats["aceitas"] += 1
+        if len(self._pending) >= INSERT_BATCH: self._flush()
+        return None
+
+    def unreadable(self, error):
+        """Conta uma linha que nem chegou a virar registro (JSON inválido...)."""
+        self.stats["lidas"] += 1
+        self.stats["invalidas"] += 1
+        return error
+
+    def _flush(self):
+        self.spool.executemany("INSERT INTO novas (master, materia, assunto, id, texto, gabarito, explicacao) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?)", self._pending)
+        self._pending = []
+
+    def _plan(self):
+        """{mestre: {matéria: [assuntos]}}: os grupos atuais na ordem do banco e os novos no fim."""
+        plan = {key: {} for key in self.masters}
+        groups = list(self.bank.execute("SELECT master, materia, assunto FROM grupos ORDER BY ordem"))
+        groups += list(self.spool.execute("SELECT master, materia, assunto FROM novas GROUP BY master, materia, assunto ORDER BY MIN(seq)"))
+        for master, materia, assunto in groups:
+            assuntos = plan.setdefault(master, {}).setdefault(materia, [])
+            if assunto not in assuntos: assuntos.append(assunto)
+        return plan
+
+    def _questions(self, group):
+        """Questões do grupo: as do banco, na ordem dele, e depois as importadas."""
+        where = "WHERE master = ? AND materia = ? AND assunto = ?"
+        rows = [self.bank.execute(f"SELECT id, texto, gabarito, explicacao FROM questions {where} ORDER BY ordem", group),
+                self.spool.execute(f"SELECT id, texto, gabarito, explicacao FROM novas {where} ORDER BY seq", group)]
+        for cursor in rows:
+            for qid, texto, gabarito, explicacao in cursor:
+                yield {"id": qid, "texto": texto, "gabarito": gabarito, "explicacao": explicacao}
+
+    def _master(self, key, materias):
+        def assuntos(materia):
+            return _Items((assunto, self._questions((key, materia, assunto))) for assunto in materias[materia])
+        fields = [(f, v) for f, v in zip(question_bank.MASTER_FIELDS, self.masters[key][2:]) if v is not None]
+        return _Items(fields + [("materias", _Items((materia, assuntos(materia)) for materia in materias))])
+
+    def oversized_groups(self):
+        """Grupos que passariam de GROUP_STRIDE questões (a ordem do banco compilado não comporta)."""
+        self._flush()
+        counts = Counter({tuple(g): n for *g, n in self.bank.execute("SELECT master, materia, assunto, COUNT(*) FROM questions GROUP BY 1, 2, 3")})
+        counts.update({tuple(g): n for *g, n in self.spool.execute("SELECT master, materia, assunto, COUNT(*) FROM novas GROUP BY 1, 2, 3")})
+        return [group for group, n in counts.items() if n >= question_bank.GROUP_STRIDE]
+
+    def write(self, path=None):
+        """Grava o banco junto com as questões aceitas: arquivo temporário e troca atômica."""
+        self._flush()
+        path = path or self.json_path
+        newline = _newline_of(self.json_path)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        plan = self._plan()
+        try:
+            with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+                dump_json(f.write, _Items((key, self._master(key, plan[key])) for key in self.masters), newline)
+                f.write(newline)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+
+    def close(self):
+        self.bank.close()
+        self.spool.close()
+        self._tmp.cleanup()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("arquivos", nargs="+", help="CSV ou JSONL a importar")
+    parser.add_argument("--mestre", help="mestre das linhas sem a coluna mestre")
+    parser.add_argument("--json", default=question_bank.QUESTOES_FILE)
+    parser.add_argument("--db", default=question_bank.QUESTOES_DB)
+    parser.add_argument("--simular", action="store_true", help="só valida e conta; não grava nada")
+    parser.add_argument("--rejeitadas", help="CSV com arquivo, linha e motivo de cada linha não importada")
+    args = parser.parse_args(argv)
+
+    ingestion = Ingestion(args.json, args.db)
+    report = open(args.rejeitadas, "w", encoding="utf-8", newline="") if args.rejeitadas else None
+    writer = csv.writer(report) if report else None
+    if writer: writer.writerow(["arquivo", "linha", "motivo"])
+    shown = 0
+    try:
+        for path in args.arquivos:
+            for line_number, raw, error in read_records(path):
+                error = ingestion.add(raw, args.mestre) if raw is not None else ingestion.unreadable(error)
+                if not error: continue
+                if writer: writer.writerow([path, line_number, error])
+                if shown < 20:
+                    print(f"{path}:{line_number}: {error}")
+                    shown += 1
+        stats = ingestion.stats
+        print(f"{stats['lidas']} lida(s): {stats['aceitas']} aceita(s), {stats['duplicadas']} duplicada(s) "
+              f"({stats['gabarito_divergente']} com gabarito divergente), {stats['invalidas']} inválida(s)")
+        oversized = ingestion.oversized_groups()
+        if oversized:
+            print(f"Nada gravado: assunto(s) com {question_bank.GROUP_STRIDE} questões ou mais: {oversized}")
+            return 1
+        if args.simular or not stats["aceitas"]: return 0
+        ingestion.write()
+        print(f"{args.json} gravado (ids {ingestion.next_id - stats['aceitas']} a {ingestion.next_id - 1}); "
+              "o app recompila o banco sozinho, ou rode python question_bank.py")
+        return 0
+    finally:
+        if report: report.close()
+        ingestion.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""Instrumentação leve da Arena: spans por rerun, contadores e exportação Prometheus.
+
+Tudo fica em memória no processo (compartilhado por todas as sessões). O app
+abre um rerun com rerun(usuario); spans e chamadas de API feitas no mesmo
+thread durante esse rerun são atribuídas a ele e ao usuário. O que roda em
+threads de fundo (fila de gravação) entra só nos agregados.
+
+Uso fora do app (ex.: para um coletor textfile do node_exporter):
+    METRICS.write_textfile("/var/lib/node_exporter/arena.prom")
+"""
+import contextlib
+import functools
+import os
+import threading
+import time
+from collections import deque
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RECENT_RERUNS = 500
+RECENT_SAMPLES = 1000
+TOP_USERS = 50
+ANONYMOUS = "(anônimo)"
+BACKGROUND = "(segundo plano)"
+
+class _SpanStats:
+    """Histograma cumulativo (Prometheus) + últimas amostras (percentis do painel)."""
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound: self.buckets[i] += 1
+
+def percentile(values, p):
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+class Metrics:
+    def __init__(self, recent=RECENT_RERUNS):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._spans = {}
+        self._api_calls = {}
+        self._users = {}
+        self._recent = deque(maxlen=recent)
+        self.started_at = time.time()
+
+    def _current(self):
+        return getattr(self._local, "rerun", None)
+
+    def _observe(self, name, seconds):
+        with self._lock:
+            self._spans.setdefault(name, _SpanStats()).observe(seconds)
+
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self._observe(name, seconds)
+            rerun = self._current()
+            if rerun is not None: rerun["spans"].append((name, seconds))
+
+    def observe(self, name, seconds):
+        """Registra uma duração medida fora de um span (ex.: do envio do login até a primeira tela pronta)."""
+        self._observe(name, seconds)
+
+    def timed(self, name=None):
+        """Decorador: cada chamada da função vira um span (nome padrão = nome da função)."""
+        def decorator(fn):
+            span_name = name or fn.__name__
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextlib.contextmanager
+    def rerun(self, user=None, kind="rerun"):
+        """Delimita um rerun; aninhado (fragmento dentro de um rerun completo) vira só um span."""
+        if self._current() is not None:
+            with self.span(kind):
+                yield
+            return
+        self._local.rerun = {"user": user or ANONYMOUS, "kind": kind, "ts": time.time(), "spans": [], "api_calls": 0}
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            rerun = self._local.rerun
+            self._local.rerun = None
+            rerun["seconds"] = time.perf_counter() - start
+            self._observe(kind, rerun["seconds"])
+            with self._lock:
+                u = self._user_stats(rerun["user"])
+                u["reruns"] += 1
+                u["seconds"] += rerun["seconds"]
+                u["max_seconds"] = max(u["max_seconds"], rerun["seconds"])
+                self._recent.append(rerun)
+
+    def set_user(self, user):
+        """Troca o usuário do rerun em andamento (ex.: logo após o login)."""
+        rerun = self._current()
+        if rerun is not None: rerun["user"] = user
+
+    def _user_stats(self, user):
+        return self._users.setdefault(user, {"reruns": 0, "seconds": 0.0, "max_seconds": 0.0, "api_calls": 0})
+
+    def api_call(self, backend, method):
+        """Conta uma chamada a um serviço externo, atribuída ao usuário do rerun atual."""
+        rerun = self._current()
+        if rerun is not None: rerun["api_calls"] += 1
+        with self._lock:
+            key = (backend, method)
+            self._api_calls[key] = self._api_calls.get(key, 0) + 1
+            self._user_stats(rerun["user"] if rerun is not None else BACKGROUND)["api_calls"] += 1
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._api_calls.clear()
+            self._users.clear()
+            self._recent.clear()
+            self.started_at = time.time()
+
+    # -------------------------------------------------------------------------
+    # LEITURA
+    # -------------------------------------------------------------------------
+    def span_table(self):
+        with self._lock:
+            items = [(name, s.count, s.total, s.max, list(s.samples)) for name, s in self._spans.items()]
+        rows = [{"span": name, "chamadas": count, "total_s": round(total, 3),
+                 "media_ms": round(total / count * 1000, 1) if count else 0.0,
+                 "p95_ms": round(percentile(samples, 95) * 1000, 1), "max_ms": round(peak * 1000, 1)}
+                for name, count, total, peak, samples in items]
+        return sorted(rows, key=lambda r: r["total_s"], reverse=True)
+
+    def user_table(self):
+        with self._lock:
+            items = [(user, dict(u)) for user, u in self._users.items()]
+        rows = [{"usuario": user, "reruns": u["reruns"], "chamadas_api": u["api_calls"],
+                 "media_ms": round(u["seconds"] / u["reruns"] * 1000, 1) if u["reruns"] else 0.0,
+                 "max_ms": round(u["max_seconds"] * 1000, 1)}
+                for user, u in items]
+        return sorted(rows, key=lambda r: (r["chamadas_api"], r["media_ms"]), reverse=True)
+
+    def api_table(self):
+        with self._lock:
+            items = list(self._api_calls.items())
+        return sorted(({"backend": b, "metodo": m, "chamadas": n} for (b, m), n in items),
+                      key=lambda r: r["chamadas"], reverse=True)
+
+    def recent_reruns(self, user=None, since=0.0):
+        """Reruns guardados (mais antigos primeiro), só os do usuário e iniciados a partir de since (time.time())."""
+        with self._lock:
+            recent = list(self._recent)
+        return [r for r in recent if (user is None or r["user"] == user) and r["ts"] >= since]
+
+    def keep_recent(self, n):
+        """Quantos reruns recentes guardar (o benchmark guarda todos os de uma rodada)."""
+        with self._lock:
+            self._recent = deque(self._recent, maxlen=n)
+
+    def slowest_reruns(self, n=20):
+        with self._lock:
+            recent = list(self._recent)
+        return sorted(recent, key=lambda r: r["seconds"], reverse=True)[:n]
+
+    def prometheus(self):
+        """Texto no formato de exposição do Prometheus."""
+        with self._lock:
+            spans = [(name, list(s.buckets), s.count, s.total) for name, s in self._spans.items()]
+            api = list(self._api_calls.items())
+            users = sorted(self._users.items(), key=lambda kv: kv[1]["api_calls"], reverse=True)[:TOP_USERS]
+            users = [(user, dict(u)) for user, u in users]
+        lines = ["# HELP arena_uptime_seconds Tempo desde o início (ou último reset) das métricas.",
+                 "# TYPE arena_uptime_seconds gauge",
+                 f"arena_uptime_seconds {time.time() - self.started_at:.3f}",
+                 "# HELP arena_span_seconds Duração dos trechos instrumentados (reruns inclusive).",
+                 "# TYPE arena_span_seconds histogram"]
+        for name, buckets, count, total in sorted(spans):
+            label = f'span="{_label(name)}"'
+            for bound, value in zip(BUCKETS, buckets):
+                lines.append(f'arena_span_seconds_bucket{{{label},le="{bound}"}} {value}')
+            lines.append(f'arena_span_seconds_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f"arena_span_seconds_sum{{{label}}} {total:.6f}")
+            lines.append(f"arena_span_seconds_count{{{label}}} {count}")
+        lines += ["# HELP arena_api_calls_total Chamadas a serviços externos.",
+                  "# TYPE arena_api_calls_total counter"]
+        for (backend, method), n in sorted(api):
+            lines.append(f'arena_api_calls_total{{backend="{_label(backend)}",method="{_label(method)}"}} {n}')
+        lines += [f"# HELP arena_user_reruns_total Reruns por usuário (top {TOP_USERS} em chamadas de API).",
+                  "# TYPE arena_user_reruns_total counter"]
+        lines += [f'arena_user_reruns_total{{user="{_label(user)}"}} {u["reruns"]}' for user, u in users]
+        lines += ["# HELP arena_user_rerun_seconds_total Tempo de rerun somado por usuário.",
+                  "# TYPE arena_user_rerun_seconds_total counter"]
+        lines += [f'arena_user_rerun_seconds_total{{user="{_label(user)}"}} {u["seconds"]:.6f}' for user, u in users]
+        lines += ["# HELP arena_user_api_calls_total Chamadas de API atribuídas a cada usuário.",
+                  "# TYPE arena_user_api_calls_total counter"]
+        lines += [f'arena_user_api_calls_total{{user="{_label(user)}"}} {u["api_calls"]}' for user, u in users]
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Grava prometheus() de forma atômica (para o coletor textfile do node_exporter)."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+METRICS = Metrics()
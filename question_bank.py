@@ -0,0 +1,439 @@
+"""Banco de questões compilado: questoes.json -> SQLite indexado.
+
+O app não carrega mais o JSON inteiro em memória: consulta só a lista de
+matérias/assuntos exibida e as questões do assunto escolhido. Quando o JSON
+muda, só os grupos (mestre, matéria, assunto) cujo conteúdo mudou são regravados.
+
+Uso (etapa de build, opcional; o app também compila sozinho quando o JSON muda):
+    python question_bank.py [questoes.json] [questoes.db]
+    python question_bank.py --memoria      # footprint de uma doctore_session
+"""
+import hashlib
+import html
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from html.parser import HTMLParser
+
+QUESTOES_FILE = "questoes.json"
+QUESTOES_DB = "questoes.db"
+SCHEMA_VERSION = "4"
+# Páginas do banco lidas via mmap: o page cache do SO é compartilhado por todos os workers
+MMAP_SIZE = 256 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE masters (
+    key TEXT PRIMARY KEY, ordem INTEGER, nome TEXT, descricao TEXT,
+    imagem TEXT, especialidades TEXT, audio TEXT
+);
+CREATE TABLE questions (
+    id INTEGER PRIMARY KEY, master TEXT NOT NULL, materia TEXT NOT NULL,
+    assunto TEXT NOT NULL, ordem INTEGER NOT NULL,
+    texto TEXT, gabarito TEXT, explicacao TEXT,
+    banca TEXT, ano INTEGER, orgao TEXT,
+    card_html TEXT, feedback_html TEXT
+);
+CREATE TABLE grupos (
+    master TEXT NOT NULL, materia TEXT NOT NULL, assunto TEXT NOT NULL,
+    ordem INTEGER NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (master, materia, assunto)
+);
+CREATE INDEX idx_questions_master ON questions (master, ordem);
+CREATE INDEX idx_questions_assunto ON questions (master, materia, assunto, ordem);
+-- Busca textual: rowid = id da questão; acentos e maiúsculas são ignorados (no índice e na consulta)
+CREATE VIRTUAL TABLE busca USING fts5(
+    texto, explicacao, materia, assunto, banca, ano, orgao, master UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+MASTER_FIELDS = ["nome", "descricao", "imagem", "especialidades", "audio"]
+# ordem da questão = índice do grupo * GROUP_STRIDE + posição dentro do grupo
+GROUP_STRIDE = 100_000
+SEARCH_LIMIT = 200
+# "<strong>Metadados:</strong> CEBRASPE (CESPE) / 2006 / CL DF" -> banca / ano / órgão
+METADADOS_RE = re.compile(r"Metadados:\s*(?:</strong>)?\s*([^<]*)", re.IGNORECASE)
+ARTIGO_RE = re.compile(r"\bart(?:igo)?s?\.?\s*(\d+)[º°]?", re.IGNORECASE)
+
+# Tags aceitas no texto e na explicação (o app mostra os dois como HTML); nenhuma com atributos
+ALLOWED_TAGS = {"strong", "b", "em", "i", "br"}
+VOID_TAGS = {"br"}
+# Tags descartadas junto com o conteúdo (as outras fora da lista perdem só a tag)
+DROP_CONTENT_TAGS = {"script", "style", "iframe", "object", "embed", "template", "svg", "math"}
+# Bloco de Metadados no início da explicação, já saneada (vira o cabeçalho do card)
+METADADOS_BLOCK_RE = re.compile(r"^\s*(?:<(?:strong|b)>)?\s*Metadados:\s*(?:</(?:strong|b)>)?\s*([^<]*)(?:<br>\s*)*", re.IGNORECASE)
+
+# -----------------------------------------------------------------------------
+# COMPILAÇÃO
+# -----------------------------------------------------------------------------
+class _Sanitizer(HTMLParser):
+    """Reescreve o HTML só com ALLOWED_TAGS, sem atributos, texto escapado e tags balanceadas."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.problems = []
+        self.open_tags = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS: self.dropping += 1
+        if self.dropping or tag not in ALLOWED_TAGS:
+            self.problems.append(f"tag <{tag}> não permitida")
+            return
+        if attrs: self.problems.append(f"atributos em <{tag}>")
+        self.out.append(f"<{tag}>")
+        if tag not in VOID_TAGS: self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in VOID_TAGS and not self.dropping: self.handle_starttag(tag, attrs)
+        else: self.problems.append(f"tag <{tag}/> não permitida")
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping = max(0, self.dropping - 1)
+            return
+        if self.dropping or tag in VOID_TAGS or tag not in ALLOWED_TAGS: return
+        if tag not in self.open_tags:
+            self.problems.append(f"</{tag}> sem abertura")
+            return
+        while self.open_tags:
+            last = self.open_tags.pop()
+            self.out.append(f"</{last}>")
+            if last == tag: break
+            self.problems.append(f"<{last}> não fechada")
+
+    def handle_data(self, data):
+        if not self.dropping: self.out.append(html.escape(data, quote=False))
+
+    def result(self):
+        self.close()
+        self.problems += [f"<{tag}> não fechada" for tag in self.open_tags]
+        return "".join(self.out + [f"</{tag}>" for tag in reversed(self.open_tags)]), self.problems
+
+def sanitize_html(fragment):
+    """(HTML saneado, problemas encontrados) de um texto ou explicação."""
+    sanitizer = _Sanitizer()
+    sanitizer.feed(fragment or "")
+    return sanitizer.result()
+
+def html_problems(fragment):
+    """Problemas do HTML de uma questão (tags fora de ALLOWED_TAGS, atributos, tags desbalanceadas)."""
+    return sanitize_html(fragment)[1]
+
+def render_question(texto, explicacao):
+    """({card_html, feedback_html, banca, ano, orgao}, problemas): fragmentos prontos para o app.
+
+    A linha de Metadados sai da explicação e vira o cabeçalho do card (banca ·
+    ano · órgão quando estruturada; senão o texto como veio). Mudou o formato
+    daqui? Suba SCHEMA_VERSION para o banco ser recompilado.
+    """
+    card, problems = sanitize_html(texto)
+    feedback, feedback_problems = sanitize_html(explicacao)
+    meta = parse_metadados(feedback)
+    block = METADADOS_BLOCK_RE.match(feedback)
+    line = block.group(1).strip() if block else ""
+    if block: feedback = feedback[block.end():].strip()
+    if meta["banca"]: line = html.escape(" · ".join(str(v) for v in (meta["banca"], meta["ano"], meta["orgao"]) if v), quote=False)
+    header = f"<div class='doctore-meta'>{line}</div>" if line else ""
+    rendered = {"card_html": f"<div class='doctore-card'>{header}{card}</div>",
+                "feedback_html": f"<div class='feedback-box'>{feedback}</div>" if feedback else ""}
+    return dict(rendered, **meta), problems + feedback_problems
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def parse_metadados(explicacao):
+    """{"banca", "ano", "orgao"} da linha de Metadados da explicação (None no que não houver)."""
+    meta = {"banca": None, "ano": None, "orgao": None}
+    match = METADADOS_RE.search(explicacao or "")
+    if not match: return meta
+    parts = [p.strip() for p in html.unescape(match.group(1)).split("/")]
+    if len(parts) >= 3 and re.fullmatch(r"\d{4}", parts[1]):
+        meta.update(banca=parts[0], ano=int(parts[1]), orgao=" / ".join(parts[2:]).rstrip("."))
+    return meta
+
+def plain_text(fragment):
+    """HTML -> texto corrido, para indexar ("5º" vira "5", como na consulta)."""
+    text = html.unescape(re.sub(r"<[^>]+>", " ", fragment or ""))
+    return " ".join(re.sub(r"(\d)[º°]", r"\1", text).split())
+
+def fts_query(text):
+    """Busca do aluno -> expressão FTS5: todos os termos (E), "art. 18" como frase e o último termo como prefixo."""
+    terms = [f'("art {n}" OR "artigo {n}")' for n in ARTIGO_RE.findall(text)]
+    words = re.findall(r"\w+", ARTIGO_RE.sub(" ", text))
+    terms += [f'"{w}"' for w in words]
+    if words and len(words[-1]) >= 3: terms[-1] += "*"
+    return " AND ".join(terms)
+
+def _groups(data):
+    """(grupo, questões) na ordem do JSON; grupo = (master, materia, assunto)."""
+    for key, master in data.items():
+        for materia, assuntos in (master.get("materias") or {}).items():
+            for assunto, questions in assuntos.items():
+                yield (key, materia, assunto), questions
+
+def _group_hash(questions):
+    return hashlib.sha256(json.dumps(questions, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:16]
+
+def _sync(conn, data, source_hash):
+    """Deixa o banco aberto em conn igual a data, regravando só os grupos novos ou alterados."""
+    current = {(m, ma, a): (ordem, h) for m, ma, a, ordem, h in conn.execute("SELECT * FROM grupos")}
+    wanted = {group: (g_idx, _group_hash(questions), questions)
+              for g_idx, (group, questions) in enumerate(_groups(data))}
+    where = "WHERE master = ? AND materia = ? AND assunto = ?"
+    # Remoções antes das inserções: uma questão pode ter mudado de assunto
+    for group, (_, h) in current.items():
+        if group not in wanted or wanted[group][1] != h:
+            conn.execute(f"DELETE FROM busca WHERE rowid IN (SELECT id FROM questions {where})", group)
+            conn.execute(f"DELETE FROM questions {where}", group)
+            conn.execute(f"DELETE FROM grupos {where}", group)
+    changed = []
+    for group, (g_idx, h, questions) in wanted.items():
+        old = current.get(group)
+        if old and old[1] == h:
+            if old[0] != g_idx:  # só mudou de posição: desloca a ordem, sem regravar as questões
+                conn.execute(f"UPDATE questions SET ordem = ordem + ? {where}", ((g_idx - old[0]) * GROUP_STRIDE,) + group)
+                conn.execute(f"UPDATE grupos SET ordem = ? {where}", (g_idx,) + group)
+            continue
+        rows, index = [], []
+        for i, q in enumerate(questions):
+            meta, problems = render_question(q.get("texto", ""), q.get("explicacao", ""))
+            if problems: print(f"Questão {q['id']}: HTML saneado ({'; '.join(problems)})")
+            rows.append((q["id"],) + group + (g_idx * GROUP_STRIDE + i, q.get("texto", ""), q.get("gabarito", ""),
+                                              q.get("explicacao", ""), meta["banca"], meta["ano"], meta["orgao"],
+                                              meta["card_html"], meta["feedback_html"]))
+            index.append((q["id"], plain_text(q.get("texto", "")), plain_text(q.get("explicacao", "")), group[1], group[2],
+                          meta["banca"], meta["ano"], meta["orgao"], group[0]))
+        conn.executemany("INSERT INTO questions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.executemany("INSERT INTO busca (rowid, texto, explicacao, materia, assunto, banca, ano, orgao, master) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", index)
+        conn.execute("INSERT INTO grupos VALUES (?, ?, ?, ?, ?)", group + (g_idx, h))
+        changed.append(group)
+    # Mestres são poucos: sempre regravados
+    conn.execute("DELETE FROM masters")
+    conn.executemany("INSERT INTO masters VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     [[key, m_idx] + [master.get(f) for f in MASTER_FIELDS] for m_idx, (key, master) in enumerate(data.items())])
+    conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                     [("source_hash", source_hash), ("schema", SCHEMA_VERSION)])
+    return changed
+
+def build_bank(data, db_path, source_hash="", incremental=False):
+    """Grava o dicionário master -> materia -> assunto -> [questões] no SQLite (troca atômica).
+
+    Com incremental=True parte de uma cópia do banco atual e regrava só os grupos que mudaram.
+    Devolve a lista de grupos (master, materia, assunto) regravados.
+    """
+    tmp_path = f"{db_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path): os.remove(tmp_path)
+    reuse = incremental and read_meta(db_path).get("schema") == SCHEMA_VERSION
+    if reuse: shutil.copyfile(db_path, tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        if not reuse: conn.executescript(SCHEMA)
+        changed = _sync(conn, data, source_hash)
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
+    return changed
+
+def compile_bank(json_path=QUESTOES_FILE, db_path=QUESTOES_DB):
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return build_bank(data, db_path, file_hash(json_path), incremental=True)
+
+def read_meta(db_path):
+    """Tabela meta do banco ({} se ele não existir ou não puder ser lido)."""
+    if not os.path.exists(db_path): return {}
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            return dict(conn.execute("SELECT key, value FROM meta"))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return {}
+
+def is_stale(json_path=QUESTOES_FILE, db_path=QUESTOES_DB):
+    """True se o .db não existe ou foi compilado de outro conteúdo/esquema."""
+    if not os.path.exists(db_path): return True
+    if not os.path.exists(json_path): return False
+    meta = read_meta(db_path)
+    if meta.get("schema") != SCHEMA_VERSION: return True
+    # Se o .db é mais novo que o JSON, confia no hash gravado sem reler o arquivo
+    if os.path.getmtime(db_path) >= os.path.getmtime(json_path) and meta.get("source_hash"): return False
+    return meta.get("source_hash") != file_hash(json_path)
+
+# -----------------------------------------------------------------------------
+# CONSULTA
+# -----------------------------------------------------------------------------
+class QuestionBank:
+    """Acesso somente leitura ao banco compilado, compartilhado entre as sessões do processo."""
+
+    def __init__(self, db_path=QUESTOES_DB):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self._conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        self._conn.row_factory = sqlite3.Row
+        self.source_hash = dict(self._conn.execute("SELECT key, value FROM meta")).get("source_hash", "")
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def masters(self):
+        rows = self._query("SELECT * FROM masters ORDER BY ordem")
+        return {r["key"]: {f: r[f] for f in MASTER_FIELDS if r[f] is not None} for r in rows}
+
+    def materias(self, master):
+        rows = self._query("SELECT materia FROM questions WHERE master = ? "
+                           "GROUP BY materia ORDER BY MIN(ordem)", (master,))
+        return [r["materia"] for r in rows]
+
+    def assuntos(self, master, materia):
+        rows = self._query("SELECT assunto FROM questions WHERE master = ? AND materia = ? "
+                           "GROUP BY assunto ORDER BY MIN(ordem)", (master, materia))
+        return [r["assunto"] for r in rows]
+
+    def count(self):
+        return self._query("SELECT COUNT(*) AS n FROM questions")[0]["n"]
+
+    def question_ids(self, master, materia, assunto):
+        rows = self._query("SELECT id FROM questions WHERE master = ? AND materia = ? AND assunto = ? "
+                           "ORDER BY ordem", (master, materia, assunto))
+        return [r["id"] for r in rows]
+
+    def master_ids(self, master):
+        return [r["id"] for r in self._query("SELECT id FROM questions WHERE master = ? ORDER BY ordem", (master,))]
+
+    def search(self, query, master=None, limit=SEARCH_LIMIT):
+        """Questões que casam com a busca, mais relevantes primeiro (índice FTS5, sem varrer as questões)."""
+        expr = fts_query(query)
+        if not expr: return []
+        rows = self._query("SELECT q.id, q.materia, q.assunto, q.banca, q.ano, q.orgao, "
+                           "snippet(busca, 0, '', '', '…', 16) AS trecho "
+                           "FROM busca JOIN questions q ON q.id = busca.rowid "
+                           "WHERE busca MATCH ? AND (? IS NULL OR busca.master = ?) ORDER BY bm25(busca) LIMIT ?",
+                           (expr, master, master, limit))
+        return [dict(r) for r in rows]
+
+    def all_ids(self):
+        return [r["id"] for r in self._query("SELECT id FROM questions ORDER BY ordem")]
+
+    def catalog(self):
+        """{coluna: lista} com id, mestre, matéria, assunto e gabarito de todas as questões (para a análise)."""
+        rows = self._query("SELECT id, master, materia, assunto, gabarito FROM questions ORDER BY ordem")
+        return {k: [r[k] for r in rows] for k in ("id", "master", "materia", "assunto", "gabarito")}
+
+    def master_of(self, qid):
+        rows = self._query("SELECT master FROM questions WHERE id = ?", (qid,))
+        return rows[0]["master"] if rows else None
+
+    def question(self, qid):
+        """Só o que o card precisa: gabarito e os fragmentos já saneados (render_question)."""
+        rows = self._query("SELECT id, gabarito, card_html, feedback_html FROM questions WHERE id = ?", (qid,))
+        return dict(rows[0]) if rows else None
+
+class BankWatcher:
+    """Mantém o banco em dia com o questoes.json enquanto o processo roda.
+
+    A cada CHECK_INTERVAL compara mtime/tamanho do JSON; se mudaram, confirma
+    pelo hash do conteúdo, recompila só os grupos alterados e reabre o banco.
+    Se outro processo já recompilou, apenas reabre.
+    """
+    CHECK_INTERVAL = 5.0
+
+    def __init__(self, json_path=QUESTOES_FILE, db_path=QUESTOES_DB):
+        self.json_path = json_path
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._checked_at = time.monotonic()
+        self._stat = self._file_stat()
+        self.last_changes = []
+        self._compile()
+        self.bank = QuestionBank(db_path)
+
+    def _file_stat(self):
+        try:
+            st = os.stat(self.json_path)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def _compile(self):
+        try:
+            if is_stale(self.json_path, self.db_path):
+                self.last_changes = compile_bank(self.json_path, self.db_path)
+        except Exception as e:
+            # JSON inválido no meio de uma edição: segue com o banco atual
+            if not os.path.exists(self.db_path): raise
+            print(f"Erro ao compilar {self.json_path}: {e}")
+
+    def current(self):
+        """(banco, recarregado): recarregado=True quando o banco foi trocado nesta chamada."""
+        if time.monotonic() - self._checked_at < self.CHECK_INTERVAL: return self.bank, False
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.CHECK_INTERVAL: return self.bank, False
+            self._checked_at = time.monotonic()
+            stat = self._file_stat()
+            if stat == self._stat: return self.bank, False
+            self._stat = stat
+            self._compile()
+            if read_meta(self.db_path).get("source_hash", "") == self.bank.source_hash: return self.bank, False
+            # O banco antigo não é fechado: sessões no meio de uma consulta ainda o usam (o GC fecha)
+            self.bank = QuestionBank(self.db_path)
+            return self.bank, True
+
+# -----------------------------------------------------------------------------
+# RELATÓRIO DE MEMÓRIA
+# -----------------------------------------------------------------------------
+def deep_sizeof(obj, seen=None):
+    """Bytes ocupados por obj e tudo que ele referencia (cada objeto contado uma vez)."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen: return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+def memory_report(bank, n_questions=30, wrong_ratio=0.3):
+    """Compara a doctore_session antiga (dicts completos) com a atual (ids) para n questões."""
+    ids = bank.all_ids()[:n_questions]
+    wrong = set(random.sample(ids, int(len(ids) * wrong_ratio)))
+    # Cada sessão antiga recebia cópias próprias dos dicts do questoes.json (texto e explicação crus)
+    rows = bank._query(f"SELECT id, texto, gabarito, explicacao FROM questions "
+                       f"WHERE id IN ({','.join('?' * len(ids))})", ids)
+    by_id = {r["id"]: dict(r) for r in rows}
+    old_questions = [by_id[qid] for qid in ids]
+    before = {"active": True, "questions": old_questions, "idx": 0, "mode": "normal",
+              "wrong_ids": [q for q in old_questions if q["id"] in wrong]}
+    after = {"active": True, "questions": array("l", ids), "idx": 0, "mode": "normal", "wrong_ids": wrong}
+    return {"questoes": len(ids), "antes_bytes": deep_sizeof(before), "depois_bytes": deep_sizeof(after)}
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    src = args[0] if len(args) > 0 else QUESTOES_FILE
+    dst = args[1] if len(args) > 1 else QUESTOES_DB
+    changed = compile_bank(src, dst)
+    bank = QuestionBank(dst)
+    print(f"{dst}: {len(bank.masters())} mestres, {bank.count()} questões ({len(changed)} assunto(s) regravado(s))")
+    if "--memoria" in sys.argv:
+        report = memory_report(bank)
+        print(f"doctore_session com {report['questoes']} questões: "
+              f"antes {report['antes_bytes']:,} bytes, depois {report['depois_bytes']:,} bytes "
+              f"({report['antes_bytes'] / max(1, report['depois_bytes']):.1f}x menor)")
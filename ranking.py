@@ -0,0 +1,126 @@
+"""Ranking dos gladiadores a partir dos resumos gravados junto com cada registro.
+
+O storage mantém um resumo pequeno por usuário (storage.ranking_summary),
+atualizado na mesma gravação do registro: os JSONs completos nunca são lidos.
+Aqui os resumos viram índices ordenados em memória, um por período e critério,
+refeitos a cada TTL: o top-N é uma fatia da lista e a posição de um usuário
+sai por busca binária.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import date, timedelta
+
+from storage import RANKING_DAYS
+
+TTL = 60
+MIN_QUESTOES = 20  # com menos questões no período, o aproveitamento não entra no ranking
+PERIODS = {"geral": "Geral", "semana": f"Últimos {RANKING_DAYS} dias", "hoje": "Hoje"}
+CRITERIA = {"acertos": "Acertos", "aproveitamento": "Aproveitamento", "fase": "Fase"}
+
+Entry = namedtuple("Entry", ["login", "nome", "acertos", "questoes", "fase", "ultima"])
+
+def period_totals(summary, period, today=None):
+    """(acertos, questões) do resumo no período: geral, semana (últimos RANKING_DAYS dias) ou hoje."""
+    if period == "geral": return summary["acertos"], summary["questoes"]
+    today = today or date.today()
+    start = today if period == "hoje" else today - timedelta(days=RANKING_DAYS - 1)
+    start, end = start.isoformat(), today.isoformat()
+    acertos = questoes = 0
+    for day, (a, t) in summary["dias"].items():
+        if start <= day <= end:
+            acertos += a
+            questoes += t
+    return acertos, questoes
+
+def entry(login, nome, summary, period, today=None):
+    acertos, questoes = period_totals(summary, period, today)
+    return Entry(login, nome, acertos, questoes, summary["fase"], summary["ultima"])
+
+def score(e, criterion):
+    """Chave de ordenação (maior = melhor); None = fora do ranking (sem questões no período)."""
+    if e.questoes <= 0: return None
+    if criterion == "aproveitamento":
+        if e.questoes < MIN_QUESTOES: return None
+        return (e.acertos / e.questoes, e.acertos)
+    if criterion == "fase": return (e.fase, e.acertos)
+    # Empate em acertos: quem precisou de menos questões fica na frente
+    return (e.acertos, -e.questoes)
+
+def _negate(key):
+    return tuple(-v for v in key)
+
+class Board:
+    """Entradas de um período e critério, da melhor para a pior.
+
+    keys guarda as chaves negadas (ordem crescente) para o bisect; posições
+    empatadas são iguais (1, 2, 2, 4...).
+    """
+
+    def __init__(self, entries, criterion):
+        self.criterion = criterion
+        scored = sorted((_negate(key), e.login, e) for e in entries for key in [score(e, criterion)] if key is not None)
+        self.keys = [k for k, _, _ in scored]
+        self.entries = [e for _, _, e in scored]
+        self._index = {e.login: i for i, e in enumerate(self.entries)}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def top(self, n):
+        """[(posição, Entry)] dos n primeiros."""
+        return [(bisect_left(self.keys, self.keys[i]) + 1, e) for i, e in enumerate(self.entries[:n])]
+
+    def position(self, login, current=None):
+        """(posição, participantes) do login, ou None se ele estiver fora do ranking.
+
+        current é a entrada mais nova do próprio usuário (a da sessão): ela é
+        comparada com o índice no lugar da entrada antiga, em O(log n).
+        """
+        i = self._index.get(login)
+        if current is None:
+            if i is None: return None
+            return bisect_left(self.keys, self.keys[i]) + 1, len(self.keys)
+        key = score(current, self.criterion)
+        if key is None: return None
+        key = _negate(key)
+        better = bisect_left(self.keys, key)
+        if i is None: return better + 1, len(self.keys) + 1
+        if self.keys[i] < key: better -= 1  # a entrada antiga do próprio usuário não conta
+        return better + 1, len(self.keys)
+
+class Leaderboard:
+    """Índices do ranking por (período, critério), refeitos a partir do loader a cada TTL.
+
+    loader() devolve [(login, nome, resumo)]. Cada índice é montado na primeira
+    consulta da combinação e dura até o próximo carregamento (ou a virada do dia).
+    """
+
+    def __init__(self, loader, ttl=TTL):
+        self._loader = loader
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._rows = []
+        self._boards = {}
+        self._built_at = 0.0
+        self._day = None
+
+    def board(self, period="geral", criterion="acertos"):
+        with self._lock:
+            now, today = time.time(), date.today()
+            if now - self._built_at > self.ttl:
+                self._rows = list(self._loader())
+                self._built_at = now
+                self._boards = {}
+            if today != self._day:
+                self._day = today
+                self._boards = {}
+            if (period, criterion) not in self._boards:
+                entries = [entry(login, nome, summary, period, today) for login, nome, summary in self._rows]
+                self._boards[(period, criterion)] = Board(entries, criterion)
+            return self._boards[(period, criterion)]
+
+    def invalidate(self):
+        with self._lock:
+            self._built_at = 0.0
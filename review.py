@@ -0,0 +1,177 @@
+"""Revisão espaçada do Doctore (SM-2): agenda por usuário e questão.
+
+Cada questão respondida vira um cartão (próxima revisão, intervalo, facilidade,
+repetições). Para escolher o que revisar, cada mestre tem um heap por data de
+revisão: a próxima questão vencida sai em O(log n), sem varrer o banco.
+
+A agenda é gravada num formato compacto: colunas binárias de tamanho fixo,
+comprimidas (zlib) e em base64, para caber em células do Sheets.
+"""
+import base64
+import heapq
+import random
+import struct
+import sys
+import time
+import zlib
+from array import array
+from collections import namedtuple
+from datetime import date
+
+# Respostas do Doctore são só certo/errado: viram as notas 4 e 2 da escala 0-5 do SM-2
+QUALITY_CERTO = 4
+QUALITY_ERRADO = 2
+INITIAL_EASE = 250  # facilidade em centésimos (2,5)
+MIN_EASE = 130
+FORMAT_VERSION = 1
+# Colunas do formato compacto (typecodes de tamanho fixo em todas as plataformas)
+LAYOUT = (("qid", "q"), ("due", "i"), ("interval", "i"), ("ease", "H"), ("reps", "H"), ("seen", "q"))
+
+# due = dia (date.toordinal) da próxima revisão; seen = timestamp da última resposta
+Card = namedtuple("Card", ["due", "interval", "ease", "reps", "seen"])
+
+def day_number(ts=None):
+    return date.fromtimestamp(time.time() if ts is None else ts).toordinal()
+
+def schedule(card, correct, now=None):
+    """Cartão depois de uma resposta (card=None para questão nunca vista)."""
+    now = int(time.time() if now is None else now)
+    if card is None: card = Card(0, 0, INITIAL_EASE, 0, 0)
+    q = QUALITY_CERTO if correct else QUALITY_ERRADO
+    ease = max(MIN_EASE, card.ease + round(100 * (0.1 - (5 - q) * (0.08 + (5 - q) * 0.02))))
+    if correct:
+        reps = card.reps + 1
+        interval = 1 if reps == 1 else 6 if reps == 2 else max(1, round(card.interval * ease / 100))
+    else:
+        reps, interval = 0, 1
+    return Card(day_number(now) + interval, interval, ease, reps, now)
+
+def merge(stored, updates):
+    """Junta cartões em stored (no lugar): em cada questão vale a resposta mais recente."""
+    for qid, card in updates.items():
+        current = stored.get(qid)
+        if current is None or card.seen >= current.seen: stored[qid] = card
+    return stored
+
+# -----------------------------------------------------------------------------
+# FORMATO COMPACTO
+# -----------------------------------------------------------------------------
+def pack(cards):
+    ids = sorted(cards)
+    columns = [array("q", ids)] + [array(code, (cards[qid][i] for qid in ids)) for i, (_, code) in enumerate(LAYOUT[1:])]
+    if sys.byteorder == "big":
+        for column in columns: column.byteswap()
+    raw = struct.pack("<BI", FORMAT_VERSION, len(ids)) + b"".join(column.tobytes() for column in columns)
+    return base64.b64encode(zlib.compress(raw, 9)).decode("ascii")
+
+def unpack(blob):
+    """{qid: Card} a partir de pack(); vazio para agenda inexistente."""
+    if not blob: return {}
+    raw = zlib.decompress(base64.b64decode(blob))
+    version, n = struct.unpack_from("<BI", raw)
+    if version != FORMAT_VERSION: raise ValueError(f"Formato de agenda desconhecido: {version}")
+    offset = struct.calcsize("<BI")
+    columns = []
+    for _, code in LAYOUT:
+        column = array(code)
+        column.frombytes(raw[offset:offset + n * column.itemsize])
+        if sys.byteorder == "big": column.byteswap()
+        offset += n * column.itemsize
+        columns.append(column)
+    return {qid: Card(*fields) for qid, *fields in zip(*columns)}
+
+def merge_blob(blob, updates):
+    """merge() direto sobre o formato gravado (usado pelo storage.update_reviews)."""
+    return pack(merge(unpack(blob), updates))
+
+# -----------------------------------------------------------------------------
+# AGENDA
+# -----------------------------------------------------------------------------
+class _Pool:
+    """Conjunto com remoção e sorteio sem varredura (lista + posição de cada item)."""
+
+    def __init__(self, items):
+        self.items = list(items)
+        self.pos = {item: i for i, item in enumerate(self.items)}
+
+    def __len__(self):
+        return len(self.items)
+
+    def discard(self, item):
+        i = self.pos.pop(item, None)
+        if i is None: return
+        last = self.items.pop()
+        if i < len(self.items):
+            self.items[i] = last
+            self.pos[last] = i
+
+    def sample(self, n):
+        return random.sample(self.items, min(n, len(self.items)))
+
+class ReviewSchedule:
+    """Cartões de um usuário e, por grupo de questões (um mestre), um heap (due, qid)
+    e o conjunto das questões ainda não vistas.
+
+    Revisar não remove a entrada antiga do heap: ela é descartada quando chega
+    ao topo e o due não bate mais com o do cartão (remoção preguiçosa).
+    """
+
+    def __init__(self, cards=None):
+        self.cards = dict(cards or {})
+        self._queues = {}
+        self._unseen = {}
+        self._due_counts = {}
+
+    def has_queue(self, group):
+        return group in self._queues
+
+    def build_queue(self, group, ids):
+        """Heap e não vistas do grupo a partir das questões ids: O(n), uma vez por sessão."""
+        heap = [(self.cards[qid].due, qid) for qid in ids if qid in self.cards]
+        heapq.heapify(heap)
+        self._queues[group] = heap
+        self._unseen[group] = _Pool(qid for qid in ids if qid not in self.cards)
+        self._due_counts.pop(group, None)
+
+    def review(self, qid, correct, group=None, now=None):
+        card = schedule(self.cards.get(qid), correct, now)
+        self.cards[qid] = card
+        if group in self._queues:
+            heapq.heappush(self._queues[group], (card.due, qid))
+            self._unseen[group].discard(qid)
+            self._due_counts.pop(group, None)
+        return card
+
+    def unseen(self, group, n):
+        """Até n questões nunca respondidas do grupo, sorteadas."""
+        pool = self._unseen.get(group)
+        return pool.sample(n) if pool else []
+
+    def due(self, group, n, today=None):
+        """Até n questões vencidas do grupo, as mais atrasadas primeiro: O(log n) cada.
+
+        Elas continuam no heap até serem respondidas.
+        """
+        today = day_number() if today is None else today
+        heap = self._queues.get(group, [])
+        picked, seen = [], set()
+        while heap and len(picked) < n and heap[0][0] <= today:
+            due, qid = heapq.heappop(heap)
+            card = self.cards.get(qid)
+            if card is None or card.due != due or qid in seen: continue
+            picked.append(qid)
+            seen.add(qid)
+        for qid in picked: heapq.heappush(heap, (self.cards[qid].due, qid))
+        return picked
+
+    def due_count(self, group, today=None):
+        """Questões vencidas do grupo, contadas no topo do heap (só as vencidas são visitadas).
+
+        Fica guardado até a próxima resposta do grupo ou a virada do dia.
+        """
+        today = day_number() if today is None else today
+        cached = self._due_counts.get(group)
+        if cached and cached[0] == today: return cached[1]
+        count = len(self.due(group, len(self.cards), today))
+        self._due_counts[group] = (today, count)
+        return count
@@ -0,0 +1,128 @@
+"""Cache compartilhado entre os processos do servidor (opcional).
+
+Guarda registros quentes (perfil e usuários) com TTL, para que um login
+depois de um failover para outro worker não volte a bater no Sheets.
+
+Configuração (ARENA_CACHE ou st.secrets["shared_cache"]):
+    sqlite:///var/tmp/arena_cache.db   arquivo local mapeado em memória (mesma máquina)
+    redis://localhost:6379/0           Redis (requer o pacote redis)
+"""
+import json
+import sqlite3
+import threading
+import time
+
+try:
+    import redis
+    REDIS_INSTALLED = True
+except ImportError:
+    REDIS_INSTALLED = False
+
+DEFAULT_TTL = 600
+MMAP_SIZE = 64 * 1024 * 1024
+
+class SharedCache:
+    """Chave -> valor JSON com expiração. Falhas do cache nunca derrubam o app: viram miss."""
+    name = "base"
+
+    def __init__(self):
+        self.counters = {"hits": 0, "misses": 0, "sets": 0, "deletes": 0, "errors": 0}
+
+    def _get(self, key): raise NotImplementedError
+    def _set(self, key, value, ttl): raise NotImplementedError
+    def _delete(self, keys): raise NotImplementedError
+
+    def get(self, key):
+        try:
+            raw = self._get(key)
+        except Exception as e:
+            self.counters["errors"] += 1
+            print(f"Erro no cache compartilhado ({key}): {e}")
+            raw = None
+        self.counters["hits" if raw is not None else "misses"] += 1
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=DEFAULT_TTL):
+        try:
+            self._set(key, json.dumps(value), ttl)
+            self.counters["sets"] += 1
+        except Exception as e:
+            self.counters["errors"] += 1
+            print(f"Erro no cache compartilhado ({key}): {e}")
+
+    def delete(self, *keys):
+        try:
+            self._delete(keys)
+            self.counters["deletes"] += len(keys)
+        except Exception as e:
+            self.counters["errors"] += 1
+            print(f"Erro no cache compartilhado ({keys}): {e}")
+
+    def report(self):
+        c = self.counters
+        total = c["hits"] + c["misses"]
+        rate = f"{c['hits'] / total:.0%}" if total else "-"
+        return f"Cache {self.name}: {c['hits']} hits / {c['misses']} misses ({rate}), erros: {c['errors']}"
+
+class SQLiteCache(SharedCache):
+    """Stand-in local: um arquivo SQLite em WAL com mmap, compartilhado pelos processos da máquina."""
+    name = "sqlite"
+    PURGE_INTERVAL = 60
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")  # é cache: perder escritas num crash não importa
+        self._conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+
+    def _get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM cache WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)", (key, value, now + ttl))
+            if now - self._last_purge > self.PURGE_INTERVAL:
+                self._last_purge = now
+                self._conn.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+
+    def _delete(self, keys):
+        with self._lock:
+            self._conn.executemany("DELETE FROM cache WHERE key = ?", [(k,) for k in keys])
+
+class RedisCache(SharedCache):
+    name = "redis"
+
+    def __init__(self, url):
+        super().__init__()
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def _get(self, key):
+        raw = self._client.get(key)
+        return raw.decode() if raw is not None else None
+
+    def _set(self, key, value, ttl):
+        self._client.set(key, value, ex=int(ttl))
+
+    def _delete(self, keys):
+        if keys: self._client.delete(*keys)
+
+def create_cache(url):
+    """Cache a partir da URL de configuração; None se vazia ou se o backend não estiver disponível."""
+    if not url: return None
+    if url.startswith("sqlite://"):
+        return SQLiteCache(url[len("sqlite://"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        if not REDIS_INSTALLED:
+            print("Cache Redis configurado, mas o pacote redis não está instalado; seguindo sem cache.")
+            return None
+        return RedisCache(url)
+    print(f"URL de cache não reconhecida: {url}")
+    return None
@@ -0,0 +1,1249 @@
+"""Camada de persistência da Arena: interface única com backends Google Sheets e SQLite.
+
+O backend é escolhido pelo app via variável de ambiente ARENA_STORAGE ou
+st.secrets["storage_backend"] ("sheets", o padrão, ou "sqlite").
+
+Uso (SQLite local):
+    python storage.py criar-usuario <login> <nome> [arena.db]
+"""
+import contextlib
+import copy
+import hashlib
+import hmac
+import json
+import queue
+import random
+import re
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+from collections import deque
+from datetime import datetime
+
+from metrics import METRICS
+
+try:
+    import gspread
+    from google.oauth2.service_account import Credentials
+    LIBS_INSTALLED = True
+    IMPORT_ERROR = ""
+except ImportError as e:
+    LIBS_INSTALLED = False
+    IMPORT_ERROR = str(e)
+
+SHEET_NAME = "SpartaJus_DB"
+SQLITE_PATH = "arena.db"
+HISTORY_SHEET = "Historico"
+HISTORY_HEADER = ["Login", "Data", "Tipo", "Detalhe", "Resultado", "Tempo", "Acertos", "Total", "Timestamp"]
+HISTORY_KEYS = ["data", "tipo", "detalhe", "resultado", "tempo", "acertos", "total", "ts"]
+HISTORY_LAST_COL = chr(ord("A") + len(HISTORY_HEADER) - 1)
+HISTORY_PAGE_SIZE = 50
+REVIEW_SHEET = "Revisoes"
+REVIEW_HEADER = ["Login", "Dados"]
+REVIEW_CELL_CHARS = 45000  # o Sheets aceita até 50 mil caracteres por célula
+ANSWER_SHEET = "Respostas"
+ANSWER_HEADER = ["Bloco"]  # um bloco do answer_log.py por linha
+# Resumo do ranking: colunas D:H da sheet1, ao lado do JSON (gravadas na mesma chamada)
+RANKING_HEADER = ["Acertos", "Questoes", "Fase", "UltimaAtividade", "Dias"]
+RANKING_DAYS = 7  # dias guardados no resumo: bastam para os rankings do dia e da semana
+RANKING_LAST_COL = chr(ord("C") + len(RANKING_HEADER))
+
+# Cota padrão da API do Sheets por usuário (a conta de serviço conta como um só usuário)
+READS_PER_MINUTE = 60
+WRITES_PER_MINUTE = 60
+MAX_RETRIES = 5
+RETRY_BASE = 1.0
+RETRY_MAX = 32.0
+BATCH_ROWS = 200
+CAS_RETRIES = 10
+WRITE_TOKENS = 20  # tokens das últimas gravações guardados no registro do Sheets
+
+# O histórico NÃO fica aqui: cada atividade vira uma linha do histórico do backend
+# "versao" sobe a cada gravação de delta (compare-and-swap no SQLite; no Sheets, gravação conferida por token)
+DEFAULT_ARENA_DATA = {
+    "stats": {"total_questoes": 0, "total_acertos": 0, "total_erros": 0},
+    "progresso_arena": {"fase_maxima_desbloqueada": 1, "fases_vencidas": []},
+    "stats_diarios": {},
+    "versao": 0
+}
+
+def new_arena_data():
+    return copy.deepcopy(DEFAULT_ARENA_DATA)
+
+def api_status(exc):
+    """Status HTTP de um erro do gspread/requests (None se não houver resposta)."""
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+def is_retryable(exc):
+    status = api_status(exc)
+    return status == 429 or (status is not None and 500 <= status < 600)
+
+def retry_after(exc):
+    """Segundos pedidos pelo servidor no cabeçalho Retry-After (None se ausente)."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, base=RETRY_BASE, cap=RETRY_MAX):
+    """Backoff exponencial com jitter total: réplicas e sessões não repetem todas juntas."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+# -----------------------------------------------------------------------------
+# SENHAS
+# -----------------------------------------------------------------------------
+PASSWORD_PREFIX = "pbkdf2_sha256"
+PASSWORD_ITERATIONS = 200_000
+
+def hash_password(password, salt=None, iterations=PASSWORD_ITERATIONS):
+    salt = salt or secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), iterations).hex()
+    return f"{PASSWORD_PREFIX}${iterations}${salt}${digest}"
+
+def is_hashed(stored):
+    return stored.startswith(PASSWORD_PREFIX + "$")
+
+def verify_password(password, stored):
+    if is_hashed(stored):
+        try:
+            _, iterations, salt, digest = stored.split("$")
+            candidate = hash_password(password, salt, int(iterations)).split("$")[3]
+        except ValueError:
+            return False
+        return hmac.compare_digest(candidate, digest)
+    # Senha legada em texto puro (é convertida para hash no primeiro login válido)
+    return hmac.compare_digest(stored.encode(), password.encode())
+
+# -----------------------------------------------------------------------------
+# FORMATO DAS ATIVIDADES
+# -----------------------------------------------------------------------------
+def parse_activity_numbers(activity):
+    """(acertos, total) da atividade; registros antigos só têm o texto "Vitória (8/10)"."""
+    if str(activity.get('total', '')).strip():
+        return int(activity.get('acertos') or 0), int(activity['total'])
+    match = re.search(r'(\d+)/(\d+)', str(activity.get('resultado', '')))
+    if match: return int(match.group(1)), int(match.group(2))
+    return 0, 0
+
+def activity_timestamp(activity):
+    if str(activity.get('ts', '')).strip(): return int(activity['ts'])
+    try:
+        return int(datetime.strptime(activity.get('data', ''), "%d/%m/%Y %H:%M").timestamp())
+    except ValueError:
+        return None
+
+def add_daily_stats(arena_data, activity):
+    """Soma a atividade no agregado por dia (chave AAAA-MM-DD) guardado no próprio registro."""
+    acertos, total = parse_activity_numbers(activity)
+    ts = activity_timestamp(activity)
+    if not total or ts is None: return
+    day = datetime.fromtimestamp(ts).date().isoformat()
+    daily = arena_data.setdefault("stats_diarios", {}).setdefault(day, {"total": 0, "acertos": 0, "erros": 0})
+    daily['total'] += total
+    daily['acertos'] += acertos
+    daily['erros'] += max(0, total - acertos)
+
+def needs_upgrade(arena_data):
+    """O registro ainda tem alguma migração única pendente (ver ArenaStorage._upgrade_profile)?"""
+    return "historico_atividades" in arena_data or "stats_diarios" not in arena_data
+
+def daily_delta(activity):
+    """Delta {"stats_diarios": {dia: {...}}, "ultima_atividade": ts} da atividade (vazio se ela não tiver números).
+
+    Vale para batalhas e para cada resposta do Doctore: os quadros do ranking
+    por período e a última atividade saem daqui.
+    """
+    holder = {}
+    add_daily_stats(holder, activity)
+    if holder: holder["ultima_atividade"] = activity_timestamp(activity)
+    return holder
+
+# -----------------------------------------------------------------------------
+# DELTAS DO REGISTRO
+# -----------------------------------------------------------------------------
+# Um delta descreve só o que mudou e é comutativo, então deltas de abas
+# diferentes podem ser somados em qualquer ordem:
+#   {"stats": {"total_questoes": +n, ...}, "stats_diarios": {dia: {"total": +n, ...}},
+#    "fases_vencidas": [ids novos], "fase_maxima_desbloqueada": n (vale o maior),
+#    "ultima_atividade": ts (vale o maior)}
+class ConflictError(Exception):
+    """O registro mudou entre a leitura e a escrita mais vezes que CAS_RETRIES."""
+
+class MissingRecordError(Exception):
+    """O registro de algum delta não existe; missing são as keys, nada foi gravado nelas."""
+
+    def __init__(self, missing):
+        super().__init__(f"Registro(s) inexistente(s): {', '.join(map(str, missing))}")
+        self.missing = missing
+
+class PartialWriteError(Exception):
+    """apply_deltas falhou no meio: saved ({key: registro novo}) já está gravado e não pode ser reaplicado."""
+
+    def __init__(self, saved, cause):
+        super().__init__(f"{len(saved)} registro(s) gravado(s) antes da falha: {cause}")
+        self.saved = saved
+        self.cause = cause
+
+def merge_delta(target, delta):
+    """Soma delta em target (outro delta), no lugar."""
+    for k, v in delta.get("stats", {}).items():
+        stats = target.setdefault("stats", {})
+        stats[k] = stats.get(k, 0) + v
+    for day, values in delta.get("stats_diarios", {}).items():
+        daily = target.setdefault("stats_diarios", {}).setdefault(day, {})
+        for k, v in values.items(): daily[k] = daily.get(k, 0) + v
+    for fase in delta.get("fases_vencidas", []):
+        won = target.setdefault("fases_vencidas", [])
+        if fase not in won: won.append(fase)
+    if "fase_maxima_desbloqueada" in delta:
+        target["fase_maxima_desbloqueada"] = max(target.get("fase_maxima_desbloqueada", 0), delta["fase_maxima_desbloqueada"])
+    if "ultima_atividade" in delta:
+        target["ultima_atividade"] = max(target.get("ultima_atividade", 0), delta["ultima_atividade"])
+    return target
+
+def apply_delta(data, delta):
+    """Aplica o delta num arena_data, no lugar (não mexe na versão)."""
+    default = new_arena_data()
+    stats = data.setdefault("stats", default["stats"])
+    for k, v in delta.get("stats", {}).items(): stats[k] = stats.get(k, 0) + v
+    for day, values in delta.get("stats_diarios", {}).items():
+        daily = data.setdefault("stats_diarios", {}).setdefault(day, {"total": 0, "acertos": 0, "erros": 0})
+        for k, v in values.items(): daily[k] = daily.get(k, 0) + v
+    progress = data.setdefault("progresso_arena", default["progresso_arena"])
+    for fase in delta.get("fases_vencidas", []):
+        if fase not in progress["fases_vencidas"]: progress["fases_vencidas"].append(fase)
+    if "fase_maxima_desbloqueada" in delta:
+        progress["fase_maxima_desbloqueada"] = max(progress["fase_maxima_desbloqueada"], delta["fase_maxima_desbloqueada"])
+    if "ultima_atividade" in delta:
+        data["ultima_atividade"] = max(int(data.get("ultima_atividade") or 0), delta["ultima_atividade"])
+    return data
+
+def _apply_versioned(raw, delta):
+    """(novo arena_data, versão lida) a partir do JSON gravado."""
+    try:
+        data = json.loads(raw) if raw else new_arena_data()
+    except ValueError:
+        data = new_arena_data()
+    version = int(data.get("versao") or 0)
+    apply_delta(data, delta)
+    data["versao"] = version + 1
+    return data, version
+
+def history_row(username, activity):
+    acertos, total = parse_activity_numbers(activity)
+    ts = activity_timestamp(activity)
+    row = [username] + [str(activity.get(k, "")) for k in HISTORY_KEYS[:5]]
+    return row + [acertos, total, ts if ts is not None else ""]
+
+def row_to_activity(values):
+    values = list(values) + [""] * len(HISTORY_HEADER)
+    return dict(zip(HISTORY_KEYS, values[1:len(HISTORY_HEADER)]))
+
+def history_matches(activity, inicio=None, fim=None, tipo=None, detalhe=None):
+    """Filtros do histórico: período [inicio, fim) em timestamp, tipo e detalhe (adversário) exatos."""
+    if tipo and activity.get('tipo') != tipo: return False
+    if detalhe and activity.get('detalhe') != detalhe: return False
+    if inicio is None and fim is None: return True
+    ts = activity_timestamp(activity)
+    if ts is None: return False
+    return (inicio is None or ts >= inicio) and (fim is None or ts < fim)
+
+def to_columns(activities):
+    """Atividades -> colunas ({chave: lista}), o formato devolvido por history_columns()."""
+    return {k: [activity.get(k, "") for activity in activities] for k in HISTORY_KEYS}
+
+def ranking_summary(data):
+    """Resumo do registro para o ranking: totais, fase, último dia com atividade e os últimos dias."""
+    daily = data.get("stats_diarios") or {}
+    days = sorted(daily)[-RANKING_DAYS:]
+    last = days[-1] if days else ""
+    if data.get("ultima_atividade"): last = max(last, datetime.fromtimestamp(int(data["ultima_atividade"])).date().isoformat())
+    return {
+        "acertos": int(data.get("stats", {}).get("total_acertos", 0)),
+        "questoes": int(data.get("stats", {}).get("total_questoes", 0)),
+        "fase": int(data.get("progresso_arena", {}).get("fase_maxima_desbloqueada", 1)),
+        "ultima": last,
+        "dias": {day: [int(daily[day].get("acertos", 0)), int(daily[day].get("total", 0))] for day in days},
+    }
+
+def payload_summary(payload):
+    """ranking_summary() de um JSON gravado (None se ele não for válido)."""
+    try:
+        return ranking_summary(json.loads(payload))
+    except (ValueError, AttributeError):
+        return None
+
+def summary_row(summary):
+    return [summary["acertos"], summary["questoes"], summary["fase"], summary["ultima"],
+            json.dumps(summary["dias"], separators=(",", ":"))]
+
+def row_to_summary(values):
+    """Resumo a partir das colunas de summary_row() (None para linha sem resumo)."""
+    values = list(values) + [""] * len(RANKING_HEADER)
+    if not str(values[1]).strip(): return None
+    try:
+        return {"acertos": int(values[0] or 0), "questoes": int(values[1]), "fase": int(values[2] or 1),
+                "ultima": values[3], "dias": json.loads(values[4]) if values[4] else {}}
+    except ValueError:
+        return None
+
+# -----------------------------------------------------------------------------
+# INTERFACE
+# -----------------------------------------------------------------------------
+class ArenaStorage:
+    """Operações de persistência usadas pelo app.
+
+    "key" é o identificador do registro do usuário no backend (linha da
+    planilha no Sheets, o próprio login no SQLite). Linhas de histórico
+    seguem o formato de history_row().
+    """
+    name = "base"
+
+    def list_users(self):
+        """Itera (key, registro) com as colunas Login, Senha e Nome."""
+        raise NotImplementedError
+
+    def find_user(self, login):
+        """(key, registro) de um único login, ou None."""
+        raise NotImplementedError
+
+    def update_password(self, key, password_hash):
+        raise NotImplementedError
+
+    def load_profile_raw(self, login, create=True):
+        """(dados, key, status) sem migrações; cria o registro se o usuário for novo (create=False: key None)."""
+        raise NotImplementedError
+
+    def save_profile(self, key, payload):
+        """Grava o JSON (str) do arena_data do usuário."""
+        raise NotImplementedError
+
+    def save_profiles(self, payloads):
+        """Grava vários registros ({key: JSON}) de uma vez; os backends agrupam numa só operação."""
+        for key, payload in payloads.items():
+            self.save_profile(key, payload)
+
+    def apply_deltas(self, deltas):
+        """Soma cada delta ({key: delta}) ao registro gravado, subindo a versão; devolve {key: registro novo}.
+
+        Deltas não são idempotentes: se a falha vier depois de parte já gravada,
+        levanta PartialWriteError com essa parte, para só o resto voltar à fila.
+        """
+        raise NotImplementedError
+
+    def append_history(self, rows):
+        raise NotImplementedError
+
+    def history_page(self, login, page=0, page_size=HISTORY_PAGE_SIZE):
+        """(atividades, há_mais) do histórico, do mais novo para o mais antigo."""
+        raise NotImplementedError
+
+    def history_columns(self, login, inicio=None, fim=None, tipo=None, detalhe=None):
+        """Histórico filtrado (ver history_matches) em colunas, do mais novo para o mais antigo.
+
+        Os backends filtram na origem; esta versão genérica percorre as páginas.
+        """
+        activities = []
+        page = 0
+        while True:
+            chunk, has_more = self.history_page(login, page)
+            activities += [a for a in chunk if history_matches(a, inicio, fim, tipo, detalhe)]
+            if not has_more: return to_columns(activities)
+            page += 1
+
+    def load_reviews(self, login):
+        """Agenda de revisão do usuário no formato compacto do review.py ("" se não houver)."""
+        raise NotImplementedError
+
+    def update_reviews(self, updates, merge):
+        """Para cada login em updates ({login: cartões}), grava merge(agenda_gravada, cartões)."""
+        raise NotImplementedError
+
+    def append_answers(self, blocks):
+        """Acrescenta blocos do registro de respostas (answer_log.pack); nada é regravado."""
+        raise NotImplementedError
+
+    def load_answers(self):
+        """Todos os blocos do registro de respostas, na ordem de gravação."""
+        raise NotImplementedError
+
+    def ranking_summaries(self):
+        """{login: resumo} (ver ranking_summary) de todos os usuários, sem ler os registros completos.
+
+        O resumo é gravado junto com o registro (apply_deltas e save_profiles).
+        """
+        raise NotImplementedError
+
+    def rebuild_ranking(self):
+        """Recalcula o resumo de todos os registros (usuários que ainda não gravaram desde a migração)."""
+        raise NotImplementedError
+
+    def reset(self):
+        """Descarta conexões após um erro (a próxima chamada reconecta)."""
+
+    def invalidate(self, login):
+        """Esquece o que houver em cache sobre o login (a próxima leitura vai ao backend)."""
+
+    def report(self):
+        return self.name
+
+    def load_profile(self, login, create=True):
+        """(dados, key, status) já migrado.
+
+        create=False só lê (ex.: antes de a senha ser conferida): se for preciso
+        gravar (usuário sem registro ou com migração pendente), devolve key None.
+        """
+        data, key, status = self.load_profile_raw(login, create)
+        if key is None: return data, key, status
+        if not create and needs_upgrade(data): return data, None, status
+        return data, key, self._upgrade_profile(login, key, data) or status
+
+    def _upgrade_profile(self, login, key, data):
+        """Migrações únicas de registros antigos; devolve o novo status ou None."""
+        if "historico_atividades" in data:
+            data["stats_diarios"] = {}
+            rows = []
+            for activity in data.pop("historico_atividades") or []:
+                add_daily_stats(data, activity)
+                rows.append(history_row(login, activity))
+            if rows: self.append_history(rows)
+            self.save_profile(key, json.dumps(data))
+            return "Histórico Migrado"
+        if "stats_diarios" not in data:
+            try:
+                data["stats_diarios"] = self.rebuild_daily_stats(login)
+            except Exception as e:
+                self.reset()
+                print(f"Erro ao migrar estatísticas diárias: {e}")
+                return None
+            self.save_profile(key, json.dumps(data))
+            return "Estatísticas Migradas"
+        return None
+
+    def rebuild_daily_stats(self, login):
+        holder = {"stats_diarios": {}}
+        page = 0
+        while True:
+            activities, has_more = self.history_page(login, page)
+            for activity in activities: add_daily_stats(holder, activity)
+            if not has_more: return holder["stats_diarios"]
+            page += 1
+
+# -----------------------------------------------------------------------------
+# GOOGLE SHEETS
+# -----------------------------------------------------------------------------
+class QuotaGovernor:
+    """Orçamento por minuto de leituras e escritas do Sheets (janela deslizante), compartilhado pelo processo.
+
+    Antes de cada chamada, acquire() espera a janela ter espaço (até MAX_WAIT);
+    um 429 pausa todas as chamadas pelo tempo pedido pelo servidor.
+    """
+    WINDOW = 60.0
+    MAX_WAIT = 20.0
+
+    def __init__(self, reads_per_minute=READS_PER_MINUTE, writes_per_minute=WRITES_PER_MINUTE):
+        self.budget = {"read": reads_per_minute, "write": writes_per_minute}
+        self._calls = {"read": deque(), "write": deque()}
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self.counters = {"waits": 0, "wait_seconds": 0.0, "throttled": 0}
+
+    def _delay(self, kind, now):
+        calls = self._calls[kind]
+        while calls and now - calls[0] >= self.WINDOW: calls.popleft()
+        delay = max(0.0, self._paused_until - now)
+        if len(calls) >= self.budget[kind]: delay = max(delay, calls[0] + self.WINDOW - now)
+        return delay
+
+    def acquire(self, kind):
+        deadline = time.monotonic() + self.MAX_WAIT
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = self._delay(kind, now)
+                # Passado o MAX_WAIT segue mesmo assim: o backoff trata um eventual 429
+                if delay <= 0 or now >= deadline:
+                    self._calls[kind].append(now)
+                    if waited:
+                        self.counters["waits"] += 1
+                        self.counters["wait_seconds"] += waited
+                    return waited
+            pause = min(delay, deadline - now) + random.uniform(0, 0.05)
+            with METRICS.span("sheets.quota_wait"):
+                time.sleep(pause)
+            waited += pause
+
+    def throttled(self, seconds):
+        with self._lock:
+            self.counters["throttled"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def usage(self):
+        with self._lock:
+            now = time.monotonic()
+            for kind in self._calls: self._delay(kind, now)
+            return {kind: len(calls) for kind, calls in self._calls.items()}
+
+    def report(self):
+        used = self.usage()
+        c = self.counters
+        return (f"Cota/min: leituras {used['read']}/{self.budget['read']}, escritas {used['write']}/{self.budget['write']} | "
+                f"esperas: {c['waits']} ({c['wait_seconds']:.1f} s) | 429: {c['throttled']}")
+
+def row_runs(rows):
+    """[(primeira, última)] dos trechos de linhas consecutivas de uma lista crescente."""
+    runs = []
+    for row in rows:
+        if runs and row == runs[-1][1] + 1: runs[-1][1] = row
+        else: runs.append([row, row])
+    return [tuple(run) for run in runs]
+
+def appended_row(response):
+    """Linha gravada por um append_row, lida do updatedRange da resposta (ex.: "sheet1!A42:C42")."""
+    try:
+        updated = response["updates"]["updatedRange"]
+    except (KeyError, TypeError):
+        return None
+    match = re.search(r"[A-Z]+(\d+)(?::[A-Z]+\d+)?$", updated)
+    return int(match.group(1)) if match else None
+
+def _count_api_response(response, *args, **kwargs):
+    """Hook do requests: "GET values", "POST values:append", "POST batchUpdate"..."""
+    request = response.request
+    url = urllib.parse.urlsplit(request.url)
+    path = url.path
+    last = path.rsplit("/", 1)[-1]
+    if "oauth2" in url.netloc: op = "token"
+    elif "/values" in path: op = "values" + (":" + last.rsplit(":", 1)[1] if ":" in last else "")
+    elif ":" in last: op = last.rsplit(":", 1)[1]
+    elif "/drive/" in path: op = "drive"
+    else: op = "metadata"
+    METRICS.api_call("sheets", f"{request.method} {op}")
+
+class SheetsConnection:
+    """Cliente gspread, planilha e abas reaproveitados por todo o processo."""
+    SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+
+    def __init__(self, creds_info, sheet_name=SHEET_NAME, governor=None):
+        self._creds_info = creds_info
+        self._sheet_name = sheet_name
+        self.governor = governor
+        self._lock = threading.RLock()
+        self._client = None
+        self._spreadsheet = None
+        self._worksheets = {}
+        self.counters = {"auth": 0, "auth_saved": 0, "open": 0, "open_saved": 0, "reconnects": 0}
+
+    def _authorize(self):
+        credentials = Credentials.from_service_account_info(self._creds_info, scopes=self.SCOPES)
+        client = gspread.authorize(credentials)
+        # Cada requisição HTTP do gspread passa por este hook: é a contagem real de chamadas à API
+        client.http_client.session.hooks["response"].append(_count_api_response)
+        return client
+
+    def client(self):
+        # As credenciais ficam dentro do cliente: o google-auth só renova o token quando ele expira.
+        with self._lock:
+            if self._client is None:
+                with METRICS.span("sheets.authorize"):
+                    self._client = self._authorize()
+                self.counters["auth"] += 1
+            else:
+                self.counters["auth_saved"] += 1
+            return self._client
+
+    def worksheet(self, name):
+        """Retorna a aba pedida ("sheet1" = primeira aba), abrindo a planilha só uma vez."""
+        with self._lock:
+            if name in self._worksheets:
+                self.counters["open_saved"] += 1
+                return self._worksheets[name]
+            client = self.client()
+            # Abrir planilha/aba também consome cota de leitura
+            if self._spreadsheet is None:
+                if self.governor: self.governor.acquire("read")
+                self._spreadsheet = client.open(self._sheet_name)
+                self.counters["open"] += 1
+            else:
+                self.counters["open_saved"] += 1
+            if self.governor: self.governor.acquire("read")
+            ws = self._spreadsheet.sheet1 if name == "sheet1" else self._spreadsheet.worksheet(name)
+            self._worksheets[name] = ws
+            return ws
+
+    def ensure_worksheet(self, name, header):
+        """Como worksheet(), mas cria a aba (com cabeçalho) se ela ainda não existir."""
+        with self._lock:
+            try:
+                ws = self.worksheet(name)
+                if ws.col_count < len(header): ws.add_cols(len(header) - ws.col_count)
+                return ws
+            except gspread.WorksheetNotFound:
+                ws = self._spreadsheet.add_worksheet(title=name, rows=1, cols=len(header))
+                ws.append_row(header, value_input_option="RAW")
+                self._worksheets[name] = ws
+                return ws
+
+    def reset(self):
+        """Descarta cliente e abas após um erro; a próxima chamada reconecta do zero."""
+        with self._lock:
+            self._client = None
+            self._spreadsheet = None
+            self._worksheets = {}
+            self.counters["reconnects"] += 1
+
+    def report(self):
+        c = self.counters
+        return (f"Sheets: {c['auth']} autenticação(ões), {c['open']} abertura(s) | "
+                f"evitadas: {c['auth_saved']} autenticações, {c['open_saved']} aberturas | "
+                f"reconexões: {c['reconnects']}")
+
+class SheetsStorage(ArenaStorage):
+    """Planilha SpartaJus_DB: abas Usuarios, sheet1, Historico, Revisoes e Respostas.
+
+    A sheet1 guarda o registro JSON na coluna C e o resumo do ranking em D:H.
+
+    Toda chamada à API passa por _call(): respeita a cota do QuotaGovernor e
+    repete erros 429/5xx com backoff exponencial e jitter.
+    """
+    name = "sheets"
+
+    def __init__(self, connection, governor=None):
+        self.conn = connection
+        self.governor = governor or connection.governor or QuotaGovernor()
+        connection.governor = self.governor
+        self._users_header = []
+        self._rows_lock = threading.Lock()
+        self._cas_lock = threading.Lock()
+        self._profile_rows = {}
+        self._ranking_ready = False
+
+    def _call(self, kind, fn, *args, **kwargs):
+        for attempt in range(MAX_RETRIES):
+            self.governor.acquire(kind)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable(e) or attempt == MAX_RETRIES - 1: raise
+                delay = retry_after(e) or backoff_delay(attempt)
+                if api_status(e) == 429: self.governor.throttled(delay)
+                time.sleep(delay)
+
+    @contextlib.contextmanager
+    def _guard(self):
+        try:
+            yield
+        except Exception as e:
+            # 429/5xx não são culpa da conexão: reconectar só gastaria mais cota
+            if not is_retryable(e): self.conn.reset()
+            raise
+
+    def reset(self):
+        self.conn.reset()
+
+    def report(self):
+        return f"{self.conn.report()} | {self.governor.report()}"
+
+    def list_users(self):
+        with self._guard():
+            # get_all_values mantém tudo como texto (get_all_records transformaria "0123" em 123)
+            values = self._call("read", self.conn.worksheet("Usuarios").get_all_values)
+        self._users_header = values[0] if values else []
+        for row_number, row in enumerate(values[1:], start=2):
+            yield row_number, dict(zip(self._users_header, row))
+
+    def _users_column(self, name):
+        return self._users_header.index(name) + 1 if name in self._users_header else None
+
+    def find_user(self, login):
+        with self._guard():
+            sheet = self.conn.worksheet("Usuarios")
+            if not self._users_header: self._users_header = self._call("read", sheet.row_values, 1)
+            cell = self._call("read", sheet.find, login, in_column=self._users_column('Login') or 1)
+            if not cell: return None
+            return cell.row, dict(zip(self._users_header, self._call("read", sheet.row_values, cell.row)))
+
+    def update_password(self, key, password_hash):
+        if not self._users_header:  # índice de logins montado por outra instância
+            with self._guard():
+                self._users_header = self._call("read", self.conn.worksheet("Usuarios").row_values, 1)
+        column = self._users_column('Senha')
+        if not column: return
+        with self._guard():
+            self._call("write", self.conn.worksheet("Usuarios").update_cell, key, column, password_hash)
+
+    def _profile_row(self, sheet, login, refresh=False):
+        """Linha do login na sheet1: a coluna A inteira é lida uma vez e serve a todos os usuários."""
+        with self._rows_lock:
+            if refresh or login not in self._profile_rows:
+                column = self._call("read", sheet.col_values, 1)
+                self._profile_rows = {value: i for i, value in enumerate(column, start=1) if value}
+            return self._profile_rows.get(login)
+
+    def load_profile_raw(self, login, create=True):
+        with self._guard():
+            sheet = self.conn.worksheet("sheet1")
+            for refresh in (False, True):
+                row = self._profile_row(sheet, login, refresh)
+                if not row: break
+                values = self._call("read", sheet.get, f"A{row}:C{row}")
+                values = list(values[0] if values else []) + ["", "", ""]
+                if values[0] != login: continue  # linhas mudaram de lugar: relê o índice uma vez
+                raw_data = values[2]
+                if not raw_data: return new_arena_data(), row, "Novo Registro"
+                try:
+                    return json.loads(raw_data), row, "Dados Carregados"
+                except ValueError:
+                    return new_arena_data(), row, "Erro no JSON"
+            if not create: return new_arena_data(), None, "Sem Registro"
+            new_row = [login, "", json.dumps(DEFAULT_ARENA_DATA)]
+            response = self._call("write", sheet.append_row, new_row, value_input_option="RAW")
+            row = appended_row(response) or self._profile_row(sheet, login, refresh=True)
+            with self._rows_lock:
+                self._profile_rows[login] = row
+            return new_arena_data(), row, "Novo Usuário Criado"
+
+    def save_profile(self, key, payload):
+        self.save_profiles({key: payload})
+
+    def apply_deltas(self, deltas):
+        """Lê os registros num batch_get, soma os deltas e grava tudo num batch_update.
+
+        O Sheets não tem escrita condicional: cada gravação deixa um token no
+        registro ("escritas") e os registros são relidos logo depois. Se outro
+        processo gravou por cima sem o token (leu antes da nossa gravação), o
+        delta é reaplicado sobre o que ficou, até CAS_RETRIES vezes. Continua
+        sem cobertura a gravação alheia que chegue depois dessa releitura.
+        """
+        keys = list(deltas)
+        results = {}
+        with self._cas_lock, self._guard():
+            sheet = self.conn.worksheet("sheet1")
+            for start in range(0, len(keys), BATCH_ROWS):
+                pending = keys[start:start + BATCH_ROWS]
+                try:
+                    for _ in range(CAS_RETRIES):
+                        token = secrets.token_hex(6)
+                        results.update(self._write_deltas(sheet, pending, deltas, token))
+                        # Gravado, mas sem o nosso token na releitura: alguém sobrescreveu, vale de novo
+                        stored = self._read_records(sheet, pending)
+                        pending = [key for key in pending if token not in stored[key].get("escritas", [])]
+                        for key in pending: del results[key]
+                        if not pending: break
+                    else:
+                        raise ConflictError(f"{len(pending)} registro(s) sobrescritos {CAS_RETRIES} vezes durante a gravação")
+                except Exception as e:
+                    # Cada bloco é um batch_update próprio: o que já foi conferido está gravado
+                    if results: raise PartialWriteError(results, e) from e
+                    raise
+        return results
+
+    def _read_records(self, sheet, keys):
+        ranges = self._call("read", sheet.batch_get, [f"C{key}" for key in keys])
+        records = {}
+        for key, value_range in zip(keys, ranges):
+            try:
+                records[key] = json.loads(value_range[0][0]) if value_range and value_range[0] else {}
+            except ValueError:
+                records[key] = {}
+        return records
+
+    def _write_deltas(self, sheet, keys, deltas, token):
+        ranges = self._call("read", sheet.batch_get, [f"C{key}" for key in keys])
+        updates = self._ranking_columns(sheet)
+        written = {}
+        for key, value_range in zip(keys, ranges):
+            raw = value_range[0][0] if value_range and value_range[0] else ""
+            data, _ = _apply_versioned(raw, deltas[key])
+            data["escritas"] = (data.get("escritas", []) + [token])[-WRITE_TOKENS:]
+            written[key] = data
+            updates.append(self._profile_update(key, json.dumps(data), ranking_summary(data)))
+        self._call("write", sheet.batch_update, updates, value_input_option="RAW")
+        return written
+
+    def _ranking_columns(self, sheet):
+        """Abre espaço para as colunas do resumo na sheet1; devolve o cabeçalho a gravar (uma vez por processo)."""
+        if self._ranking_ready: return []
+        width = 3 + len(RANKING_HEADER)
+        if sheet.col_count < width: self._call("write", sheet.add_cols, width - sheet.col_count)
+        self._ranking_ready = True
+        return [{"range": f"D1:{RANKING_LAST_COL}1", "values": [RANKING_HEADER]}]
+
+    @staticmethod
+    def _profile_update(key, payload, summary):
+        # JSON e resumo do ranking na mesma faixa: o resumo nunca fica para trás do registro
+        if summary is None: return {"range": f"C{key}", "values": [[payload]]}
+        return {"range": f"C{key}:{RANKING_LAST_COL}{key}", "values": [[payload] + summary_row(summary)]}
+
+    def save_profiles(self, payloads):
+        items = list(payloads.items())
+        with self._guard():
+            sheet = self.conn.worksheet("sheet1")
+            # Um batch_update por bloco de linhas, qualquer que seja o número de usuários
+            for start in range(0, len(items), BATCH_ROWS):
+                data = self._ranking_columns(sheet)
+                data += [self._profile_update(key, payload, payload_summary(payload)) for key, payload in items[start:start + BATCH_ROWS]]
+                self._call("write", sheet.batch_update, data, value_input_option="RAW")
+
+    def ranking_summaries(self):
+        # Só a coluna A e as do resumo descem: os JSONs (coluna C) ficam na planilha
+        with self._guard():
+            logins, values = self._call("read", self.conn.worksheet("sheet1").batch_get, ["A2:A", f"D2:{RANKING_LAST_COL}"])
+        summaries = {}
+        for login, row in zip(logins, values):
+            summary = row_to_summary(row)
+            if login and login[0] and summary: summaries[login[0]] = summary
+        return summaries
+
+    def rebuild_ranking(self):
+        # Só as colunas do resumo são regravadas: um delta gravado no meio do caminho não se perde
+        with self._cas_lock, self._guard():
+            sheet = self.conn.worksheet("sheet1")
+            data = []
+            for row, value in enumerate(self._call("read", sheet.get, "C2:C"), start=2):
+                summary = payload_summary(value[0]) if value and value[0] else None
+                if summary: data.append({"range": f"D{row}:{RANKING_LAST_COL}{row}", "values": [summary_row(summary)]})
+            updates = self._ranking_columns(sheet) + data
+            for start in range(0, len(updates), BATCH_ROWS):
+                self._call("write", sheet.batch_update, updates[start:start + BATCH_ROWS], value_input_option="RAW")
+        return len(data)
+
+    def append_history(self, rows):
+        with self._guard():
+            ws = self.conn.ensure_worksheet(HISTORY_SHEET, HISTORY_HEADER)
+            self._call("write", ws.append_rows, rows, value_input_option="RAW")
+
+    def _history_rows(self, ws, login):
+        # Só a coluna A desce; as linhas pedidas vêm depois num único batch_get
+        return [i for i, value in enumerate(self._call("read", ws.col_values, 1), start=1) if value == login and i > 1]
+
+    def history_columns(self, login, inicio=None, fim=None, tipo=None, detalhe=None):
+        # Só as linhas do login: trechos contíguos viram uma faixa cada, BATCH_ROWS faixas por batch_get
+        with self._guard():
+            ws = self.conn.ensure_worksheet(HISTORY_SHEET, HISTORY_HEADER)
+            ranges = [f"A{first}:{HISTORY_LAST_COL}{last}" for first, last in row_runs(self._history_rows(ws, login))]
+            values = []
+            for start in range(0, len(ranges), BATCH_ROWS):
+                for value_range in self._call("read", ws.batch_get, ranges[start:start + BATCH_ROWS]):
+                    values.extend(value_range)
+        activities = [row_to_activity(v) for v in values if v and v[0] == login]
+        return to_columns([a for a in activities[::-1] if history_matches(a, inicio, fim, tipo, detalhe)])
+
+    def _review_rows(self, ws):
+        return {value: i for i, value in enumerate(self._call("read", ws.col_values, 1), start=1) if value and i > 1}
+
+    def load_reviews(self, login):
+        with self._guard():
+            ws = self.conn.ensure_worksheet(REVIEW_SHEET, REVIEW_HEADER)
+            row = self._review_rows(ws).get(login)
+            return "".join(self._call("read", ws.row_values, row)[1:]) if row else ""
+
+    def update_reviews(self, updates, merge):
+        """Uma leitura da coluna A, um batch_get das linhas e uma gravação, para todos os logins.
+
+        A agenda é quebrada em várias células da linha (REVIEW_CELL_CHARS cada).
+        """
+        with self._guard():
+            ws = self.conn.ensure_worksheet(REVIEW_SHEET, REVIEW_HEADER)
+            rows = self._review_rows(ws)
+            existing = [login for login in updates if login in rows]
+            stored = {}
+            if existing:
+                last_col = gspread.utils.rowcol_to_a1(1, ws.col_count).rstrip("0123456789")
+                ranges = self._call("read", ws.batch_get, [f"A{rows[login]}:{last_col}{rows[login]}" for login in existing])
+                stored = {login: "".join((r[0] if r else [])[1:]) for login, r in zip(existing, ranges)}
+            cells = {}
+            for login, cards in updates.items():
+                blob = merge(stored.get(login, ""), cards)
+                cells[login] = [blob[i:i + REVIEW_CELL_CHARS] for i in range(0, len(blob), REVIEW_CELL_CHARS)]
+            width = max(len(chunks) for chunks in cells.values()) + 1
+            if ws.col_count < width: self._call("write", ws.add_cols, width - ws.col_count)
+            # Linha inteira regravada: pedaços de uma agenda maior que a atual ficam vazios
+            data = [{"range": f"A{rows[login]}", "values": [[login] + chunks + [""] * (ws.col_count - len(chunks) - 1)]}
+                    for login, chunks in cells.items() if login in rows]
+            if data: self._call("write", ws.batch_update, data, value_input_option="RAW")
+            new = [[login] + chunks for login, chunks in cells.items() if login not in rows]
+            if new: self._call("write", ws.append_rows, new, value_input_option="RAW")
+
+    def append_answers(self, blocks):
+        with self._guard():
+            ws = self.conn.ensure_worksheet(ANSWER_SHEET, ANSWER_HEADER)
+            self._call("write", ws.append_rows, [[block] for block in blocks], value_input_option="RAW")
+
+    def load_answers(self):
+        with self._guard():
+            ws = self.conn.ensure_worksheet(ANSWER_SHEET, ANSWER_HEADER)
+            return [value for value in self._call("read", ws.col_values, 1)[1:] if value]
+
+    def rebuild_daily_stats(self, login):
+        """Monta o stats_diarios e preenche Acertos/Total/Timestamp das linhas antigas."""
+        with self._guard():
+            ws = self.conn.ensure_worksheet(HISTORY_SHEET, HISTORY_HEADER)
+            # Cabeçalho e as linhas do login em faixas contíguas, BATCH_ROWS faixas por batch_get (como history_columns)
+            runs = [(1, 1)] + row_runs(self._history_rows(ws, login))
+            ranges = [f"A{first}:{HISTORY_LAST_COL}{last}" for first, last in runs]
+            values = []
+            for start in range(0, len(ranges), BATCH_ROWS):
+                values.extend(self._call("read", ws.batch_get, ranges[start:start + BATCH_ROWS]))
+            updates = []
+            if list(values[0][0] if values[0] else []) != HISTORY_HEADER:
+                updates.append({"range": f"A1:{HISTORY_LAST_COL}1", "values": [HISTORY_HEADER]})
+            holder = {"stats_diarios": {}}
+            read = [(first + i, row) for (first, _), value_range in zip(runs[1:], values[1:]) for i, row in enumerate(value_range)]
+            for r, row in read:
+                if not row or row[0] != login: continue
+                activity = row_to_activity(row)
+                add_daily_stats(holder, activity)
+                if not str(activity['total']).strip():
+                    acertos, total = parse_activity_numbers(activity)
+                    ts = activity_timestamp(activity)
+                    updates.append({"range": f"G{r}:I{r}", "values": [[acertos, total, ts if ts is not None else ""]]})
+            if updates: self._call("write", ws.batch_update, updates, value_input_option="RAW")
+        return holder["stats_diarios"]
+
+# -----------------------------------------------------------------------------
+# SQLITE
+# -----------------------------------------------------------------------------
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usuarios (login TEXT PRIMARY KEY, senha TEXT NOT NULL, nome TEXT);
+CREATE TABLE IF NOT EXISTS perfis (login TEXT PRIMARY KEY, dados TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS historico (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, login TEXT NOT NULL,
+    data TEXT, tipo TEXT, detalhe TEXT, resultado TEXT, tempo TEXT,
+    acertos INTEGER, total INTEGER, ts INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_historico_login ON historico (login, id);
+CREATE TABLE IF NOT EXISTS revisoes (login TEXT PRIMARY KEY, dados TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS respostas (id INTEGER PRIMARY KEY AUTOINCREMENT, bloco TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS ranking (
+    login TEXT PRIMARY KEY, acertos INTEGER, questoes INTEGER, fase INTEGER, ultima TEXT, dias TEXT
+);
+"""
+
+class SQLiteStorage(ArenaStorage):
+    """Backend local: WAL (leitores não bloqueiam o gravador) e um pool fixo de conexões.
+
+    As consultas são strings constantes com parâmetros, então cada conexão
+    reaproveita o statement já compilado do seu cache (cached_statements).
+    """
+    name = "sqlite"
+    POOL_SIZE = 4
+
+    def __init__(self, path=SQLITE_PATH, pool_size=POOL_SIZE):
+        self.path = path
+        self._pool = queue.Queue()
+        for _ in range(pool_size):
+            self._pool.put(self._connect())
+        with self._connection() as conn:
+            conn.executescript(SQLITE_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, cached_statements=64)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=10000")
+        return conn
+
+    @contextlib.contextmanager
+    def _connection(self):
+        conn = self._pool.get()
+        try:
+            with conn:  # commit ao sair, rollback em caso de erro
+                yield conn
+        finally:
+            self._pool.put(conn)
+
+    def report(self):
+        return f"SQLite: {self.path} (pool {self._pool.qsize()} livres)"
+
+    def list_users(self):
+        with self._connection() as conn:
+            rows = conn.execute("SELECT login, senha, nome FROM usuarios").fetchall()
+        for login, senha, nome in rows:
+            yield login, {"Login": login, "Senha": senha, "Nome": nome}
+
+    def find_user(self, login):
+        with self._connection() as conn:
+            row = conn.execute("SELECT login, senha, nome FROM usuarios WHERE login = ?", (login,)).fetchone()
+        if not row: return None
+        return row[0], {"Login": row[0], "Senha": row[1], "Nome": row[2]}
+
+    def create_user(self, login, nome, password):
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO usuarios (login, senha, nome) VALUES (?, ?, ?)",
+                         (login, hash_password(password), nome))
+
+    def update_password(self, key, password_hash):
+        with self._connection() as conn:
+            conn.execute("UPDATE usuarios SET senha = ? WHERE login = ?", (password_hash, key))
+
+    def load_profile_raw(self, login, create=True):
+        with self._connection() as conn:
+            row = conn.execute("SELECT dados FROM perfis WHERE login = ?", (login,)).fetchone()
+            if row is None:
+                if not create: return new_arena_data(), None, "Sem Registro"
+                conn.execute("INSERT INTO perfis (login, dados) VALUES (?, ?)", (login, json.dumps(DEFAULT_ARENA_DATA)))
+                return new_arena_data(), login, "Novo Usuário Criado"
+        try:
+            return json.loads(row[0]), login, "Dados Carregados"
+        except ValueError:
+            return new_arena_data(), login, "Erro no JSON"
+
+    def save_profile(self, key, payload):
+        self.save_profiles({key: payload})
+
+    def save_profiles(self, payloads):
+        summaries = {key: payload_summary(payload) for key, payload in payloads.items()}
+        with self._connection() as conn:
+            conn.executemany("UPDATE perfis SET dados = ? WHERE login = ?",
+                             [(payload, key) for key, payload in payloads.items()])
+            self._save_summaries(conn, {key: s for key, s in summaries.items() if s})
+
+    @staticmethod
+    def _save_summaries(conn, summaries):
+        conn.executemany("INSERT OR REPLACE INTO ranking (login, acertos, questoes, fase, ultima, dias) VALUES (?, ?, ?, ?, ?, ?)",
+                         [(key, *summary_row(summary)) for key, summary in summaries.items()])
+
+    def apply_deltas(self, deltas):
+        """Compare-and-swap de verdade: o UPDATE só vale se a versão ainda for a que foi lida."""
+        results = {}
+        try:
+            self._apply_each(deltas, results)
+        except Exception as e:
+            # Cada registro é uma transação própria: os anteriores já estão gravados
+            if results: raise PartialWriteError(results, e) from e
+            raise
+        return results
+
+    def _apply_each(self, deltas, results):
+        missing = []
+        for key, delta in deltas.items():
+            for _ in range(CAS_RETRIES):
+                with self._connection() as conn:
+                    row = conn.execute("SELECT dados FROM perfis WHERE login = ?", (key,)).fetchone()
+                    if row is None:
+                        missing.append(key)
+                        break
+                    data, version = _apply_versioned(row[0], delta)
+                    cursor = conn.execute("UPDATE perfis SET dados = ? WHERE login = ? "
+                                          "AND COALESCE(CASE WHEN json_valid(dados) THEN json_extract(dados, '$.versao') END, 0) = ?",
+                                          (json.dumps(data), key, version))
+                    # Resumo do ranking na mesma transação do registro
+                    if cursor.rowcount: self._save_summaries(conn, {key: ranking_summary(data)})
+                if cursor.rowcount:
+                    results[key] = data
+                    break
+            else:
+                raise ConflictError(f"Registro {key} mudou {CAS_RETRIES} vezes durante a gravação")
+        # Sem registro o delta não foi gravado: falha para ele voltar à fila
+        if missing: raise MissingRecordError(missing)
+
+    def append_history(self, rows):
+        values = [tuple(row[:6]) + tuple((int(v) if str(v).strip() else None) for v in row[6:9]) for row in rows]
+        with self._connection() as conn:
+            conn.executemany("INSERT INTO historico (login, data, tipo, detalhe, resultado, tempo, acertos, total, ts) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", values)
+
+    def history_page(self, login, page=0, page_size=HISTORY_PAGE_SIZE):
+        with self._connection() as conn:
+            rows = conn.execute("SELECT login, data, tipo, detalhe, resultado, tempo, acertos, total, ts "
+                                "FROM historico WHERE login = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+                                (login, page_size + 1, page * page_size)).fetchall()
+        activities = [row_to_activity(["" if v is None else v for v in row]) for row in rows[:page_size]]
+        return activities, len(rows) > page_size
+
+    def history_columns(self, login, inicio=None, fim=None, tipo=None, detalhe=None):
+        # Filtro nulo = desligado, para a consulta continuar constante (statement em cache)
+        with self._connection() as conn:
+            rows = conn.execute("SELECT data, tipo, detalhe, resultado, tempo, acertos, total, ts FROM historico "
+                                "WHERE login = ? AND (? IS NULL OR ts >= ?) AND (? IS NULL OR ts < ?) "
+                                "AND (? IS NULL OR tipo = ?) AND (? IS NULL OR detalhe = ?) ORDER BY id DESC",
+                                (login, inicio, inicio, fim, fim, tipo, tipo, detalhe, detalhe)).fetchall()
+        columns = list(zip(*rows)) or [()] * len(HISTORY_KEYS)
+        return {k: list(values) for k, values in zip(HISTORY_KEYS, columns)}
+
+    def append_answers(self, blocks):
+        with self._connection() as conn:
+            conn.executemany("INSERT INTO respostas (bloco) VALUES (?)", [(block,) for block in blocks])
+
+    def load_answers(self):
+        with self._connection() as conn:
+            return [row[0] for row in conn.execute("SELECT bloco FROM respostas ORDER BY id")]
+
+    def ranking_summaries(self):
+        with self._connection() as conn:
+            rows = conn.execute("SELECT login, acertos, questoes, fase, ultima, dias FROM ranking").fetchall()
+        return {row[0]: row_to_summary(row[1:]) for row in rows}
+
+    def rebuild_ranking(self):
+        with self._connection() as conn:
+            rows = conn.execute("SELECT login, dados FROM perfis").fetchall()
+            summaries = {login: payload_summary(dados) for login, dados in rows}
+            self._save_summaries(conn, {key: s for key, s in summaries.items() if s})
+        return sum(1 for s in summaries.values() if s)
+
+    def load_reviews(self, login):
+        with self._connection() as conn:
+            row = conn.execute("SELECT dados FROM revisoes WHERE login = ?", (login,)).fetchone()
+        return row[0] if row else ""
+
+    def update_reviews(self, updates, merge):
+        for login, cards in updates.items():
+            with self._connection() as conn:
+                # Trava de escrita antes da leitura: outro processo não intercala entre ler e gravar
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT dados FROM revisoes WHERE login = ?", (login,)).fetchone()
+                conn.execute("INSERT OR REPLACE INTO revisoes (login, dados) VALUES (?, ?)",
+                             (login, merge(row[0] if row else "", cards)))
+
+# -----------------------------------------------------------------------------
+# CACHE COMPARTILHADO
+# -----------------------------------------------------------------------------
+class CachedStorage(ArenaStorage):
+    """Envolve outro backend com um shared_cache.SharedCache, visto por todos os processos.
+
+    Perfis e os resumos do ranking são lidos do cache; o histórico vai sempre
+    ao backend (history_columns já filtra na origem). Os registros de Usuarios
+    (com a Senha) também: quem pudesse gravar no cache plantaria um hash e
+    entraria como qualquer um.
+    Gravações de delta atualizam o perfil no cache (write-through); gravações
+    completas invalidam as entradas afetadas.
+    """
+    RANKING_TTL = 60
+
+    def __init__(self, inner, cache, ttl=600):
+        self.inner = inner
+        self.cache = cache
+        self.ttl = ttl
+        self.name = inner.name
+
+    def __getattr__(self, attr):
+        # Extras do backend (create_user, governor...) continuam acessíveis
+        if attr == "inner": raise AttributeError(attr)
+        return getattr(self.inner, attr)
+
+    def list_users(self):
+        return self.inner.list_users()
+
+    def find_user(self, login):
+        return self.inner.find_user(login)
+
+    def update_password(self, key, password_hash):
+        self.inner.update_password(key, password_hash)
+
+    def load_profile(self, login, create=True):
+        key = self.cache.get(f"linha:{login}")
+        if key is not None:
+            data = self.cache.get(f"perfil:{key}")
+            if data is not None: return data, key, "Dados Carregados (cache)"
+        data, key, status = self.inner.load_profile(login, create)
+        if key is not None and status != "Erro no JSON":
+            self.cache.set(f"linha:{login}", key, self.ttl)
+            self.cache.set(f"perfil:{key}", data, self.ttl)
+        return data, key, status
+
+    def load_profile_raw(self, login, create=True):
+        return self.inner.load_profile_raw(login, create)
+
+    def save_profile(self, key, payload):
+        self.save_profiles({key: payload})
+
+    def save_profiles(self, payloads):
+        self.inner.save_profiles(payloads)
+        self.cache.delete(*[f"perfil:{key}" for key in payloads])
+
+    def apply_deltas(self, deltas):
+        try:
+            results = self.inner.apply_deltas(deltas)
+        except PartialWriteError as e:
+            for key, data in e.saved.items():
+                self.cache.set(f"perfil:{key}", data, self.ttl)
+            raise
+        for key, data in results.items():
+            self.cache.set(f"perfil:{key}", data, self.ttl)
+        return results
+
+    def append_history(self, rows):
+        self.inner.append_history(rows)
+
+    def history_page(self, login, page=0, page_size=HISTORY_PAGE_SIZE):
+        return self.inner.history_page(login, page, page_size)
+
+    def history_columns(self, login, inicio=None, fim=None, tipo=None, detalhe=None):
+        return self.inner.history_columns(login, inicio, fim, tipo, detalhe)
+
+    def append_answers(self, blocks):
+        self.inner.append_answers(blocks)
+
+    def load_answers(self):
+        return self.inner.load_answers()
+
+    def ranking_summaries(self):
+        # TTL curto e compartilhado: uma leitura por intervalo para todos os processos
+        cached = self.cache.get("ranking")
+        if cached is None:
+            cached = self.inner.ranking_summaries()
+            self.cache.set("ranking", cached, self.RANKING_TTL)
+        return cached
+
+    def rebuild_ranking(self):
+        count = self.inner.rebuild_ranking()
+        self.cache.delete("ranking")
+        return count
+
+    def load_reviews(self, login):
+        return self.inner.load_reviews(login)
+
+    def update_reviews(self, updates, merge):
+        self.inner.update_reviews(updates, merge)
+
+    def rebuild_daily_stats(self, login):
+        return self.inner.rebuild_daily_stats(login)
+
+    def reset(self):
+        self.inner.reset()
+
+    def invalidate(self, login):
+        key = self.cache.get(f"linha:{login}")
+        keys = [f"linha:{login}"]
+        if key is not None: keys.append(f"perfil:{key}")
+        self.cache.delete(*keys)
+
+    def report(self):
+        return f"{self.inner.report()} | {self.cache.report()}"
+
+# -----------------------------------------------------------------------------
+# ESCOLHA DO BACKEND
+# -----------------------------------------------------------------------------
+BACKENDS = {}
+
+def register_backend(name, factory):
+    """Registra um backend extra, criado por factory() (ex.: o Sheets simulado do benchmark.py)."""
+    BACKENDS[name] = factory
+
+def create_storage(backend, creds_info=None, sqlite_path=SQLITE_PATH, quota=None):
+    """Instancia o backend pedido; None se o Sheets não puder ser usado (libs/credenciais ausentes).
+
+    quota = (leituras, escritas) por minuto para o QuotaGovernor do Sheets.
+    """
+    if backend in BACKENDS:
+        return BACKENDS[backend]()
+    if backend == "sqlite":
+        return SQLiteStorage(sqlite_path)
+    if not LIBS_INSTALLED or not creds_info: return None
+    return SheetsStorage(SheetsConnection(creds_info), QuotaGovernor(*quota) if quota else None)
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 4 and sys.argv[1] == "criar-usuario":
+        import getpass
+        path = sys.argv[4] if len(sys.argv) > 4 else SQLITE_PATH
+        SQLiteStorage(path).create_user(sys.argv[2], sys.argv[3], getpass.getpass("Senha: "))
+        print(f"Usuário {sys.argv[2]} criado em {path}")
+    else:
+        print(__doc__)
@@ -0,0 +1,37 @@
+import question_bank
+
+def test_sanitizer_keeps_allowed_tags_and_unwraps_the_rest():
+    clean, problems = question_bank.sanitize_html("<b>ok</b> <u>x</u><br>")
+    assert clean == "<b>ok</b> x<br>"
+    assert problems == ["tag <u> não permitida"]
+
+def test_sanitizer_strips_attributes():
+    clean, problems = question_bank.sanitize_html('<em class="x" onclick="alert(1)">a</em>')
+    assert clean == "<em>a</em>"
+    assert problems == ["atributos em <em>"]
+
+def test_sanitizer_drops_script_and_style_content():
+    assert question_bank.sanitize_html("a<script>alert(1)</script>b")[0] == "ab"
+    assert question_bank.sanitize_html("<style>p { color: red }</style>t")[0] == "t"
+
+def test_sanitizer_balances_tags():
+    clean, problems = question_bank.sanitize_html("<em>a<strong>b</em>c</strong>")
+    assert clean == "<em>a<strong>b</strong></em>c"
+    assert problems == ["<strong> não fechada", "</strong> sem abertura"]
+    assert question_bank.sanitize_html("<strong>a")[0] == "<strong>a</strong>"
+    assert question_bank.sanitize_html("x</em>y") == ("xy", ["</em> sem abertura"])
+    assert question_bank.sanitize_html("<BR/>") == ("<br>", [])
+
+def test_render_question_lifts_metadados_into_the_card_header():
+    explicacao = "<strong>Metadados:</strong> CEBRASPE (CESPE) / 2006 / CL DF<br><br><strong>Correto:</strong> sim"
+    rendered, problems = question_bank.render_question("Enunciado", explicacao)
+    assert problems == []
+    assert rendered["card_html"] == ("<div class='doctore-card'><div class='doctore-meta'>"
+                                     "CEBRASPE (CESPE) · 2006 · CL DF</div>Enunciado</div>")
+    assert rendered["feedback_html"] == "<div class='feedback-box'><strong>Correto:</strong> sim</div>"
+    assert (rendered["banca"], rendered["ano"], rendered["orgao"]) == ("CEBRASPE (CESPE)", 2006, "CL DF")
+
+def test_render_question_without_explicacao_has_no_feedback():
+    rendered, _ = question_bank.render_question("Texto", "")
+    assert rendered["card_html"] == "<div class='doctore-card'>Texto</div>"
+    assert rendered["feedback_html"] == ""
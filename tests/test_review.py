@@ -0,0 +1,24 @@
+import review
+
+DAY = review.day_number()
+
+def card(due, seen=0):
+    return review.Card(due, 1, review.INITIAL_EASE, 1, seen)
+
+def test_due_count_uses_only_due_cards_of_the_group():
+    schedule = review.ReviewSchedule({1: card(DAY - 2), 2: card(DAY), 3: card(DAY + 5), 9: card(DAY - 1)})
+    schedule.build_queue("mestre", [1, 2, 3, 4, 5])
+    assert schedule.due_count("mestre", today=DAY) == 2
+    assert schedule.due("mestre", 10, today=DAY) == [1, 2]
+    assert schedule.due_count("outro", today=DAY) == 0
+
+def test_review_updates_due_count_and_unseen():
+    schedule = review.ReviewSchedule({1: card(DAY - 2)})
+    schedule.build_queue("mestre", [1, 2, 3])
+    assert schedule.due_count("mestre", today=DAY) == 1
+    assert sorted(schedule.unseen("mestre", 10)) == [2, 3]
+    # Respondidas hoje: a 1 sai das vencidas e a 2 deixa de ser não vista
+    schedule.review(1, True, "mestre")
+    schedule.review(2, False, "mestre")
+    assert schedule.due_count("mestre", today=DAY) == 0
+    assert schedule.unseen("mestre", 10) == [3]
@@ -0,0 +1,180 @@
+import json
+from datetime import datetime
+
+import pytest
+
+import shared_cache
+import storage
+from benchmark import FakeConnection, FakeSheets, FakeWorksheet
+
+ONE_ANSWER = {"stats": {"total_questoes": 1, "total_acertos": 1, "total_erros": 0}}
+
+def test_merge_delta_sums_stats_days_and_phases():
+    target = {}
+    storage.merge_delta(target, {"stats": {"total_questoes": 2}, "stats_diarios": {"2024-05-01": {"total": 2}},
+                                 "fases_vencidas": [1], "fase_maxima_desbloqueada": 2})
+    storage.merge_delta(target, {"stats": {"total_questoes": 3, "total_erros": 1}, "stats_diarios": {"2024-05-01": {"total": 3}},
+                                 "fases_vencidas": [1, 2], "fase_maxima_desbloqueada": 1})
+    assert target == {"stats": {"total_questoes": 5, "total_erros": 1}, "stats_diarios": {"2024-05-01": {"total": 5}},
+                      "fases_vencidas": [1, 2], "fase_maxima_desbloqueada": 2}
+
+def test_answer_deltas_feed_the_period_ranking():
+    ts = int(datetime(2024, 5, 1, 10, 0).timestamp())
+    delta = {"stats": {"total_questoes": 1, "total_acertos": 1, "total_erros": 0}}
+    storage.merge_delta(delta, storage.daily_delta({"acertos": 1, "total": 1, "ts": ts}))
+    storage.merge_delta(delta, storage.daily_delta({"acertos": 0, "total": 1, "ts": ts - 60}))
+    assert delta["stats_diarios"] == {"2024-05-01": {"total": 2, "acertos": 1, "erros": 1}}
+    assert delta["ultima_atividade"] == ts
+    summary = storage.ranking_summary(storage.apply_delta(storage.new_arena_data(), delta))
+    assert summary["ultima"] == "2024-05-01"
+    assert summary["dias"] == {"2024-05-01": [1, 2]}
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    store = storage.SQLiteStorage(str(tmp_path / "arena.db"))
+    for login in ("ana", "bia", "caio"): store.load_profile(login)
+    return store
+
+def test_sqlite_cas_retries_when_the_record_changes(sqlite_store, monkeypatch):
+    real = storage._apply_versioned
+    calls = []
+
+    def racing(raw, delta):
+        # Outra aba grava entre a leitura e o UPDATE da primeira tentativa
+        if not calls: sqlite_store.save_profile("ana", json.dumps(dict(json.loads(raw), versao=7)))
+        calls.append(1)
+        return real(raw, delta)
+
+    monkeypatch.setattr(storage, "_apply_versioned", racing)
+    saved = sqlite_store.apply_deltas({"ana": ONE_ANSWER})
+    assert len(calls) == 2
+    assert saved["ana"]["versao"] == 8
+    assert sqlite_store.load_profile("ana")[0]["stats"]["total_questoes"] == 1
+
+def test_sqlite_gives_up_after_cas_retries(sqlite_store, monkeypatch):
+    monkeypatch.setattr(storage, "_apply_versioned", lambda raw, delta: (json.loads(raw), -1))
+    with pytest.raises(storage.ConflictError):
+        sqlite_store.apply_deltas({"ana": ONE_ANSWER})
+
+def test_sqlite_partial_failure_reports_saved_keys(sqlite_store, monkeypatch):
+    real = storage._apply_versioned
+
+    def failing(raw, delta):
+        if delta.get("falha"): raise RuntimeError("disco cheio")
+        return real(raw, delta)
+
+    monkeypatch.setattr(storage, "_apply_versioned", failing)
+    with pytest.raises(storage.PartialWriteError) as error:
+        sqlite_store.apply_deltas({"ana": ONE_ANSWER, "bia": dict(ONE_ANSWER, falha=True), "caio": ONE_ANSWER})
+    assert set(error.value.saved) == {"ana"}
+    monkeypatch.setattr(storage, "_apply_versioned", real)
+    # Só o que não foi gravado é reaplicado: cada registro recebe a resposta uma única vez
+    sqlite_store.apply_deltas({"bia": ONE_ANSWER, "caio": ONE_ANSWER})
+    assert [sqlite_store.load_profile(login)[0]["stats"]["total_questoes"] for login in ("ana", "bia", "caio")] == [1, 1, 1]
+
+def test_sqlite_missing_record_is_not_reported_as_saved(sqlite_store):
+    with pytest.raises(storage.PartialWriteError) as error:
+        sqlite_store.apply_deltas({"ana": ONE_ANSWER, "zeca": ONE_ANSWER, "bia": ONE_ANSWER})
+    assert set(error.value.saved) == {"ana", "bia"}
+    assert error.value.cause.missing == ["zeca"]
+    with pytest.raises(storage.MissingRecordError):
+        sqlite_store.apply_deltas({"zeca": ONE_ANSWER})
+
+def test_sqlite_failure_before_any_write_is_not_partial(sqlite_store, monkeypatch):
+    monkeypatch.setattr(storage, "_apply_versioned", lambda raw, delta: (_ for _ in ()).throw(RuntimeError("x")))
+    with pytest.raises(RuntimeError):
+        sqlite_store.apply_deltas({"ana": ONE_ANSWER})
+
+def test_sheets_partial_batch_failure_requeues_only_unsaved_rows(monkeypatch):
+    fake = FakeSheets(latency_ms=0, jitter_ms=0)
+    rows = [["Login", "", "Dados"]] + [[f"u{i}", "", json.dumps(storage.new_arena_data())] for i in range(250)]
+    fake.sheets["sheet1"] = FakeWorksheet(fake, "sheet1", rows, 3)
+    store = storage.SheetsStorage(FakeConnection(fake))
+    sheet = fake.sheets["sheet1"]
+    real_update, updates = sheet.batch_update, []
+
+    def flaky(data, **kwargs):
+        updates.append(1)
+        if len(updates) == 2: raise RuntimeError("conexão caiu")
+        return real_update(data, **kwargs)
+
+    monkeypatch.setattr(sheet, "batch_update", flaky)
+    deltas = {row: ONE_ANSWER for row in range(2, 252)}
+    with pytest.raises(storage.PartialWriteError) as error:
+        store.apply_deltas(deltas)
+    assert sorted(error.value.saved) == list(range(2, 2 + storage.BATCH_ROWS))
+    store.apply_deltas({row: d for row, d in deltas.items() if row not in error.value.saved})
+    totals = {json.loads(sheet.rows[row - 1][2])["stats"]["total_questoes"] for row in deltas}
+    assert totals == {1}
+
+def test_sheets_reapplies_a_delta_overwritten_by_another_process(monkeypatch):
+    fake = FakeSheets(latency_ms=0, jitter_ms=0)
+    fake.sheets["sheet1"] = FakeWorksheet(fake, "sheet1", [["Login", "", "Dados"], ["ana", "", json.dumps(storage.new_arena_data())]], 3)
+    store = storage.SheetsStorage(FakeConnection(fake))
+    sheet = fake.sheets["sheet1"]
+    real_update, stale = sheet.batch_update, []
+
+    def racing(data, **kwargs):
+        real_update(data, **kwargs)
+        # Outro processo leu o registro antes desta gravação e grava por cima, com o delta dele
+        if not stale:
+            other = storage.apply_delta(storage.new_arena_data(), {"stats": {"total_questoes": 5}})
+            stale.append(1)
+            real_update([{"range": "C2", "values": [[json.dumps(other)]]}])
+
+    monkeypatch.setattr(sheet, "batch_update", racing)
+    saved = store.apply_deltas({2: ONE_ANSWER})
+    stored = json.loads(sheet.rows[1][2])
+    assert stored["stats"]["total_questoes"] == 6
+    assert saved[2]["escritas"][-1] in stored["escritas"]
+
+def test_row_runs_groups_consecutive_rows():
+    assert storage.row_runs([2, 3, 4, 7, 9, 10]) == [(2, 4), (7, 7), (9, 10)]
+    assert storage.row_runs([]) == []
+
+def test_sheets_history_columns_reads_only_the_login_rows():
+    fake = FakeSheets(latency_ms=0, jitter_ms=0)
+    history = [storage.HISTORY_HEADER]
+    for i in range(300):
+        login = "ana" if i in (0, 1, 2, 150, 299) else f"outro{i}"
+        history.append([str(v) for v in storage.history_row(login, {"tipo": "Batalha", "resultado": "Vitória (8/10)", "ts": 1_700_000_000 + i})])
+    fake.sheets[storage.HISTORY_SHEET] = FakeWorksheet(fake, storage.HISTORY_SHEET, history, len(storage.HISTORY_HEADER))
+    store = storage.SheetsStorage(FakeConnection(fake))
+    sheet = fake.sheets[storage.HISTORY_SHEET]
+    requested = []
+    real_batch_get = sheet.batch_get
+    sheet.batch_get = lambda ranges: requested.extend(ranges) or real_batch_get(ranges)
+    columns = store.history_columns("ana")
+    assert requested == ["A2:I4", "A152:I152", "A301:I301"]
+    assert [int(ts) for ts in columns["ts"]] == [1_700_000_299, 1_700_000_150, 1_700_000_002, 1_700_000_001, 1_700_000_000]
+
+def test_sheets_rebuild_daily_stats_reads_row_runs_in_chunks(monkeypatch):
+    monkeypatch.setattr(storage, "BATCH_ROWS", 2)
+    fake = FakeSheets(latency_ms=0, jitter_ms=0)
+    history = [storage.HISTORY_HEADER]
+    for i in range(10):
+        login = "ana" if i in (0, 1, 4, 7) else f"outro{i}"
+        # Linhas antigas: só o texto do resultado, sem Acertos/Total/Timestamp
+        history.append([login, "01/05/2024 10:00", "Batalha", "vs X", "Vitória (8/10)", "30 min", "", "", ""])
+    fake.sheets[storage.HISTORY_SHEET] = FakeWorksheet(fake, storage.HISTORY_SHEET, history, len(storage.HISTORY_HEADER))
+    store = storage.SheetsStorage(FakeConnection(fake))
+    sheet = fake.sheets[storage.HISTORY_SHEET]
+    requested = []
+    real_batch_get = sheet.batch_get
+    sheet.batch_get = lambda ranges: requested.append(list(ranges)) or real_batch_get(ranges)
+    daily = store.rebuild_daily_stats("ana")
+    assert requested == [["A1:I1", "A2:I3"], ["A6:I6", "A9:I9"]]
+    assert daily == {"2024-05-01": {"total": 40, "acertos": 32, "erros": 8}}
+    assert [sheet.rows[r - 1][6:8] for r in (2, 3, 6, 9)] == [["8", "10"]] * 4
+
+def test_cached_storage_never_caches_credentials(tmp_path):
+    inner = storage.SQLiteStorage(str(tmp_path / "arena.db"))
+    inner.create_user("ana", "Ana", "arena123")
+    cache = shared_cache.SQLiteCache(str(tmp_path / "cache.db"))
+    store = storage.CachedStorage(inner, cache)
+    key, record = store.find_user("ana")
+    assert [k for k, _ in store.list_users()] == ["ana"]
+    assert cache._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] == 0
+    # A troca de senha vale na hora: nada antigo fica no cache
+    store.update_password(key, "novo-hash")
+    assert store.find_user("ana")[1]["Senha"] == "novo-hash"